@@ -55,12 +55,66 @@ def parse_args():
 
     # Parameters for TGN
 
+    parser.add_argument('--append', action='store_true',
+                        help="Only project snapshots that are new relative to the cached visualization and append them "
+                             "to the cache instead of rebuilding it")
+
     parser.add_argument('--background_color', type=str, default="white",
                         help="white")
 
+    parser.add_argument('--background_delivery', type=str, choices=["asset", "callback"], default="asset",
+                        help="How the Dash app sends the background of the initial figure. `asset`: a content-hashed "
+                             "static file that browsers and proxies cache. `callback`: inside the callback response")
+
+    parser.add_argument('--background_job_size', type=int, default=200,
+                        help="Selections and projection changes of the Dash app that build more trajectories than this "
+                             "run as background jobs with a progress bar, see `--background_jobs`")
+
+    parser.add_argument('--background_jobs', type=str, choices=["diskcache", "off"], default="off",
+                        help="How the Dash app runs slow interactions. `off`: inside the callbacks. `diskcache`: as "
+                             "background jobs in separate processes, which are canceled when the selection changes")
+
+    parser.add_argument('--background_mode', type=str, choices=["scatter", "raster"], default="scatter",
+                        help="How the Dash apps draw the background nodes. `scatter`: one marker per node. `raster`: "
+                             "a density image rendered on the server for the current viewport, for large graphs")
+
+    parser.add_argument('--background_point_budget', type=int, default=20000,
+                        help="With `--background_mode scatter`, backgrounds with more nodes than this are subsampled "
+                             "to at most this many nodes in the current viewport. Zooming in reveals more nodes")
+
     parser.add_argument('--batch_size', type=int, default=256,
                         help="the batch size for models")
 
+    parser.add_argument('--category_percentile', type=float, default=75.,
+                        help="With `--category_rendering aggregate`, the band around the median path of a category "
+                             "covers this percentile of the members' distances to the median")
+    parser.add_argument('--category_rendering', type=str, choices=["aggregate", "traces"], default="traces",
+                        help="How the Dash apps draw a category selected in the dropdown. `traces`: one trajectory "
+                             "per member. `aggregate`: the median path and a percentile band of its members, which "
+                             "keeps large categories responsive")
+    parser.add_argument('--category_samples', type=int, default=0,
+                        help="With `--category_rendering aggregate`, also draw the trajectories of this many "
+                             "representative members of a category, i.e. those closest to its median path")
+
+    parser.add_argument('--clientside_max_bytes', type=int, default=2000000,
+                        help="With `--trajectory_toggling clientside`, fall back to the server callbacks if the "
+                             "trajectories shipped to the browser would take more than this many bytes")
+
+    parser.add_argument('--coherence_expansion', type=int, default=5,
+                        help="Number of extra candidate neighbors kept from each full top-k search when "
+                             "--coherence_threshold is set")
+    parser.add_argument('--coherence_threshold', type=float, default=0.,
+                        help="Reuse the nearest neighbors of nodes whose embeddings drifted less than this threshold "
+                             "since their last full top-k search. 0 disables the reuse")
+
+    parser.add_argument('--concurrency_limits', type=str, default="add-trajectory:4,projection:2,viewport:8",
+                        help="Maximum number of callbacks of each operation that the Dash app runs at once, as "
+                             "`operation:limit` pairs. Further requests wait in a queue, see `--queue_size`")
+
+    parser.add_argument('--coordinate_decimals', type=int, default=None,
+                        help="Round the coordinates that the Dash app sends to the browser to this many decimals, so "
+                             "that compressed responses are smaller. Default: no rounding")
+
     parser.add_argument('--comment', type=str, default="",
                         help="Comment for each run. Useful for identifying each run on Tensorboard")
     parser.add_argument('--data_dir', type=str, default="data",
@@ -94,6 +148,13 @@ def parse_args():
                         default=EXCLUDE_POSITIVE,
                         help="Negative sampling method for evaluation dataset")
 
+    parser.add_argument('--fragment_cache_dir', type=str, default=None,
+                        help="Directory in which the Dash app also keeps cached figure fragments, so that they survive "
+                             "restarts and are shared by worker processes. Default: memory only")
+    parser.add_argument('--fragment_cache_size', type=int, default=1024,
+                        help="Maximum number of figure fragments (initial figure, trajectories) that the Dash app "
+                             "keeps in memory for reuse across sessions. 0 disables the cache")
+
     parser.add_argument('--gpus', type=str, default="0",
                         help="GPUs to use. If using 4 GPUs, type 0,1,2,3")
 
@@ -105,10 +166,17 @@ def parse_args():
     parser.add_argument('--in_channels', type=int, default=None,
                         help="Index of the end dataset.")
 
+    parser.add_argument('--job_cache_dir', type=str, default=None,
+                        help="Directory of the progress and results of background jobs, and of the figure fragments "
+                             "they build unless `--fragment_cache_dir` is set. Default: `Jobs_*` in the visual dir")
+
     parser.add_argument('--lr', type=float, default=1e-3, help="Learning rate")
     parser.add_argument('--max_seq_length', type=int, default=128,
                         help="Maximum sequence length")
 
+    parser.add_argument('--merge_trajectories_above', type=int, default=0,
+                        help="If positive, the Dash app draws the trajectories as a single WebGL trace, colored per "
+                             "point, when more than this many nodes are displayed. 0 draws one trace per node")
     parser.add_argument('--model', type=str, default=None, help="Model name")
 
 
@@ -125,6 +193,17 @@ def parse_args():
                         help="Which epoch of the pretrained embeddings (Node2Vec, GCN ...) to use")
     parser.add_argument('--output_dir', type=str, default="outputs")
 
+    parser.add_argument('--projection_engine', type=str, choices=["knn", "mlp"], default="knn",
+                        help="How to project nodes onto the reference frame. `knn`: interpolated mean of the nearest "
+                             "anchor nodes. `mlp`: an MLP fit on the reference snapshot. Each engine has its own "
+                             "cache, which the Dash apps open with the same option")
+
+    parser.add_argument('--queue_size', type=int, default=16,
+                        help="Maximum number of requests of an operation that wait for a slot, see "
+                             "`--concurrency_limits`. Further requests get a \"server busy\" message")
+    parser.add_argument('--queue_timeout', type=float, default=10.,
+                        help="Seconds that a request waits for a slot before it gets a \"server busy\" message")
+
     parser.add_argument('--resample_every', type=int, default=1,
                         help="Number of epochs to resample training dataset.")
 
@@ -143,14 +222,29 @@ def parse_args():
     parser.add_argument('--num_snapshots', type=int, default=10,
                         help="Number of snapshots to use for Continuous-Time Dynamic Graph models, such as TGN")
 
+    parser.add_argument('--log_level', type=str, choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="INFO",
+                        help="Logging level. DEBUG also logs every action of the Dash apps and the duration of each "
+                             "startup stage")
+
     parser.add_argument('--port', type=int, default=8050)
 
+    parser.add_argument('--response_compression', type=str, choices=["br", "gzip", "none"], default="none",
+                        help="Compression of the responses of the Dash app. `none`: uncompressed. `br`: brotli, or "
+                             "gzip for browsers that do not accept brotli. `br` and `gzip` need flask-compress")
+
     parser.add_argument('--save_embeds_every', type=int, default=10,
                         help="How many epochs to save embeddings for visualization?")
 
     parser.add_argument('--save_model_every', type=int, default=-1,
                         help="How many epochs to save the model weights?")
     parser.add_argument('--seed', type=int, default=42, help="Random seed.")
+    parser.add_argument('--session_dir', type=str, default=None,
+                        help="With `--session_store diskcache`, directory of the sessions. Default: `Sessions_*` in "
+                             "the visual dir")
+    parser.add_argument('--session_store', type=str, choices=["memory", "diskcache"], default="memory",
+                        help="Where the Dash app keeps what each browser session displays. `memory`: in the server "
+                             "process, so every request of a session must reach the same process. `diskcache`: in a "
+                             "cache on disk that the worker processes of a WSGI server share. Default of `wsgi.py`")
     parser.add_argument('--step_size', type=int, default=50, help="step size")
     parser.add_argument('--task', type=str, default="", help="task_name")
     parser.add_argument('--test_size', type=float, default=0.1, help="Size of the test set. Note that running "
@@ -165,6 +259,21 @@ def parse_args():
     parser.add_argument('--snapshot_interval', type=int, default=1,
                         help="Time interval (in days) between each snapshot. Default: 1 month. Interactions happening within this time interval will be grouped into one snapshot.")
 
+    parser.add_argument('--snapshot_prefetch', type=int, default=1,
+                        help="Number of snapshots on each side of the time slider of the multi-dataset servers whose "
+                             "points are built in advance")
+
+    parser.add_argument('--trajectory_tolerance', type=float, default=0.,
+                        help="If positive, the Dash app simplifies trajectories so that deviations below this many "
+                             "pixels are not drawn, and zooming in reveals more points. 1 is a good start for long "
+                             "trajectories. 0 draws every point")
+
+    parser.add_argument('--trajectory_toggling', type=str, choices=["server", "clientside"], default="server",
+                        help="Where the Dash app adds, removes and recolors trajectories. `clientside`: the "
+                             "trajectories of all nodes are shipped to the browser once, and selecting nodes or "
+                             "toggling background labels needs no server round-trip. Categories are then drawn as the "
+                             "trajectories of their members")
+
     parser.add_argument('--transform_input', action='store_true',
                         help="Whether to transform the input to a new embedding space. This field is automatically set to True if in_channels does not equal to embedding_dim")
 
@@ -183,8 +292,14 @@ def parse_args():
                                  const.MDS], default=const.TSNE,
                         help="Visualization model to use")
 
+    parser.add_argument('--warm_up', action='store_true',
+                        help="Open the port of the Dash app before loading the data, and show the progress of the "
+                             "startup until the app is ready. Health checks are served at /healthz and /readyz")
+
     args = parser.parse_args()
 
+    logging.getLogger().setLevel(args.log_level)
+
     if args.in_channels is None:
         args.in_channels = args.embedding_dim
     args.num_nearest_neighbors = eval(args.num_nearest_neighbors)
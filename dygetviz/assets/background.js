@@ -0,0 +1,46 @@
+/* Background traces loaded from a static file. See `visualization/static_assets.py` */
+
+if (!window.dash_clientside) {window.dash_clientside = {};}
+
+(function () {
+    // One request per file, shared by every figure update. The browser's HTTP cache keeps the file across visits
+    const requests = {};
+
+    function fetchBackground(url) {
+        if (!(url in requests)) {
+            requests[url] = fetch(url).then(response => {
+                if (!response.ok) {
+                    delete requests[url];
+                    throw new Error(`Failed to load ${url}: ${response.status}`);
+                }
+                return response.json();
+            });
+        }
+        return requests[url];
+    }
+
+    window.dash_clientside.dygetviz = Object.assign(window.dash_clientside.dygetviz || {}, {
+        /* Fill the placeholders of the background traces, which the server sends without their points */
+        loadBackground: async function (figure, asset) {
+            if (!asset || !figure || !figure.data) {
+                return window.dash_clientside.no_update;
+            }
+
+            const placeholders = figure.data.slice(0, asset.num_traces);
+            if (!placeholders.some(trace => trace.x === undefined)) {
+                return window.dash_clientside.no_update;
+            }
+
+            const background = await fetchBackground(asset.url);
+
+            // Fields that the server set on a placeholder, e.g. the mode, take precedence
+            const data = figure.data.slice();
+            placeholders.forEach((trace, idx) => {
+                if (trace.x === undefined) {
+                    data[idx] = Object.assign({}, background.data[idx], trace);
+                }
+            });
+            return Object.assign({}, figure, {data: data});
+        },
+    });
+})();
@@ -0,0 +1,116 @@
+/* Clientside trajectory toggling. See `visualization/clientside.py` */
+
+if (!window.dash_clientside) {window.dash_clientside = {};}
+
+(function () {
+    const decoded = {bdata: null, array: null};
+    const BYTES_PER_ELEMENT = {f4: 4, f8: 8, i4: 4, u4: 4, i2: 2, u2: 2, i1: 1, u1: 1};
+
+    function decodeTypedArray(encoded) {
+        const bytes = Uint8Array.from(atob(encoded.bdata), c => c.charCodeAt(0));
+        return new Float32Array(bytes.buffer);
+    }
+
+    function getCoordinates(coordinates) {
+        // The coordinates only change with the projection controls, so they are decoded once per update
+        if (decoded.bdata !== coordinates.x.bdata) {
+            decoded.bdata = coordinates.x.bdata;
+            decoded.array = {x: decodeTypedArray(coordinates.x), y: decodeTypedArray(coordinates.y)};
+        }
+        return decoded.array;
+    }
+
+    /* Map each selected node or category to its color, like `get_selected_trajectories` on the server */
+    function getNodeColors(values, store) {
+        const node2color = new Map();
+        let colorIdx = 0;
+
+        for (const value of values || []) {
+            if (value in store.templates) {
+                if (!node2color.has(value)) {
+                    const palette = store.palettes[store.node2palette[value]];
+                    node2color.set(value, palette[colorIdx % palette.length]);
+                    colorIdx += 1;
+                }
+            } else if (value in store.categories) {
+                const palette = store.palettes[store.category2palette[value]];
+                for (const [node, idxNode] of store.categories[value]) {
+                    if (!node2color.has(node)) {
+                        node2color.set(node, palette[idxNode % palette.length]);
+                    }
+                }
+            }
+        }
+        return node2color;
+    }
+
+    window.dash_clientside.dygetviz = Object.assign(window.dash_clientside.dygetviz || {}, {
+        updateTrajectories: function (values, coordinates, store, figure) {
+            if (!store || !coordinates || !figure || !figure.data) {
+                return window.dash_clientside.no_update;
+            }
+
+            const background = figure.data.slice(0, store.num_background_traces);
+
+            // Displayed trajectories keep their colors
+            const displayedColors = {};
+            for (const trace of figure.data.slice(store.num_background_traces)) {
+                displayedColors[trace.meta] = trace.line.color;
+            }
+
+            const {x, y} = getCoordinates(coordinates);
+            const node2idx = {};
+            coordinates.nodes.forEach((node, idx) => {node2idx[node] = idx;});
+
+            const trajectories = [];
+            for (const [node, color] of getNodeColors(values, store)) {
+                const template = store.templates[node];
+                const idx = node2idx[node];
+                const start = coordinates.offsets[idx], end = coordinates.offsets[idx + 1];
+
+                trajectories.push(Object.assign({}, template, {
+                    x: x.subarray(start, end),
+                    y: y.subarray(start, end),
+                    line: Object.assign({}, template.line, {color: displayedColors[node] || color}),
+                    meta: node,
+                }));
+            }
+
+            return Object.assign({}, figure, {data: background.concat(trajectories)});
+        },
+
+        /* Clicking a background point toggles its label, like the `dygetviz` action on the server */
+        toggleLabel: function (clickData, store, figure) {
+            const labels = store && store.background_labels;
+            if (!labels || !clickData || !figure || !figure.data) {
+                return window.dash_clientside.no_update;
+            }
+
+            const point = clickData.points[0];
+            if (point.curveNumber !== 0) {
+                return window.dash_clientside.no_update;
+            }
+
+            const trace = figure.data[0];
+            // Coordinates sent as typed arrays are still encoded in the figure
+            const numPoints = trace.x.bdata !== undefined ? atob(trace.x.bdata).length / BYTES_PER_ELEMENT[trace.x.dtype] :
+                trace.x.length;
+            const defaultText = idx => labels.text[idx] || '';
+            const text = trace.text ? Array.from(trace.text) : Array.from({length: numPoints}, (_, idx) => defaultText(idx));
+            const hovertext = trace.hovertext ? trace.hovertext[point.pointIndex] : '';
+
+            const idx = point.pointIndex;
+            const toggled = text[idx] !== defaultText(idx);
+            text[idx] = toggled ? defaultText(idx) : (defaultText(idx) ? '' : hovertext);
+
+            let mode = labels.mode;
+            if (mode === 'markers+text' && !text.some(label => label)) {
+                mode = 'markers';
+            }
+
+            const data = figure.data.slice();
+            data[0] = Object.assign({}, trace, {text: text, mode: mode});
+            return Object.assign({}, figure, {data: data});
+        },
+    });
+})();
@@ -2,23 +2,21 @@
 Plot using [Dash](https://dash.plotly.com/)
 """
 
+import logging
 import os.path as osp
 
 import dash
 import dash_bootstrap_components as dbc
+import flask
 import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
-import plotly.io as pio
 from dash import dcc, html, no_update
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
 # import dash_mantine_components as dmc  # Disabled due to upload panel being disabled
 # from dash_iconify import DashIconify  # Disabled due to upload panel being disabled
-from tqdm import tqdm
 
 # import dash_ag_grid as dag  # Disabled due to upload panel being disabled
 
-import const
 import const
 from arguments import parse_args
 from components.dygetviz_components import graph_with_loading, dataset_description, interpretation_of_plot, \
@@ -26,18 +24,61 @@ from components.dygetviz_components import graph_with_loading, dataset_descripti
 # from components.upload import upload_panel  # Disabled due to upload panel being disabled
 from data.dataloader import load_data
 from utils.utils_data import get_modified_time_of_file, read_markdown_into_html
-from utils.utils_misc import project_setup
+from utils.utils_misc import get_visualization_name, project_setup
 from utils.utils_visual import get_colors
-
-print("Loading data...")
+from visualization.admission import Busy, SingleFlight, WorkQueue, parse_limits
+from visualization.aggregation import CategoryAggregator, get_category_points, stack_member_coords
+from visualization.clientside import get_payload_size, pack_coordinates
+from visualization.data_plane import SharedArrays
+from visualization.fragment_cache import FragmentCache, get_fragment_key, pack_trace
+from visualization.jobs import get_job_manager, run_tasks
+from visualization.projection import NeighborIndex
+from visualization.lod import ViewportIndex
+from visualization.metrics import CACHE_ENTRIES, CACHE_LOOKUPS, REGISTRY, StartupTimer, end_parse, \
+    install_metrics, timed_callback
+from visualization.node_search import NodeSearchIndex
+from visualization.payload import enable_compression, encode_trace
+from visualization.raster import BackgroundRaster, get_relayout_viewport
+from visualization.session_state import SessionStore
+from visualization.simplification import TrajectorySimplifier
+from visualization.static_assets import StaticAssets, get_placeholders
+from visualization.trace_store import TraceTemplates, load_trace_store, make_trace_template
+from visualization.trajectory_cache import get_cache_paths, load_cache_manifest, resolve_visualization_name, \
+    thin_display_name
+from visualization.warmup import WarmUp
+
+logger = logging.getLogger(__name__)
 
 args = parse_args()
 project_setup()
-print("Start the app ...")
+
+# Durations of the stages of the startup are served at `/metrics`
+startup = StartupTimer(args.dataset_name)
+
+# Stages of the startup, in order, for the progress shown while warming up
+STARTUP_STAGES = ["app", "load_data", "cache_read", "neighbor_index", "nodes", "options", "layout", "render_state"]
+
+startup.stage("app", "Start the app ...")
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP, "../dygetviz/assets/base.css",
                                                 "../dygetviz/assets/clinical-analytics.css"])
 
+# Callback latencies and response sizes are served at `/metrics`. Installed first, so that sizes are measured after
+# compression
+install_metrics(app.server)
+
+# Callback and layout responses are compressed with brotli or gzip, whichever the browser accepts
+if args.response_compression != "none":
+    enable_compression(app.server, ["br", "gzip"] if args.response_compression == "br" else ["gzip"])
+
+# Liveness and readiness at `/healthz` and `/readyz`. With `--warm_up`, the port opens now and serves the progress of
+# the startup until the app below is loaded, see `visualization/warmup.py`
+warm_up = WarmUp(startup, STARTUP_STAGES)
+warm_up.install(app.server)
+
+if args.warm_up and __name__ == "__main__":
+    warm_up.start(args.port)
 
+startup.stage("load_data", "Loading data ...")
 data = load_data(args.dataset_name, False)
 
 annotation: dict = data.get("annotation", {})
@@ -56,59 +97,66 @@ plot_anomaly_labels: bool = data["plot_anomaly_labels"]
 projected_nodes: np.ndarray = data["projected_nodes"]
 reference_nodes: np.ndarray = data["reference_nodes"]
 snapshot_names: list = data["snapshot_names"]
-z = data["z"]
+
+# The Dash app never reads the embeddings. Releasing them keeps them out of the memory of every worker process
+data.pop("z", None)
 
 args = parse_args()
 
 idx2node = {idx: node for node, idx in node2idx.items()}
 
-visualization_name = f"{args.dataset_name}_{args.model}_{args.visualization_model}_perplex{perplexity}_nn{data['num_nearest_neighbors'][0]}_interpolation{interpolation}_snapshot{idx_reference_snapshot}"
+visualization_name = get_visualization_name(args.dataset_name, args.model, args.visualization_model, perplexity,
+                                            data['num_nearest_neighbors'][0], interpolation, idx_reference_snapshot,
+                                            args.projection_engine)
+visualization_name = resolve_visualization_name(args.visual_dir, visualization_name)
 
-print("Reading visualization cache...")
+startup.stage("cache_read", "Reading visualization cache ...")
 
 path = osp.join(args.visual_dir, f"Trajectory_{visualization_name}.json")
 
 get_modified_time_of_file(path)
 
 if args.debug:
-    fig_cached = node2trace = None
+    node2trace = None
+
+else:
+    # Only the header and the background layers are read here. Trajectories are read when they are added
+    node2trace = load_trace_store(args.visual_dir, visualization_name)
+
+    # Arrays that the callbacks read are memory-mapped, so that the worker processes of a WSGI server share them
+    cache_paths = get_cache_paths(args.visual_dir, visualization_name)
+    shared_arrays = SharedArrays(cache_paths["shared"], cache_paths["traces"])
+
+    node_presence = data["node_presence"] = shared_arrays.attach("node_presence", lambda: data["node_presence"])
+    background_x = shared_arrays.attach("background_x",
+                                        lambda: np.asarray(node2trace['background'].x, dtype=np.float64))
+    background_y = shared_arrays.attach("background_y",
+                                        lambda: np.asarray(node2trace['background'].y, dtype=np.float64))
+
+startup.stage("neighbor_index")
+
+# The precomputed neighbor index lets users change nn and interpolation without rebuilding the cache
+manifest = None if args.debug else load_cache_manifest(args.visual_dir, visualization_name)
 
+if manifest is not None and manifest.get("projection_engine", "knn") == "knn":
+    logger.info("Reading neighbor index ...")
+    neighbor_index = NeighborIndex.load_shared(cache_paths["neighbors"], np.load(cache_paths["anchors"]),
+                                               shared_arrays)
+    projected_node2idx = {node: idx for idx, node in enumerate(manifest["projected_nodes"])}
 
 else:
-    try:
-        fig_cached = pio.read_json(path)
-    except ValueError as e:
-        if 'heatmapgl' in str(e):
-            print("⚠️  Found deprecated 'heatmapgl' in cached file. Attempting to fix...")
-            # Read the JSON file and replace heatmapgl with heatmap
-            with open(path, 'r') as f:
-                json_content = f.read()
-            
-            # Replace deprecated property
-            fixed_content = json_content.replace('"heatmapgl"', '"heatmap"')
-            
-            # Try to parse again with the fixed content
-            import json
-            fixed_data = json.loads(fixed_content)
-            fig_cached = pio.from_json(json.dumps(fixed_data))
-            
-            # Optionally save the fixed version
-            print("✓ Successfully fixed deprecated 'heatmapgl' property")
-        else:
-            raise e
-
-    node2trace = {
-        trace['name'].split(' ')[0]: trace for trace in fig_cached.data
-    }
+    neighbor_index = None
+    projected_node2idx = {}
 
-print("Getting candidate nodes ...")
+startup.stage("nodes", "Getting candidate nodes ...")
 
 if args.dataset_name in ["DGraphFin"]:
     nodes = [n for n, l in node2label.items() if l in [0, 1]]
 else:
     nodes = list(node2idx.keys())
 
-options = []
+node_set = set(nodes)
+
 
 # If there are multiple node categories, we can display a distinct color family for each type of nodes
 # NOTE: We specifically require that the first color palette is Blue (for normal nodes) and the second one is Red (for anomalous nodes)
@@ -126,76 +174,48 @@ else:
         0: get_colors(10, "Spectral")
     }
 
-print("Adding categories to the dropdown menu ...")
-options_categories = []
-
-for label, nodes_li in label2node.items():
-    options_categories.append({
-        "label": html.Span(
-            [
-                "✨",
-                html.Span(label, style={
-                    'font-size': 15,
-                    'padding-left': 10
-                }),
-            ], style={
-                'align-items': 'center',
-                'justify-content': 'center'
-            }
-        ),
-        "value": label,
-    })
-
-print("Adding nodes to the dropdown menu ...")
+startup.stage("options", "Indexing nodes for the dropdown menu ...")
 
-options_nodes = []
+projected_node_set = set(projected_nodes)
+node2name = {}
 
 for node, idx in node2idx.items():
     # Only add trajectories of projected or reference nodes
-    if not node in projected_nodes:
+    if node not in projected_node_set:
         continue
 
     # For the DGraphFin dataset, the background nodes (label = 2 or 3) are not meaningful due to insufficient information. So we do not visualize them
     if display_node_type and args.dataset_name in [
         "DGraphFin"] and node2label.get(node) is None:
-        print(f"\tIgnoring node {node} ...")
+        logger.debug(f"Ignoring node {node} ...")
         continue
 
     if display_node_type:
         label = node2label[node]
 
-        name = f"{node} ({label2name[label]})"
+        node2name[node] = f"{node} ({label2name[label]})"
 
     else:
-        name = node
-
-    options_nodes.append({
-        "label": html.Span(
-            [
-                html.Span(name, style={
-                    'font-size': 15,
-                    'padding-left': 10
-                }),
-            ], style={
-                'align-items': 'center',
-                'justify-content': 'center'
-            }
-        ),
-        "value": node,  # Get a random node as the default value.
-    })
+        node2name[node] = node
 
-options = options_categories + options_nodes
+# The dropdown only holds the categories and a few nodes. Other nodes are found by `update_node_options`
+node_search = NodeSearchIndex(list(label2node.keys()), node2name)
+options = node_search.get_initial_options()
 
-print("Reading plotly button explanations ...")
+startup.stage("layout", "Reading plotly button explanations ...")
 with open('dygetviz/static/Plotly_Button_Explanations.html', 'r') as file:
     plotly_button_explanations = file.read()
 
 app.title = f"DyGetViz | {args.dataset_name}"
 
 
-print("Reading dataset explanations ...")
+logger.info("Reading dataset explanations ...")
 dataset_descriptions = read_markdown_into_html(osp.join(args.data_dir, args.dataset_name, "data_descriptions.md"))
 
+# With `--trajectory_toggling clientside`, the trajectories of all nodes are shipped with the page. Filled in below
+trajectory_store = dcc.Store(id='trajectory-store')
+trajectory_coordinates_store = dcc.Store(id='trajectory-coordinates-store')
+background_asset_store = dcc.Store(id='background-asset-store')
 
 app.layout = html.Div(
     id="app-container",
@@ -259,6 +279,48 @@ app.layout = html.Div(
                     className="text-center mb-4"
                     # margin-bottom to give some space below the row
                 ),
+
+                # Projection controls. Disabled if the cache has no neighbor index
+                dbc.Row(
+                    [
+                        dbc.Col(
+                            [
+                                dbc.Label("Nearest neighbors:", className="form-label mb-2",
+                                          style={'font-weight': 'bold', 'color': '#34495e'}),
+                                dcc.Slider(
+                                    id='nn-slider',
+                                    min=1,
+                                    max=neighbor_index.max_nn if neighbor_index is not None else num_nearest_neighbors[0],
+                                    step=1,
+                                    value=num_nearest_neighbors[0],
+                                    marks=None,
+                                    tooltip={"placement": "bottom", "always_visible": True},
+                                    disabled=neighbor_index is None,
+                                ),
+                            ],
+                            width=6,
+                        ),
+                        dbc.Col(
+                            [
+                                dbc.Label("Interpolation:", className="form-label mb-2",
+                                          style={'font-weight': 'bold', 'color': '#34495e'}),
+                                dcc.Slider(
+                                    id='interpolation-slider',
+                                    min=0.,
+                                    max=1.,
+                                    step=0.05,
+                                    value=interpolation,
+                                    marks=None,
+                                    tooltip={"placement": "bottom", "always_visible": True},
+                                    disabled=neighbor_index is None,
+                                ),
+                            ],
+                            width=6,
+                        ),
+                    ],
+                    className="mb-4"
+                ),
+
                 dbc.Row([
 
 
@@ -295,11 +357,29 @@ app.layout = html.Div(
                 # The main dashboard
                 graph_with_loading(),
 
+                # Progress of a background job, only displayed while one runs
+                dbc.Progress(id='job-progress', value=0, max=1, striped=True, animated=True,
+                             style={'display': 'none'}),
+
+                # Shown when a request is rejected because the server is busy
+                dbc.Alert(id='busy-alert', color='warning', is_open=False, dismissable=True, duration=5000),
+
+                # A request that is too slow for a regular callback, and the request once its job is done
+                dcc.Store(id='job-request-store'),
+                dcc.Store(id='job-result-store'),
+
                 # Store the nodes in `trajectory_names`
                 dcc.Store(
                     id='trajectory-names-store',
                     data=[]),
 
+                # The view state of a session is kept on the server. Only the session id is stored here
+                dcc.Store(id='session-id-store'),
+
+                trajectory_store,
+                trajectory_coordinates_store,
+                background_asset_store,
+
                 dcc.Store(id="dataset-store", storage_type="local"),
                 html.Div(
                     [
@@ -368,63 +448,190 @@ def generate_node_profile(profile: pd.DataFrame):
     profile['description'] = profile.apply(f, axis=1)
     return profile
 
-def convert_scatter_to_scattergl(scatter):
-    line = { "color": scatter.line.color, "dash": scatter.line.dash, "shape": scatter.line.shape, "width": scatter.line.width }
-    marker = { "size": scatter.marker.size, 'symbol': scatter.marker.symbol}
-    
-    # Fix mode for background traces - if mode is 'markers+text' but no text, use just 'markers'
-    mode = scatter.mode
-    if mode == 'markers+text' and (not scatter.text or all(not t for t in scatter.text)):
-        mode = 'markers'
-    
-    # Try using regular Scatter instead of Scattergl for better compatibility
-    return go.Scatter(x=scatter.x, y=scatter.y, xaxis=scatter.xaxis, yaxis=scatter.yaxis, customdata=scatter.customdata,
-                        hovertemplate=scatter.hovertemplate, hovertext=scatter.hovertext, legendgroup=scatter.legendgroup,
-                        line= line, marker=marker, mode=mode, name=scatter.name, showlegend=scatter.showlegend,
-                          selectedpoints=scatter.selectedpoints, text=scatter.text, textposition=scatter.textposition)
-
-# List to keep track of current annotations
-annotations = []
+def set_live_coordinates(trace, node, nn, interpolation_value):
+    """Recompute the coordinates of a trajectory from the neighbor index for the current projection controls."""
+    if neighbor_index is None or node not in projected_node2idx:
+        return trace
+
+    presence = node_presence[:neighbor_index.num_snapshots, node2idx[node]]
+    idx_snapshots = presence.nonzero()[0]
+    coords = neighbor_index.get_coords(nn, interpolation_value, [projected_node2idx[node]])[presence, 0]
+
+    trace['x'] = coords[:, 0]
+    trace['y'] = coords[:, 1]
+    trace['hovertext'] = [f"Node: {node} | Snapshot: {snapshot_names[idx_snapshot]}" for idx_snapshot in
+                          idx_snapshots]
+    trace['text'] = [thin_display_name(f"{node} ({snapshot_names[idx_snapshot]})", i, len(snapshot_names)) for
+                     i, idx_snapshot in enumerate(idx_snapshots)]
+
+    # The metadata of a node does not change over time
+    customdata = trace['customdata'] if 'customdata' in trace else None
+    if customdata is not None and len(customdata) > 0:
+        trace['customdata'] = [customdata[0]] * len(idx_snapshots)
+
+    return trace
+
+
+startup.stage("render_state", "Preparing the background and trajectory templates ...")
+
+# What each browser session displays. With `--session_store diskcache`, the worker processes of a WSGI server share
+# the sessions, so that any worker can serve any request
+sessions = SessionStore(cache_dir=args.session_dir or osp.join(args.visual_dir, f"Sessions_{visualization_name}")) if (
+        args.session_store == "diskcache") else SessionStore()
+
+if node2trace is not None:
+    # Default labels of the background points. Clicks toggle them per session, so these are never modified
+    background_text = tuple(node2trace['background'].text or [''] * len(node2trace['background'].x))
+    background_hovertext = tuple(node2trace['background'].hovertext or [''] * len(background_text))
+    num_background_labels = sum(bool(text) for text in background_text)
+
+# With `--background_mode raster`, the background is an image rendered for the current viewport instead of a trace
+background_raster = BackgroundRaster(background_x, background_y) if (
+        node2trace is not None and args.background_mode == "raster") else None
+
+# With `--background_mode scatter`, large backgrounds are subsampled to the points in the current viewport
+background_lod = ViewportIndex(background_x, background_y, budget=args.background_point_budget) if (
+        node2trace is not None and background_raster is None and
+        len(background_x) > args.background_point_budget) else None
+
+if background_lod is not None:
+    # Per-point fields of the background, as arrays that can be indexed by the points in a viewport
+    background_points = {
+        'x': background_x,
+        'y': background_y,
+        'hovertext': np.asarray(background_hovertext, dtype=object),
+    }
+    if node2trace['background'].customdata is not None:
+        background_points['customdata'] = np.asarray(node2trace['background'].customdata, dtype=object)
+
+# Long trajectories are simplified for the current viewport. Deviations below `--trajectory_tolerance` pixels are
+# not drawn
+trajectory_simplifier = TrajectorySimplifier(pixel_tolerance=args.trajectory_tolerance) if (
+        node2trace is not None and args.trajectory_tolerance > 0) else None
+
+if node2trace is not None:
+    # The viewport when the axes are not zoomed
+    background_extent = ((float(background_x.min()), float(background_x.max())),
+                         (float(background_y.min()), float(background_y.max())))
+
+# With `--category_rendering aggregate`, a category is drawn as the median path and a percentile band of its members
+category_aggregator = CategoryAggregator(args.category_percentile, args.category_samples) if (
+        node2trace is not None and args.category_rendering == "aggregate") else None
+
+if category_aggregator is not None:
+    label2members = {label: [node for node in members if node in node2trace] for label, members in
+                     label2node.items()}
+
+# Name of the trace that merges the trajectories of many nodes, in `ViewState.figure_traces`
+MERGED_TRACE = "__merged_trajectories__"
+
+if node2trace is not None:
+    # Ready-to-send traces, styled once. Callbacks only assemble them and never build plotly objects
+    background_templates = {
+        'background': make_trace_template(node2trace.read('background'),
+                                          marker=dict(size=8, opacity=0.8, color='#B2B2B2')),
+    }
+    if plot_anomaly_labels:
+        background_templates['anomaly'] = make_trace_template(node2trace.read('anomaly'))
 
+    trajectory_templates = TraceTemplates(node2trace, line=dict(width=3), marker=dict(size=10, opacity=0.9))
 
-@app.callback(
-    Output('dygetviz', 'figure'),
-    Output('trajectory-names-store', 'data'),
-    Input('add-trajectory', 'value'),
-    Input('dygetviz', 'clickData'),
-    State('dygetviz', 'figure'),
-    # Input('update-color-button', 'n_clicks'),
-    # State('node-selector', 'value'),
-    # State('color-picker', 'value'),
+# Slow selections and projection changes run as background jobs, see `visualization/jobs.py`. The jobs hand the
+# fragments they build to the server through the on-disk tier of the fragment cache
+use_background_jobs = (node2trace is not None and args.background_jobs != "off" and args.fragment_cache_size > 0 and
+                       args.trajectory_toggling != "clientside" and not args.debug)
+job_cache_dir = args.job_cache_dir or osp.join(args.visual_dir, f"Jobs_{visualization_name}")
+fragment_cache_dir = args.fragment_cache_dir or (osp.join(job_cache_dir, "fragments") if use_background_jobs else None)
 
-)
-def update_graph(trajectory_names, clickData, current_figure,
-                 # do_update_color, selected_node, selected_color,
-                 ):
-    """
+# Figure fragments that are identical across sessions: the initial figure, and the points of a trajectory or of the
+# merged trace for given projection controls. Fragments that depend on the viewport are not cached
+fragment_cache = FragmentCache(args.fragment_cache_size, fragment_cache_dir) if (
+        node2trace is not None and args.fragment_cache_size > 0) else None
 
-    :param trajectory_names: Names of the trajectories to be added into the visualization
-    :param background_node_names:
-    :param do_update_color:
-    :param selected_node:
-    :param selected_color:
-    :param current_figure: figure from the previous update
-    :return:
-    """
+if fragment_cache is not None:
+    # Everything besides the key of a fragment that its content depends on. A rebuilt cache changes the mtime
+    fragment_cache_version = (visualization_name, osp.getmtime(cache_paths["traces"]), args.background_mode,
+                              args.background_point_budget, args.trajectory_tolerance, args.category_rendering,
+                              args.category_percentile, args.category_samples)
 
-    global annotations
+# Results of the jobs are cached for an hour, keyed by their request and the version of the fragments
+job_manager = get_job_manager(job_cache_dir, cache_by=[lambda: get_fragment_key(*fragment_cache_version)],
+                              expire=3600) if use_background_jobs else None
 
-    if not trajectory_names:
-        trajectory_names = []
+# Data that is identical for every user, e.g. the background, served as content-hashed files that browsers cache
+static_assets = StaticAssets()
+static_assets.install(app.server, app.config.routes_pathname_prefix)
 
-    ctx = dash.callback_context
-    action_name = ctx.triggered[0]['prop_id'].split('.')[0]
-    print(f"[Action]\t{action_name}")
 
-    # This is the template for displaying metadata when hovering over a node
+@app.server.route("/_dygetviz/cache-stats")
+def get_cache_stats():
+    """Hit and miss counts of the figure fragment cache, as JSON."""
+    stats = {"fragments": fragment_cache.get_stats() if fragment_cache is not None else None}
+    if background_raster is not None:
+        stats["raster"] = {"size": len(background_raster._cache), "hits": background_raster.hits,
+                           "misses": background_raster.misses}
+
+    return flask.jsonify(stats)
 
-    fig = go.Figure()
-    fig.update_layout(
+
+def collect_cache_metrics():
+    """Copy the hit and miss counts of the caches to `/metrics`."""
+    if fragment_cache is not None:
+        stats = fragment_cache.get_stats()
+        CACHE_ENTRIES.set(stats["size"], cache="fragments")
+        for result in ["hits", "disk_hits", "misses"]:
+            CACHE_LOOKUPS.set(stats[result], cache="fragments", result=result)
+
+    if background_raster is not None:
+        CACHE_ENTRIES.set(len(background_raster._cache), cache="raster")
+        CACHE_LOOKUPS.set(background_raster.hits, cache="raster", result="hits")
+        CACHE_LOOKUPS.set(background_raster.misses, cache="raster", result="misses")
+
+
+REGISTRY.add_collector(collect_cache_metrics)
+
+
+# Sessions that need the same fragment at once, e.g. when several users select the same category, share one build
+fragment_flights = SingleFlight("fragments")
+
+# Callbacks of each operation that run at once. Further requests wait, and are rejected when the queue is full
+work_queue = WorkQueue(parse_limits(args.concurrency_limits), args.queue_size, args.queue_timeout)
+
+
+def get_fragment(build, *key):
+    """The fragment identified by `key`, from `fragment_cache` if enabled. `build` makes the fragment on a miss."""
+    if fragment_cache is None:
+        return build()
+
+    key = get_fragment_key(*fragment_cache_version, *key)
+    return fragment_flights.do(key, lambda: fragment_cache.get(key, build))
+
+
+def show_busy(error):
+    """Error handler of the callbacks: tell the user that a request was rejected by `work_queue`, and send nothing."""
+    if not isinstance(error, Busy):
+        raise error
+
+    dash.set_props('busy-alert', {'is_open': True, 'children': str(error)})
+
+
+def is_fragment_cached(*key) -> bool:
+    """Whether the fragment identified by `key` is in `fragment_cache`, in memory or on disk."""
+    return fragment_cache is not None and fragment_cache.contains(get_fragment_key(*fragment_cache_version, *key))
+
+
+# Names of the traces at the start of every figure, before the trajectories
+background_layer_names = (["background"] if background_raster is None else []) + (
+    ["anomaly"] if plot_anomaly_labels else [])
+
+
+def encode(fields: dict) -> dict:
+    """Per-point fields or a trace, with numeric fields as typed arrays, ready to be sent to the browser."""
+    return encode_trace(fields, args.coordinate_decimals)
+
+
+def get_figure_layout() -> dict:
+    return dict(
         plot_bgcolor='white',
         xaxis=dict(
             showgrid=False,
@@ -440,237 +647,710 @@ def update_graph(trajectory_names, clickData, current_figure,
         )
     )
 
-    if current_figure is None:
-        figure_name2trace = {}
 
+def get_background_text(toggled_labels: set, point_indices=None) -> list:
+    r"""Labels displayed on the background for a session.
 
-    else:
-        figure_name2trace = {trace['name']: trace for idx, trace in
-                             enumerate(current_figure['data'])}
-
-    def add_background():
-
-        # Always add background trace
-        trace = node2trace['background']
-        print(f"Background trace type: {type(trace)}")
-        # Convert to Scattergl for consistency
-        trace = convert_scatter_to_scattergl(trace)
-        print(f"Background trace after conversion: {type(trace)}")
-        # Ensure marker is visible
-        if hasattr(trace, 'marker'):
-            trace.marker.update(
-                size=8,  # Increase size
-                opacity=0.8,  # Increase opacity
-                color='#B2B2B2'  # Ensure color is set
-            )
-        print(f"Adding background trace with mode: {trace.mode}")
-        # trace.hovertemplate = HOVERTEMPLATE
-        fig.add_trace(trace)
-
-        # Add anomaly labels if enabled
-        if plot_anomaly_labels:
-            trace = node2trace['anomaly']
-            # Convert to Scattergl for consistency
-            trace = convert_scatter_to_scattergl(trace)
-            fig.add_trace(trace)
-
-    def add_traces():
-        for name, trace in figure_name2trace.items():
-            if name not in {"background"}:
-                fig.add_trace(trace)
-
-    if action_name == '':
-        """Launch the app for the first time. 
-        
-        Only add the background nodes
-        """
+    Clicking a point toggles its label between its default (usually empty) text and its hover text.
 
-        # In debug mode, we do not manipulate the figure. Only test the upload module
-        if not args.debug:
-            add_background()
-            print(f"Initial figure has {len(fig.data)} traces:")
-            for i, trace in enumerate(fig.data):
-                print(f"  Trace {i}: {trace.name} (type: {type(trace)}, mode: {trace.mode})")
-        return fig, trajectory_names
-
-    elif action_name == 'add-trajectory':
-        fig = go.Figure()
-        fig.update_layout(
-            plot_bgcolor='white',
-            xaxis=dict(
-                showgrid=False,
-                zeroline=False,
-                showline=False,
-                showticklabels=False
-            ),
-            yaxis=dict(
-                showgrid=False,
-                zeroline=False,
-                showline=False,
-                showticklabels=False
-            )
-        )
+    Args:
+        toggled_labels (set): Indices of the points whose label the session toggled
+        point_indices (list): Only return the labels of these points. Default: all points
+    """
 
-        # Always add background first
-        add_background()
+    if point_indices is None:
+        point_indices = range(len(background_text))
 
-        # Get existing trajectories (excluding background)
-        existing_trajectories = {name: trace for name, trace in figure_name2trace.items() 
-                               if name != "background"}
+    return [(background_hovertext[idx] if not background_text[idx] else '') if idx in toggled_labels else
+            background_text[idx] for idx in point_indices]
 
-        print(f"Existing trajectories: {list(existing_trajectories.keys())}")
 
-        # Add existing trajectories
-        for name, trace in existing_trajectories.items():
-            print(f"Adding existing trajectory: {name}")
-            fig.add_trace(trace)
+def get_background_mode(toggled_labels: set) -> str:
+    mode = node2trace['background'].mode
 
-        # Add new trajectories
-        new_trajectory_names = list(
-            set(trajectory_names) - set(existing_trajectories.keys()))
+    if mode != 'markers+text':
+        return mode
 
-        print(f"New search values:\t{new_trajectory_names}")
-        
-        # Track color index separately for new trajectories
-        color_idx = len(existing_trajectories)
-        
-        for value in trajectory_names:
-            if args.dataset_name == "DGraphFin" and node2label.get(
-                    value) is None:
-                print(f"Node {value} is a background node, so we ignore it.")
-                continue
-
-            # Skip if already added (existing trajectory)
-            if value in existing_trajectories:
-                continue
-
-            # Add a new node
-            if value in nodes:
-                print(f"Processing node: {value}")
-                trace = node2trace[value]
-                print(f"Original trace type: {type(trace)}")
-                trace = convert_scatter_to_scattergl(trace)
-                print(f"Converted trace type: {type(trace)}")
-                
+    # Number of labels that are displayed after applying the toggles
+    num_labels = num_background_labels + sum(-1 if background_text[idx] else 1 for idx in toggled_labels)
+    return mode if num_labels > 0 else 'markers'
+
+
+def get_background_points(toggled_labels: set, point_indices) -> dict:
+    """Per-point fields of the background trace, restricted to the points displayed in the viewport."""
+    fields = {name: values[point_indices] for name, values in background_points.items()}
+    fields['text'] = get_background_text(toggled_labels, point_indices)
+    return fields
+
+
+def get_background_traces(toggled_labels: set, point_indices=None) -> dict:
+    """The traces that are displayed on every figure, keyed by their name in `node2trace`.
+
+    `point_indices` are the background points to display, or None to display all of them.
+    """
+
+    traces = {}
+
+    # Always add background trace, unless the background is rasterized
+    if background_raster is None:
+        fields = {'mode': get_background_mode(toggled_labels)}
+        if point_indices is not None:
+            fields.update(get_background_points(toggled_labels, point_indices))
+        elif toggled_labels:
+            fields['text'] = get_background_text(toggled_labels)
+
+        traces['background'] = {**background_templates['background'], **fields}
+
+    # Add anomaly labels if enabled
+    if plot_anomaly_labels:
+        traces['anomaly'] = background_templates['anomaly']
+
+    return traces
+
+
+def get_category_aggregate(label, nn, interpolation_value) -> dict:
+    """The median path and percentile band of the members of a category, for the current projection controls."""
+
+    def get_coords():
+        members = label2members[label]
+        presence = node_presence[:, [node2idx[node] for node in members]].astype(bool)
+
+        # All members are recomputed at once from the neighbor index
+        if neighbor_index is not None and all(node in projected_node2idx for node in members):
+            presence = presence[:neighbor_index.num_snapshots]
+            coords = neighbor_index.get_coords(nn, interpolation_value,
+                                               [projected_node2idx[node] for node in members]).astype(np.float64)
+            coords[~presence] = np.nan
+            return coords
+
+        return stack_member_coords([node2trace.read(node) for node in members], presence)
+
+    # Cached as a fragment, so that an aggregate built by a background job is not rebuilt by the server
+    return get_fragment(lambda: category_aggregator.get((label, nn, interpolation_value), get_coords), "aggregate",
+                        label, nn, interpolation_value)
+
+
+def get_category_trace(name, color, nn, interpolation_value):
+    """One of the traces of a category, styled for display. `name` is (label, "band") or (label, "median")."""
+    label, part = name
+    template = category_aggregator.get_templates(label2name.get(label, label), color)[part]
+    return encode({**template, **get_trajectory_points(name, nn, interpolation_value, (None, None))})
+
+
+def get_trajectory_points(node, nn, interpolation_value, viewport) -> dict:
+    r"""Per-point fields of the trajectory of `node` for the current projection controls.
+
+    The trajectory is simplified for `viewport`, i.e. (x_range, y_range). The first and last points and the point at
+    the reference snapshot are always kept.
+    """
+    # The traces of an aggregated category are not simplified
+    if isinstance(node, tuple):
+        label, part = node
+        return get_fragment(lambda: get_category_points(get_category_aggregate(label, nn, interpolation_value),
+                                                        label2name.get(label, label), snapshot_names)[part],
+                            "category", label, part, nn, interpolation_value)
+
+    if viewport == (None, None):
+        return get_fragment(lambda: pack_trace(build_trajectory_points(node, nn, interpolation_value, viewport)),
+                            "trajectory", node, nn, interpolation_value)
+
+    return build_trajectory_points(node, nn, interpolation_value, viewport)
+
+
+def build_trajectory_points(node, nn, interpolation_value, viewport) -> dict:
+    """Per-point fields of the trajectory of a single node, see `get_trajectory_points`."""
+    trace = set_live_coordinates(dict(trajectory_templates[node]), node, nn, interpolation_value)
+    fields = {field: trace.get(field) for field in ['x', 'y', 'text', 'hovertext', 'customdata']}
+
+    if trajectory_simplifier is None or fields['x'] is None:
+        return fields
+
+    presence = node_presence[:, node2idx[node]]
+    keep = [int(presence[:idx_reference_snapshot].sum())] if presence[idx_reference_snapshot] else []
+
+    x_range, y_range = viewport
+    indices = trajectory_simplifier.select((node, nn, interpolation_value), fields['x'], fields['y'],
+                                           x_range or background_extent[0], y_range or background_extent[1], keep)
+
+    return {field: None if values is None else
+            np.asarray(values)[indices] if field in ['x', 'y'] else np.asarray(values, dtype=object)[indices].tolist()
+            for field, values in fields.items()}
+
+
+def get_trajectory_trace(node, color, nn, interpolation_value, viewport):
+    """Trajectory of `node` for the current projection controls and viewport, styled for display."""
+    if isinstance(node, tuple):
+        return get_category_trace(node, color, nn, interpolation_value)
+
+    template = trajectory_templates[node]
+    trace = {**template, **get_trajectory_points(node, nn, interpolation_value, viewport),
+             'line': {**template['line'], 'color': color}}
+
+    # For trajectory traces, use 'markers+lines' instead of 'markers+lines+text' if text is empty
+    if 'text' in trace.get('mode', '') and not any(trace['text'] or []):
+        trace['mode'] = trace['mode'].replace('+text', '')
+
+    return encode(trace)
+
+
+def get_merged_nodes(node2color) -> list:
+    r"""The nodes whose trajectories are merged into a single trace: all of them above `--merge_trajectories_above`.
+
+    The nodes are sorted, so that the same selection gives the same merged trace regardless of the order of selection.
+    """
+    nodes = sorted((name for name in node2color if not isinstance(name, tuple)), key=str)
+    return nodes if 0 < args.merge_trajectories_above < len(nodes) else []
+
+
+def get_merged_points(nodes, node2color, nn, interpolation_value, viewport) -> dict:
+    r"""Per-point fields of the trace that merges the trajectories of `nodes`.
+
+    The trajectories are concatenated, separated by a NaN point so that they are not connected. Each point carries the
+    id of its node in `customdata` and the color of its node in `marker.color`.
+    """
+    if viewport == (None, None):
+        return get_fragment(lambda: build_merged_points(nodes, node2color, nn, interpolation_value, viewport),
+                            "merged", [(node, node2color[node]) for node in nodes], nn, interpolation_value)
+
+    return build_merged_points(nodes, node2color, nn, interpolation_value, viewport)
+
+
+def build_merged_points(nodes, node2color, nn, interpolation_value, viewport) -> dict:
+    """Per-point fields of the merged trace, see `get_merged_points`."""
+    x, y, hovertext, customdata, colors = [], [], [], [], []
+
+    for node in nodes:
+        points = get_trajectory_points(node, nn, interpolation_value, viewport)
+        num_points = len(points['x'])
+
+        x += [np.asarray(points['x'], dtype=np.float64), [np.nan]]
+        y += [np.asarray(points['y'], dtype=np.float64), [np.nan]]
+        hovertext += list(points['hovertext'] or [str(node)] * num_points) + ['']
+        customdata += [node] * (num_points + 1)
+        colors += [node2color[node]] * (num_points + 1)
+
+    return dict(x=np.concatenate(x) if x else [], y=np.concatenate(y) if y else [], hovertext=hovertext,
+                customdata=customdata, marker=dict(color=colors, size=6, opacity=0.9))
+
+
+def get_merged_trace(nodes, node2color, nn, interpolation_value, viewport):
+    """A single WebGL trace that draws the trajectories of `nodes`, so that the browser handles one trace."""
+    return dict(type='scattergl', **encode(get_merged_points(nodes, node2color, nn, interpolation_value, viewport)),
+                mode='lines+markers', line=dict(color='rgba(120, 120, 120, 0.5)', width=2),
+                name=f"{len(nodes)} trajectories", connectgaps=False, hovertemplate='<b>%{hovertext}</b><extra></extra>')
+
+
+def get_displayed_points(state, name, nn, interpolation_value, viewport) -> dict:
+    """Per-point fields of a trace displayed in a session, i.e. a trajectory or the merged trace."""
+    if name == MERGED_TRACE:
+        return get_merged_points(get_merged_nodes(state.node2color), state.node2color, nn, interpolation_value,
+                                 viewport)
+
+    return get_trajectory_points(name, nn, interpolation_value, viewport)
+
+
+def get_initial_fragment() -> dict:
+    """The background of the initial figure, which every session starts with, and the background points it shows."""
+
+    def build():
+        point_indices = background_lod.query() if background_lod is not None else None
+        return dict(background_indices=point_indices,
+                    data=[encode(trace) for trace in get_background_traces(set(), point_indices).values()],
+                    image=background_raster.render() if background_raster is not None else None)
+
+    return get_fragment(build, "initial")
+
+
+# With `--background_delivery asset`, the background of the initial figure is a static file, which browsers and
+# proxies cache across visits. Callbacks only send placeholders for its traces
+background_asset = None
+if node2trace is not None and background_layer_names and args.background_delivery == "asset" and not args.debug:
+    initial_background = get_initial_fragment()['data']
+    background_asset = dict(url=app.get_relative_path(static_assets.publish("background", dict(data=initial_background))),
+                            num_traces=len(initial_background))
+    background_asset_store.data = background_asset
+
+
+def get_selected_trajectories(trajectory_names, nn, interpolation_value) -> dict:
+    """Map each trajectory selected in the dropdown (single nodes or whole categories) to its color.
+
+    With `--category_rendering aggregate`, a category maps to its (label, "band") and (label, "median") traces, and its
+    representative members.
+    """
+    node2color = {}
+    color_idx = 0
+
+    for value in trajectory_names:
+        if args.dataset_name == "DGraphFin" and node2label.get(value) is None and value not in label2node:
+            logger.debug(f"Node {value} is a background node, so we ignore it.")
+            continue
+
+        # Add a new node
+        if value in node_set:
+            if value not in node2color and value in node2trace:
                 if display_node_type:
                     label = node2label[value]
-                    color = label2colors[label][color_idx % len(label2colors[label])]
-                    trace.line['color'] = color
-                    print(f"\tAdd node:\t{value} ({label2name[label]}) with color {color}")
+                    node2color[value] = label2colors[label][color_idx % len(label2colors[label])]
 
                 else:
-                    color = label2colors[0][color_idx % len(label2colors[0])]
-                    trace.line['color'] = color
-                    print(f"\tAdd node:\t{value} with color {color}")
-                
-                # Ensure line properties are set for trajectory visibility
-                if hasattr(trace, 'line'):
-                    trace.line.update(
-                        width=3,  # Make line thicker
-                    )
-                    print(f"Set line properties: width={trace.line.width}")
-
-                # Ensure the trace has proper mode and marker settings
-                if hasattr(trace, 'mode'):
-                    # For trajectory traces, use 'markers+lines' instead of 'markers+lines+text' if text is empty
-                    if 'text' in trace.mode and (not trace.text or all(not t for t in trace.text)):
-                        trace.mode = trace.mode.replace('+text', '')
-                        print(f"Fixed mode from 'markers+lines+text' to '{trace.mode}' due to empty text")
-                
-                # Ensure marker is visible
-                if hasattr(trace, 'marker'):
-                    trace.marker.update(
-                        size=10,  # Larger size for visibility
-                        opacity=0.9,  # Higher opacity
-                    )
-                
-                print(f"Adding trace with mode: {trace.mode}, color: {trace.line.color}")
-                print(f"Trace data points: {len(trace.x)} x-coordinates, {len(trace.y)} y-coordinates")
-                print(f"Line properties: {trace.line}")
-                print(f"Marker properties: {trace.marker}")
-                fig.add_trace(trace)
+                    node2color[value] = label2colors[0][color_idx % len(label2colors[0])]
+
                 color_idx += 1
 
-            # Add a category
-            elif value in label2node:
-                print(f"\tAdd label:\t{value}")
-
-                for idx_node, node in enumerate(label2node[value]):
-                    trace = node2trace[node]
-                    # Haven't tested this since I believe category is broken (after adding only a subset of node trajectories)
-                    trace = convert_scatter_to_scattergl(trace)
-                    trace.line['color'] = label2colors[value][idx_node % 12]
-                    fig.add_trace(trace)
-
-        # Debug: print final figure traces
-        print(f"Final figure has {len(fig.data)} traces:")
-        for i, trace in enumerate(fig.data):
-            print(f"  Trace {i}: {trace.name} (type: {type(trace)}, mode: {trace.mode})")
-            if hasattr(trace, 'x') and trace.x:
-                print(f"    X range: {min(trace.x)} to {max(trace.x)}")
-                print(f"    Y range: {min(trace.y)} to {max(trace.y)}")
-        
-        # Debug: print figure layout
-        print(f"Figure layout: {fig.layout}")
+        # Add the aggregate of a category
+        elif value in label2node and category_aggregator is not None:
+            palette = label2colors.get(value, label2colors[0])
+            node2color[(value, "band")] = node2color[(value, "median")] = palette[0]
+
+            members = label2members[value]
+            for idx_node, idx_member in enumerate(
+                    get_category_aggregate(value, nn, interpolation_value)['representatives']):
+                if members[idx_member] not in node2color:
+                    node2color[members[idx_member]] = palette[(idx_node + 1) % len(palette)]
+
+        # Add a category
+        elif value in label2node:
+            palette = label2colors.get(value, label2colors[0])
+            for idx_node, node in enumerate(label2node[value]):
+                if node not in node2color and node in node2trace:
+                    node2color[node] = palette[idx_node % len(palette)]
 
+    return node2color
 
-    # elif action_name == 'update-color-button':
-    #     # Update the color of the selected trajectory
-    #     del figure_name2trace['background']
-    #     figure_name2trace[selected_node].line['color'] = selected_color['hex']
-    #
-    #     add_traces()
 
-    elif action_name == 'dygetviz':
-        # Add annotations when user clicks on a node
+def get_fragment_builders(trajectory_names, nn, interpolation_value) -> list:
+    r"""The uncached fragments that displaying a selection at the default viewport needs.
+
+    Returns:
+        list: (number of trajectories, build) for each fragment, where `build` is called without arguments and puts the
+            fragment into `fragment_cache`
+    """
+    builders = []
+    nodes = set()
+
+    def add_node(node):
+        if node in nodes or node not in node2trace or is_fragment_cached("trajectory", node, nn, interpolation_value):
+            return
+
+        nodes.add(node)
+        builders.append((1, lambda: get_trajectory_points(node, nn, interpolation_value, (None, None))))
+
+    def build_category(label):
+        # The representatives are only known once the aggregate is built
+        aggregate = get_category_aggregate(label, nn, interpolation_value)
+        for part in ["band", "median"]:
+            get_trajectory_points((label, part), nn, interpolation_value, (None, None))
+        for idx_member in aggregate['representatives']:
+            get_trajectory_points(label2members[label][idx_member], nn, interpolation_value, (None, None))
+
+    for value in trajectory_names:
+        if value in node_set:
+            add_node(value)
+
+        elif value in label2node and category_aggregator is not None:
+            if not is_fragment_cached("aggregate", value, nn, interpolation_value):
+                builders.append((len(label2members[value]), lambda label=value: build_category(label)))
+
+        elif value in label2node:
+            for node in label2node[value]:
+                add_node(node)
+
+    return builders
+
+
+def get_clientside_store() -> dict:
+    """Styling and labels of the trajectories of all nodes, and how the browser colors them, for `trajectory-store`."""
+    templates = {}
+    for node in clientside_nodes:
+        trace = set_live_coordinates(dict(trajectory_templates[node]), node, num_nearest_neighbors[0], interpolation)
+        template = {field: values for field, values in trace.items() if field not in ['x', 'y']}
+
+        if 'text' in template.get('mode', '') and not any(template.get('text') or []):
+            template['mode'] = template['mode'].replace('+text', '')
+
+        templates[node] = template
+
+    # Labels of the background can only be toggled in the browser if the figure holds all background points
+    background_labels = dict(mode=node2trace['background'].mode, text={
+        idx: text for idx, text in enumerate(background_text) if text}) if clientside_labels else None
+
+    return dict(
+        num_background_traces=len(background_layer_names),
+        templates=templates,
+        palettes={str(label): list(colors) for label, colors in label2colors.items()},
+        node2palette={node: str(node2label[node]) if display_node_type else '0' for node in templates},
+        categories={str(label): [[node, idx_node] for idx_node, node in enumerate(members) if node in templates] for
+                    label, members in label2node.items()},
+        category2palette={str(label): str(label) if label in label2colors else '0' for label in label2node},
+        background_labels=background_labels,
+    )
+
+
+def get_clientside_coordinates(nn, interpolation_value) -> dict:
+    """Coordinates of the trajectories of all nodes for the projection controls, for `trajectory-coordinates-store`."""
+    node2coords = {}
+    for node in clientside_nodes:
+        trace = set_live_coordinates(dict(trajectory_templates[node]), node, nn, interpolation_value)
+        node2coords[node] = (trace['x'], trace['y'])
+
+    return pack_coordinates(node2coords)
+
+
+# With `--trajectory_toggling clientside`, trajectories are added, removed and recolored in the browser, see
+# `assets/trajectories.js`. Above `--clientside_max_bytes`, this falls back to the server callbacks
+clientside_toggling = node2trace is not None and args.trajectory_toggling == "clientside"
+clientside_labels = clientside_toggling and background_raster is None and background_lod is None
+
+if clientside_toggling:
+    clientside_nodes = [node for node in nodes if node in node2trace]
+
+    # Each point takes 8 bytes of coordinates, about 11 in base64, before any labels
+    payload_size = 11 * int(node_presence[:, [node2idx[node] for node in clientside_nodes]].sum())
+    if payload_size <= args.clientside_max_bytes:
+        trajectory_store.data = get_clientside_store()
+        trajectory_coordinates_store.data = get_clientside_coordinates(num_nearest_neighbors[0], interpolation)
+        payload_size = get_payload_size(trajectory_store.data) + get_payload_size(trajectory_coordinates_store.data)
+
+    if payload_size > args.clientside_max_bytes:
+        logger.warning(f"The trajectories of {len(clientside_nodes)} nodes take {payload_size} bytes, more than "
+                       f"--clientside_max_bytes. Trajectories are added on the server instead")
+        trajectory_store.data = trajectory_coordinates_store.data = None
+        clientside_toggling = clientside_labels = False
+
+    else:
+        logger.info(f"Shipping the trajectories of {len(clientside_nodes)} nodes to the browser ({payload_size} bytes)")
+
+
+@app.callback(
+    Output('add-trajectory', 'options'),
+    Input('add-trajectory', 'search_value'),
+    State('add-trajectory', 'value'),
+    prevent_initial_call=True,
+)
+@timed_callback("search")
+def update_node_options(search_value, selected_values):
+    """Look up the nodes and categories that match what the user typed in the dropdown."""
+    if not search_value:
+        return no_update
+
+    return node_search.get_search_options(search_value, selected_values)
+
+
+@app.callback(
+    Output('dygetviz', 'figure'),
+    Output('trajectory-names-store', 'data'),
+    Output('session-id-store', 'data'),
+    # In clientside mode, the browser handles these without calling the server
+    (State if clientside_toggling else Input)('add-trajectory', 'value'),
+    (State if clientside_labels else Input)('dygetviz', 'clickData'),
+    Input('nn-slider', 'value'),
+    Input('interpolation-slider', 'value'),
+    State('session-id-store', 'data'),
+    Input('job-result-store', 'data'),
+    # Input('update-color-button', 'n_clicks'),
+    # State('node-selector', 'value'),
+    # State('color-picker', 'value'),
+    on_error=show_busy,
+)
+@timed_callback()
+def update_graph(trajectory_names, clickData, nn, interpolation_value, session_id, job,
+                 # do_update_color, selected_node, selected_color,
+                 ):
+    """Update the figure in place.
+
+    Except on the first call, only the difference to the displayed figure is sent to the browser as a `dash.Patch`:
+    added trajectories are appended, removed ones are deleted, and the background is never re-sent.
+
+    What the session currently displays is kept on the server in `sessions`. The browser only sends its session id.
+
+    :param trajectory_names: Names of the trajectories to be added into the visualization
+    :param clickData: The point that the user clicked on
+    :param nn: Number of nearest neighbors used to place the trajectories
+    :param interpolation_value: Weight of each node's own anchor coordinate
+    :param session_id: Id of the browser session
+    :param job: A request whose fragments a background job built
+    :return:
+    """
+
+    if not trajectory_names:
+        trajectory_names = []
+
+    ctx = dash.callback_context
+    action_name = ctx.triggered[0]['prop_id'].split('.')[0]
+    logger.debug(f"[Action]\t{action_name}")
+
+    state = sessions.get(session_id) if session_id else None
+    end_parse("initial" if action_name == '' or state is None else "click" if action_name == 'dygetviz' else action_name)
+
+    if action_name == '' or state is None:
+        """Launch the app for the first time. 
+        
+        Only add the background nodes. Sessions that the server does not know (e.g. after a restart) also start over
         """
-                Upon clicking a node, if the node's display is on, we turn the display off. If its display is off, we turn the display on.
-                """
 
-        if clickData:
-            del figure_name2trace['background']
-            point_data = clickData['points'][0]
-            point_idx = point_data['pointIndex']
+        session_id = session_id or sessions.new_session_id()
+        state = sessions.create(session_id)
 
-            displayed_text = np.array(
-                list(node2trace['background']['text'])).astype(
-                '<U50')
+        fig = dict(data=[], layout=get_figure_layout())
 
-            displayed_text[point_idx] = node2trace['background']['hovertext'][
-                point_idx] if not displayed_text[point_idx] else ''
+        # In debug mode, we do not manipulate the figure. Only test the upload module
+        if args.debug:
+            return fig, trajectory_names, session_id
+
+        with state.lock:
+            state.reset(background_layer_names)
+
+            # The initial figure is the same for every session
+            initial_fragment = get_initial_fragment()
+            state.background_indices = initial_fragment['background_indices']
+            fig['data'] = get_placeholders(initial_fragment['data']) if background_asset is not None else (
+                list(initial_fragment['data']))
+
+        if background_raster is not None:
+            fig['layout']['images'] = [initial_fragment['image']]
+            fig['layout']['xaxis']['range'] = list(background_raster.x_range)
+            fig['layout']['yaxis']['range'] = list(background_raster.y_range)
+
+        return fig, trajectory_names, session_id
+
+    if args.debug:
+        return no_update, trajectory_names, session_id
+
+    if action_name == 'job-result-store':
+        # Results of jobs whose request changed since, e.g. by a slider, are ignored
+        if not job or job['request'] != [trajectory_names, nn, interpolation_value]:
+            return no_update, trajectory_names, session_id
+
+        action_name = job['action']
+
+    elif (job_manager is not None and action_name in ['add-trajectory', 'nn-slider', 'interpolation-slider'] and
+          state.viewport == (None, None)):
+        # Requests that build many trajectories run as a background job. This callback is called again when it is done
+        num_trajectories = sum(size for size, _ in get_fragment_builders(trajectory_names, nn, interpolation_value))
+        if num_trajectories > args.background_job_size:
+            logger.debug(f"Build {num_trajectories} trajectories in a background job")
+            dash.set_props('job-request-store', {'data': dict(action=action_name, request=[
+                trajectory_names, nn, interpolation_value])})
+            return no_update, trajectory_names, session_id
+
+    patched_figure = dash.Patch()
+    num_background_traces = len(background_layer_names)
+    operation = "projection" if action_name in ['nn-slider', 'interpolation-slider'] else action_name
+
+    with work_queue.slot(operation), state.lock:
+        figure_traces = state.figure_traces
+
+        # A slider cancels the job of a selection, which is then applied along with the slider
+        if action_name == 'add-trajectory' or (action_name in ['nn-slider', 'interpolation-slider'] and
+                                               job_manager is not None and trajectory_names != state.selection):
+            # Displayed trajectories keep their colors
+            node2color = {name: state.node2color.get(name, color) for name, color in
+                          get_selected_trajectories(trajectory_names, nn, interpolation_value).items()}
+
+            # Above `--merge_trajectories_above` nodes, the trajectories of the nodes are drawn as a single trace
+            merged_nodes = get_merged_nodes(node2color)
+            trace_names = [name for name in node2color if name not in set(merged_nodes)] + (
+                [MERGED_TRACE] if merged_nodes else [])
+
+            # Delete from the end so that the indices of the remaining traces do not shift
+            for idx_trace in reversed(range(num_background_traces, len(figure_traces))):
+                if figure_traces[idx_trace] not in trace_names:
+                    logger.debug(f"Remove node:\t{figure_traces[idx_trace]}")
+                    del patched_figure['data'][idx_trace]
+
+            figure_traces = figure_traces[:num_background_traces] + [name for name in figure_traces[
+                                                                                      num_background_traces:] if
+                                                                     name in trace_names]
+
+            # The merged trace is updated in place when nodes are added to or removed from it
+            if MERGED_TRACE in figure_traces and merged_nodes != get_merged_nodes(state.node2color):
+                idx_trace = figure_traces.index(MERGED_TRACE)
+                for field, values in encode(get_merged_points(merged_nodes, node2color, nn, interpolation_value,
+                                                              state.viewport)).items():
+                    patched_figure['data'][idx_trace][field] = values
+                patched_figure['data'][idx_trace]['name'] = f"{len(merged_nodes)} trajectories"
+
+            for name in trace_names:
+                if name in figure_traces:
+                    continue
+
+                if name == MERGED_TRACE:
+                    logger.debug(f"Merge {len(merged_nodes)} nodes into one trace")
+                    trace = get_merged_trace(merged_nodes, node2color, nn, interpolation_value, state.viewport)
 
-            node2trace['background']['text'] = tuple(displayed_text.tolist())
+                else:
+                    logger.debug(f"Add node:\t{name} with color {node2color[name]}")
+                    trace = get_trajectory_trace(name, node2color[name], nn, interpolation_value, state.viewport)
 
-            add_background()
+                patched_figure['data'].append(trace)
+                figure_traces = figure_traces + [name]
 
-            add_traces()
+            state.node2color = node2color
+            state.selection = list(trajectory_names)
+            state.figure_traces = figure_traces
 
-        #     point_name = df['name'].iloc[idx]
-        #
-        #     # Check if the point is already annotated
-        #     existing_annotation = next((a for a in annotations if
-        #                                 a['x'] == point_data['x'] and a['y'] ==
-        #                                 point_data['y']), None)
+        # elif action_name == 'update-color-button':
+        #     # Update the color of the selected trajectory
+        #     del figure_name2trace['background']
+        #     figure_name2trace[selected_node].line['color'] = selected_color['hex']
         #
-        #     if existing_annotation:
-        #         # Remove existing annotation
-        #         annotations.remove(existing_annotation)
-        #     else:
-        #         # Add new annotation
-        #         annotations.append({
-        #             'x': point_data['x'],
-        #             'y': point_data['y'],
-        #             'xref': 'x',
-        #             'yref': 'y',
-        #             'text': point_name,
-        #             'showarrow': False
-        #         })
-        #
-        # fig.update_layout(annotations=annotations)
+        #     add_traces()
+
+        if action_name in ['nn-slider', 'interpolation-slider']:
+            # Move the existing trajectories. No neighbor search is needed, and only the coordinates are sent
+            for idx_trace, name in enumerate(figure_traces):
+                if idx_trace < num_background_traces:
+                    continue
+
+                for field, values in encode(get_displayed_points(state, name, nn, interpolation_value,
+                                                                 state.viewport)).items():
+                    patched_figure['data'][idx_trace][field] = values
+
+        elif action_name == 'dygetviz':
+            """
+            Upon clicking a node, if the node's display is on, we turn the display off. If its display is off, we 
+            turn the display on.
+            """
+
+            # Labels cannot be toggled on a rasterized background
+            if 'background' not in figure_traces:
+                return no_update, trajectory_names, session_id
+
+            idx_background = figure_traces.index('background')
+
+            if not clickData or clickData['points'][0].get('curveNumber') != idx_background:
+                return no_update, trajectory_names, session_id
+
+            point_idx = clickData['points'][0]['pointIndex']
+
+            # With level of detail, the figure only holds the background points in the viewport
+            idx_node = point_idx if state.background_indices is None else int(state.background_indices[point_idx])
+            state.toggle_label(idx_node)
+
+            # Only the toggled label (and the mode, when the first label is shown or the last one is hidden) is sent
+            patched_figure['data'][idx_background]['text'][point_idx] = get_background_text(
+                state.toggled_labels, [idx_node])[0]
+            patched_figure['data'][idx_background]['mode'] = get_background_mode(state.toggled_labels)
+
+    return patched_figure, trajectory_names, session_id
+
+
+if job_manager is not None:
+    @app.callback(
+        Output('job-result-store', 'data'),
+        Input('job-request-store', 'data'),
+        background=True,
+        manager=job_manager,
+        progress=[Output('job-progress', 'value'), Output('job-progress', 'max')],
+        progress_default=[0, 1],
+        running=[(Output('job-progress', 'style'), {'display': 'flex'}, {'display': 'none'})],
+        # Changing the selection or the sliders again makes the job obsolete
+        cancel=[Input('add-trajectory', 'value'), Input('nn-slider', 'value'), Input('interpolation-slider', 'value')],
+        prevent_initial_call=True,
+    )
+    def run_fragment_job(set_progress, job):
+        """Build the fragments of a slow request in a separate process. `update_graph` then assembles the figure."""
+        trajectory_names, nn, interpolation_value = job['request']
+        run_tasks([build for _, build in get_fragment_builders(trajectory_names, nn, interpolation_value)],
+                  set_progress)
+        return job
+
+
+@app.callback(
+    Output('dygetviz', 'figure', allow_duplicate=True),
+    Input('dygetviz', 'relayoutData'),
+    State('session-id-store', 'data'),
+    State('nn-slider', 'value'),
+    State('interpolation-slider', 'value'),
+    prevent_initial_call=True,
+    on_error=show_busy,
+)
+@timed_callback("viewport")
+def update_viewport(relayout_data, session_id, nn, interpolation_value):
+    """Update what depends on the viewport when the user pans or zooms.
+
+    Depending on the options, this re-renders the rasterized background, sends the background points in the
+    viewport, and re-simplifies the displayed trajectories.
+    """
+    viewport = get_relayout_viewport(relayout_data)
+    state = sessions.get(session_id) if session_id else None
+
+    if args.debug or viewport is None or state is None:
+        return no_update
+
+    patched_figure = dash.Patch()
+
+    with work_queue.slot("viewport"), state.lock:
+        if background_raster is not None:
+            patched_figure['layout']['images'] = [background_raster.render(*viewport)]
+
+        state.viewport = viewport
+
+        if background_lod is not None:
+            state.background_indices = background_lod.query(*viewport)
+            idx_background = state.figure_traces.index('background')
 
-    return fig, trajectory_names
+            for field, values in encode(get_background_points(state.toggled_labels,
+                                                              state.background_indices)).items():
+                patched_figure['data'][idx_background][field] = values
 
+            patched_figure['data'][idx_background]['mode'] = get_background_mode(state.toggled_labels)
 
+        if trajectory_simplifier is not None:
+            for idx_trace, name in enumerate(state.figure_traces):
+                if idx_trace < len(background_layer_names):
+                    continue
+
+                for field, values in encode(get_displayed_points(state, name, nn, interpolation_value,
+                                                                 viewport)).items():
+                    patched_figure['data'][idx_trace][field] = values
+
+    return patched_figure
+
+
+if clientside_toggling:
+    app.clientside_callback(
+        ClientsideFunction(namespace='dygetviz', function_name='updateTrajectories'),
+        Output('dygetviz', 'figure', allow_duplicate=True),
+        Input('add-trajectory', 'value'),
+        Input('trajectory-coordinates-store', 'data'),
+        State('trajectory-store', 'data'),
+        State('dygetviz', 'figure'),
+        prevent_initial_call=True,
+    )
+
+
+    @app.callback(
+        Output('trajectory-coordinates-store', 'data'),
+        Input('nn-slider', 'value'),
+        Input('interpolation-slider', 'value'),
+        prevent_initial_call=True,
+    )
+    @timed_callback("projection")
+    def update_trajectory_coordinates(nn, interpolation_value):
+        """Send the coordinates of all trajectories for new projection controls. The browser redraws the displayed
+        ones."""
+        return get_fragment(lambda: get_clientside_coordinates(nn, interpolation_value), "clientside", nn,
+                            interpolation_value)
+
+if background_asset is not None:
+    app.clientside_callback(
+        ClientsideFunction(namespace='dygetviz', function_name='loadBackground'),
+        Output('dygetviz', 'figure', allow_duplicate=True),
+        Input('dygetviz', 'figure'),
+        State('background-asset-store', 'data'),
+        prevent_initial_call=True,
+    )
+
+if clientside_labels:
+    app.clientside_callback(
+        ClientsideFunction(namespace='dygetviz', function_name='toggleLabel'),
+        Output('dygetviz', 'figure', allow_duplicate=True),
+        Input('dygetviz', 'clickData'),
+        State('trajectory-store', 'data'),
+        State('dygetviz', 'figure'),
+        prevent_initial_call=True,
+    )
 
 # Upload callbacks disabled due to dash_mantine_components compatibility issues
 # @app.callback(
@@ -754,6 +1434,9 @@ def update_graph(trajectory_names, clickData, current_figure,
 #     } for node in trajectory_names]
 
 
+startup.finish()
+warm_up.set_ready(app.server)
+
 if __name__ == "__main__":
     print(const.DYGETVIZ)
 
@@ -761,8 +1444,13 @@ if __name__ == "__main__":
     `dev_tools_hot_reload`: disable hot-reloading. The code is not reloaded when the file is changed. Setting it to 
     `True` will make the code run very slow.
     """
-    app.run(debug=True, dev_tools_hot_reload=True, use_reloader=True,
-            port=args.port)
+    if args.warm_up:
+        # The app is served by the thread that served the warm-up
+        warm_up.wait()
+
+    else:
+        app.run(debug=True, dev_tools_hot_reload=True, use_reloader=True,
+                port=args.port)
 
     # app.run_server(debug=True, port=args.port)
 
@@ -2,6 +2,7 @@
 Plot using [Dash](https://dash.plotly.com/)
 """
 
+import logging
 import os.path as osp
 import os
 
@@ -12,7 +13,7 @@ import pandas as pd
 import plotly.graph_objects as go
 import plotly.io as pio
 from dash import dcc, html
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
 from tqdm import tqdm
 
 import const
@@ -22,6 +23,15 @@ from data.dataloader import load_data
 from utils.utils_data import read_markdown_into_html
 from utils.utils_misc import project_setup
 from utils.utils_visual import get_colors, get_nodes_and_options
+from visualization.admission import SingleFlight
+from visualization.animation import SnapshotFrames, get_slider_marks
+from visualization.aggregation import CategoryAggregator, get_category_traces, stack_member_coords
+from visualization.metrics import install_metrics, timed_callback
+from visualization.payload import enable_compression
+from visualization.raster import BackgroundRaster
+from visualization.static_assets import StaticAssets, get_placeholders
+
+logger = logging.getLogger(__name__)
 
 print(const.DYGETVIZ)
 args = parse_args()
@@ -29,6 +39,19 @@ project_setup()
 print("Start the app ...")
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 
+# Callback latencies and response sizes are served at `/metrics`. Installed first, so that sizes are measured after
+# compression
+install_metrics(app.server)
+
+# Callback and layout responses are compressed with brotli or gzip, whichever the browser accepts
+if args.response_compression != "none":
+    enable_compression(app.server, ["br", "gzip"] if args.response_compression == "br" else ["gzip"])
+
+# With `--background_delivery asset`, the background of each dataset is a static file, which browsers and proxies cache
+# across visits
+static_assets = StaticAssets()
+static_assets.install(app.server, app.config.routes_pathname_prefix)
+
 """
 `dev_tools_hot_reload`: disable hot-reloading. The code is not reloaded when the file is changed. Setting it to `True` will be very slow.
 """
@@ -42,9 +65,34 @@ for dataset_name in dataset_names:
     visual_dir = osp.join(args.output_dir, "visual", dataset_name)
 
     # nodes, node2trace, label2colors, options, cached_frames, cached_layout = get_nodes_and_options(data, visual_dir)
-    nodes, node2trace, label2colors, options, cached_frames = get_nodes_and_options(data, visual_dir)
+    nodes, node2trace, label2colors, node_search, cached_figure = get_nodes_and_options(
+        data, visual_dir, projection_engine=args.projection_engine)
+
+    # The animation frames are not embedded in the figure. The time slider requests the points of one snapshot at a time
+    snapshot_frames = SnapshotFrames(cached_figure, decimals=args.coordinate_decimals, prefetch=args.snapshot_prefetch)
+
+    # The servers never read the embeddings. Releasing them keeps them out of the memory of every worker process
+    data.pop("z", None)
+
+    # With `--background_mode raster`, the background is an image rendered for the current viewport
+    background_raster = BackgroundRaster(node2trace['background'].x, node2trace['background'].y) if (
+            args.background_mode == "raster") else None
+
+    # With `--category_rendering aggregate`, a category is drawn as the median path and a percentile band of its members
+    category_aggregator = CategoryAggregator(args.category_percentile, args.category_samples) if (
+            args.category_rendering == "aggregate") else None
+
+    # The initial figure only holds placeholders for the background traces, which `assets/background.js` fills in
+    background_asset, background_placeholders = None, None
+    if background_raster is None and args.background_delivery == "asset" and not args.debug:
+        background_traces = [node2trace['background']] + ([node2trace['anomaly']] if data['plot_anomaly_labels'] else [])
+        background_asset = dict(
+            url=app.get_relative_path(static_assets.publish("background", dict(data=background_traces))),
+            num_traces=len(background_traces))
+        background_placeholders = get_placeholders([trace.to_plotly_json() for trace in background_traces])
+
     # Can refactor this into one dict later...
-    dataset_data[dataset_name] = {"data": data, "nodes": nodes, "node2trace": node2trace, "label2colors": label2colors, "options": options, "cached_frames": cached_frames }
+    dataset_data[dataset_name] = {"background_asset": background_asset, "background_placeholders": background_placeholders, "category_aggregator": category_aggregator, "data": data, "nodes": set(nodes), "node2trace": node2trace, "label2colors": label2colors, "node_search": node_search, "snapshot_frames": snapshot_frames, "cached_layout": snapshot_frames.layout, "background_raster": background_raster }
 
 with open('dygetviz/static/Plotly_Button_Explanations.html', 'r') as file:
     plotly_button_explanations = file.read()
@@ -114,7 +162,7 @@ app.layout = html.Div(
                     [
                         dcc.Dropdown(
                             id='add-trajectory',
-                            options=options,
+                            options=node_search.get_initial_options(),
                             value='',
                             multi=True,
                             placeholder="Select a node",
@@ -146,6 +194,24 @@ app.layout = html.Div(
         ),
         html.Div("✨: a category. \n\"(1)\": a node label.", id="note"),
 
+        # Time slider. Each position only requests the points of the displayed traces at that snapshot
+        dcc.Slider(
+            id='snapshot-slider',
+            min=0,
+            max=len(dataset_data[dataset_names[0]]['snapshot_frames']) - 1,
+            step=1,
+            value=len(dataset_data[dataset_names[0]]['snapshot_frames']) - 1,
+            marks=get_slider_marks(dataset_data[dataset_names[0]]['snapshot_frames'].names),
+        ),
+
+        # Names of the traces in the figure, in order, which the time slider updates
+        dcc.Store(
+            id='displayed-traces-store',
+            data=[]),
+
+        # The static file of the background of the displayed dataset
+        dcc.Store(id='background-asset-store'),
+
         # Store the nodes in `trajectory_names`
         dcc.Store(
             id='trajectory-names-store',
@@ -209,16 +275,48 @@ def generate_node_profile(profile: pd.DataFrame):
     profile['description'] = profile.apply(f, axis=1)
     return profile
 
-def add_background(fig, figure_name2trace, node2trace, plot_anomaly_labels, cached_frames):
-    if figure_name2trace.get("background") is None:
+def add_background(fig, figure_name2trace, node2trace, plot_anomaly_labels, background_raster=None, image=None):
+    if background_raster is not None:
+        # `image` is the raster of the current viewport. The full extent only applies until the user zooms, since the
+        # figure keeps the zoom of the user through `uirevision`
+        fig.update_layout(images=[image or background_raster.render()], **background_raster.get_axis_ranges())
+    elif figure_name2trace.get("background") is None:
         trace = node2trace['background']
         # trace.hovertemplate = HOVERTEMPLATE
         fig.add_trace(trace)
     if figure_name2trace.get("background") is None and plot_anomaly_labels:
         trace = node2trace['anomaly']
         fig.add_trace(trace)
-    print("adding cached frames", cached_frames)
-    fig.frames = cached_frames
+
+
+def show_snapshot(fig, snapshot_frames, idx_snapshot):
+    """Cut the trajectories of a figure at the snapshot selected on the time slider."""
+    if idx_snapshot is None or idx_snapshot >= len(snapshot_frames) - 1:
+        return
+
+    points = snapshot_frames.get_points(idx_snapshot, {trace.name for trace in fig.data})
+    for trace in fig.data:
+        if trace.name in points:
+            trace.update(points[trace.name])
+
+
+# Users who select the same category at once share one computation of its aggregate
+aggregate_flights = SingleFlight("aggregates")
+
+
+def get_category_aggregate(dataset_name, label):
+    """The median path and percentile band of the members of a category in a dataset."""
+    global_store_data = dataset_data[dataset_name]
+    data, node2trace = global_store_data['data'], global_store_data['node2trace']
+    members = [node for node in data["label2node"][label] if node in node2trace]
+
+    def get_coords():
+        presence = data["node_presence"][:, [data["node2idx"][node] for node in members]]
+        return stack_member_coords([node2trace.read(node) for node in members], presence)
+
+    return members, aggregate_flights.do((dataset_name, label),
+                                         lambda: global_store_data['category_aggregator'].get(label, get_coords))
+
 
 def add_traces(fig, figure_name2trace):
     for name, trace in figure_name2trace.items():
@@ -240,17 +338,23 @@ def convert_scatter_to_scattergl(scatter):
     Output('trajectory-names-store', 'data'),
     Output('add-trajectory', 'options'),
     Output('dataset-title', 'children'),
+    Output('displayed-traces-store', 'data'),
+    Output('snapshot-slider', 'max'),
+    Output('snapshot-slider', 'marks'),
+    Output('snapshot-slider', 'value'),
+    Output('background-asset-store', 'data'),
     Input('dataset-selector', 'value'),
     Input('add-trajectory', 'value'),
     Input('dygetviz', 'clickData'),
     State('dygetviz', 'figure'),
     State('add-trajectory', 'options'),
+    State('snapshot-slider', 'value'),
     # Input('update-color-button', 'n_clicks'),
     # State('node-selector', 'value'),
     # State('color-picker', 'value'),
 
 )
-def update_graph(dataset_name, trajectory_names, clickData, current_figure, trajectory_options
+def update_graph(dataset_name, trajectory_names, clickData, current_figure, trajectory_options, idx_snapshot
                  # do_update_color, selected_node, selected_color,
     ):
 
@@ -269,11 +373,12 @@ def update_graph(dataset_name, trajectory_names, clickData, current_figure, traj
     # data = dataset_data[dataset_name]['data']
 
     global_store_data = dataset_data[dataset_name]
-    nodes, node2trace, label2colors, options, cached_frames, cached_layout = (global_store_data['nodes'], global_store_data['node2trace'], global_store_data['label2colors'], global_store_data['options'], global_store_data['cached_frames'], global_store_data['cached_layout'])
+    nodes, node2trace, label2colors, node_search, snapshot_frames, cached_layout = (global_store_data['nodes'], global_store_data['node2trace'], global_store_data['label2colors'], global_store_data['node_search'], global_store_data['snapshot_frames'], global_store_data['cached_layout'])
     display_node_type: bool = global_store_data['data']["display_node_type"]
     node2label: dict = global_store_data['data']["node2label"]
     label2node: dict = global_store_data['data']["label2node"]
     plot_anomaly_labels: bool = global_store_data['data']['plot_anomaly_labels']
+    background_raster = global_store_data['background_raster']
     title = [f"Dataset: {dataset_name}"]
     global annotations
 
@@ -289,6 +394,8 @@ def update_graph(dataset_name, trajectory_names, clickData, current_figure, traj
     fig.layout = cached_layout
     fig.update_layout(
         plot_bgcolor='white',
+        # Keep the zoom of the user when the figure is updated, until the dataset changes
+        uirevision=dataset_name,
         xaxis=dict(
             showgrid=False,
             zeroline=False,
@@ -301,19 +408,6 @@ def update_graph(dataset_name, trajectory_names, clickData, current_figure, traj
             showline=False,
             showticklabels=False
         ),
-        updatemenus=[
-                dict(
-                    type='buttons',
-                    buttons=[
-                        dict(
-                            label='Play',
-                            method='animate',
-                            args=[None]
-                        )
-                    ]
-                )
-            ]
-
     )
 
     if current_figure is None or action_name == 'dataset-selector':
@@ -323,15 +417,31 @@ def update_graph(dataset_name, trajectory_names, clickData, current_figure, traj
     else:
         figure_name2trace = {trace['name']: trace for idx, trace in
                              enumerate(current_figure['data'])}
+
+    # The rasterized background of the current viewport, which `update_background_raster` rendered
+    current_image = None
+    if current_figure is not None and action_name != 'dataset-selector':
+        current_image = (current_figure.get('layout', {}).get('images') or [None])[0]
     if action_name == '' or action_name == 'dataset-selector':
         """Launch the app for the first time. 
         
         Only add the background nodes
         """
-        add_background(fig, figure_name2trace, node2trace, plot_anomaly_labels, cached_frames)
+        if global_store_data['background_asset'] is not None:
+            fig.add_traces(global_store_data['background_placeholders'])
+        else:
+            add_background(fig, figure_name2trace, node2trace, plot_anomaly_labels, background_raster)
+
+        # The slider keeps its position if the dataset has enough snapshots
+        last_snapshot = len(snapshot_frames) - 1
+        idx_displayed = last_snapshot if idx_snapshot is None else min(idx_snapshot, last_snapshot)
+        show_snapshot(fig, snapshot_frames, idx_displayed)
 
         # print(fig)
-        return fig, trajectory_names, options, title
+        return (fig, trajectory_names, node_search.get_initial_options(), title, [trace.name for trace in fig.data],
+                last_snapshot, get_slider_marks(snapshot_frames.names),
+                idx_displayed if idx_displayed != idx_snapshot else dash.no_update,
+                global_store_data['background_asset'])
 
 
 
@@ -339,6 +449,7 @@ def update_graph(dataset_name, trajectory_names, clickData, current_figure, traj
         fig = go.Figure()
         fig.update_layout(
             plot_bgcolor='white',
+            uirevision=dataset_name,
             xaxis=dict(
                 showgrid=False,
                 zeroline=False,
@@ -355,9 +466,9 @@ def update_graph(dataset_name, trajectory_names, clickData, current_figure, traj
 
 
 
-        del figure_name2trace['background']
+        figure_name2trace.pop('background', None)
 
-        add_background(fig, figure_name2trace, node2trace, plot_anomaly_labels, cached_frames)
+        add_background(fig, figure_name2trace, node2trace, plot_anomaly_labels, background_raster, current_image)
 
 
         new_trajectory_names = list(
@@ -393,13 +504,28 @@ def update_graph(dataset_name, trajectory_names, clickData, current_figure, traj
                 fig.add_trace(trace)
 
 
+            # Add the aggregate of a category, and its representative members
+            elif value in label2node and global_store_data['category_aggregator'] is not None:
+                logger.debug(f"\tAdd label:\t{value}")
+
+                palette = label2colors.get(value, label2colors[0])
+                members, aggregate = get_category_aggregate(dataset_name, value)
+                category_traces = get_category_traces(aggregate, value, palette[0],
+                                                      global_store_data['data']["snapshot_names"],
+                                                      global_store_data['category_aggregator'].percentile)
+                fig.add_traces([category_traces['band'], category_traces['median']])
+
+                for idx_node, idx_member in enumerate(aggregate['representatives']):
+                    trace = convert_scatter_to_scattergl(node2trace[members[idx_member]])
+                    trace.line['color'] = palette[(idx_node + 1) % len(palette)]
+                    fig.add_trace(trace)
+
             # Add a category
             elif value in label2node:
-                print(f"\tAdd label:\t{value}")
+                logger.debug(f"\tAdd label:\t{value}")
 
                 for idx_node, node in enumerate(label2node[value]):
                     trace = node2trace[node]
-                    print("trying to convert to scattergl3")
                     trace = convert_scatter_to_scattergl(trace)
                     trace.line['color'] = label2colors[value][idx_node % 12]
                     fig.add_trace(trace)
@@ -419,8 +545,9 @@ def update_graph(dataset_name, trajectory_names, clickData, current_figure, traj
                 Upon clicking a node, if the node's display is on, we turn the display off. If its display is off, we turn the display on.
                 """
 
-        if clickData:
-            del figure_name2trace['background']
+        # Labels cannot be toggled on a rasterized background
+        if clickData and background_raster is None:
+            figure_name2trace.pop('background', None)
             point_data = clickData['points'][0]
             point_idx = point_data['pointIndex']
 
@@ -434,7 +561,7 @@ def update_graph(dataset_name, trajectory_names, clickData, current_figure, traj
 
             node2trace['background']['text'] = tuple(displayed_text.tolist())
 
-            add_background(fig, figure_name2trace, node2trace, plot_anomaly_labels, cached_frames)
+            add_background(fig, figure_name2trace, node2trace, plot_anomaly_labels, background_raster, current_image)
 
             add_traces(fig, figure_name2trace)
 
@@ -463,8 +590,77 @@ def update_graph(dataset_name, trajectory_names, clickData, current_figure, traj
 
 
 
+    show_snapshot(fig, snapshot_frames, idx_snapshot)
+
     # print(fig)
-    return fig, trajectory_names, trajectory_options, title
+    return (fig, trajectory_names, trajectory_options, title, [trace.name for trace in fig.data], dash.no_update,
+            dash.no_update, dash.no_update, dash.no_update)
+
+
+if any(global_store_data['background_asset'] is not None for global_store_data in dataset_data.values()):
+    app.clientside_callback(
+        ClientsideFunction(namespace='dygetviz', function_name='loadBackground'),
+        Output('dygetviz', 'figure', allow_duplicate=True),
+        Input('dygetviz', 'figure'),
+        State('background-asset-store', 'data'),
+        prevent_initial_call=True,
+    )
+
+
+@app.callback(
+    Output('dygetviz', 'figure', allow_duplicate=True),
+    Input('snapshot-slider', 'value'),
+    State('displayed-traces-store', 'data'),
+    State('dataset-selector', 'value'),
+    prevent_initial_call=True,
+)
+@timed_callback("snapshot")
+def update_snapshot(idx_snapshot, trace_names, dataset_name):
+    """Move the displayed trajectories to the snapshot selected on the time slider, sending only their points."""
+    delta = dataset_data[dataset_name]['snapshot_frames'].get_delta(idx_snapshot, trace_names)
+    if not delta:
+        return dash.no_update
+
+    patched_figure = dash.Patch()
+    for idx_trace, name in enumerate(trace_names):
+        for field, values in delta.get(name, {}).items():
+            patched_figure['data'][idx_trace][field] = values
+
+    return patched_figure
+
+
+@app.callback(
+    Output('add-trajectory', 'options', allow_duplicate=True),
+    Input('add-trajectory', 'search_value'),
+    State('add-trajectory', 'value'),
+    State('dataset-selector', 'value'),
+    prevent_initial_call=True,
+)
+def update_node_options(search_value, selected_values, dataset_name):
+    """Look up the nodes and categories of the current dataset that match what the user typed in the dropdown."""
+    if not search_value:
+        return dash.no_update
+
+    return dataset_data[dataset_name]['node_search'].get_search_options(search_value, selected_values)
+
+
+if args.background_mode == "raster":
+    @app.callback(
+        Output('dygetviz', 'figure', allow_duplicate=True),
+        Input('dygetviz', 'relayoutData'),
+        State('dataset-selector', 'value'),
+        prevent_initial_call=True,
+    )
+    def update_background_raster(relayout_data, dataset_name):
+        """Re-render the rasterized background when the user pans or zooms."""
+        image = dataset_data[dataset_name]['background_raster'].render_relayout(relayout_data)
+
+        if image is None:
+            return dash.no_update
+
+        patched_figure = dash.Patch()
+        patched_figure['layout']['images'] = [image]
+        return patched_figure
 
 if __name__ == "__main__":
     app.run_server(debug=True,
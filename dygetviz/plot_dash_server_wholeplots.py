@@ -12,7 +12,7 @@ import pandas as pd
 import plotly.graph_objects as go
 import plotly.io as pio
 from dash import dcc, html
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
 from tqdm import tqdm
 
 import const
@@ -21,6 +21,12 @@ from arguments import parse_args
 from data.dataloader import load_data, load_data_description
 from utils.utils_misc import project_setup
 from utils.utils_visual import get_colors, get_nodes_and_options
+from visualization.animation import SnapshotFrames, get_slider_marks
+from visualization.metrics import install_metrics, timed_callback
+from visualization.payload import enable_compression
+from visualization.raster import BackgroundRaster, replace_background_with_raster
+from visualization.static_assets import StaticAssets, get_placeholders
+from visualization.trace_store import BACKGROUND_LAYER_NAMES
 
 args = parse_args()
 
@@ -32,7 +38,40 @@ for dataset_name in dataset_names:
     print(f"Loading data for {dataset_name}...")
     data = load_data(dataset_name)
     visual_dir = osp.join(args.output_dir, "visual", dataset_name)
-    nodes, node2trace, label2colors, options, cached_figure = get_nodes_and_options(data, visual_dir)
+    nodes, node2trace, label2colors, node_search, cached_figure = get_nodes_and_options(
+        data, visual_dir, projection_engine=args.projection_engine)
+
+    # The servers never read the embeddings. Releasing them keeps them out of the memory of every worker process
+    data.pop("z", None)
+
+    # With `--background_mode raster`, the background is an image rendered for the current viewport
+    if args.background_mode == "raster":
+        background_raster = BackgroundRaster(node2trace['background'].x, node2trace['background'].y)
+        cached_figure = replace_background_with_raster(cached_figure, background_raster)
+    else:
+        background_raster = None
+
+    cached_figure.update_layout(
+        plot_bgcolor='white',
+        # Keep the zoom of the user when the figure is updated, until the dataset changes
+        uirevision=dataset_name,
+        xaxis=dict(
+            showgrid=False,
+            zeroline=False,
+            showline=False,
+            showticklabels=False
+        ),
+        yaxis=dict(
+            showgrid=False,
+            zeroline=False,
+            showline=False,
+            showticklabels=False
+        ),
+    )
+
+    # The animation frames are not embedded in the figure. The time slider requests the points of one snapshot at a time
+    snapshot_frames = SnapshotFrames(cached_figure, decimals=args.coordinate_decimals, prefetch=args.snapshot_prefetch)
+
     try:
         with open(osp.join("data", dataset_name, "data_descriptions.md"), 'r') as file:
             markdown = file.read()
@@ -46,11 +85,42 @@ for dataset_name in dataset_names:
 
     # dataset_data[dataset_name] = {"data": data, "nodes": nodes, "node2trace": node2trace, "label2colors":
     #     label2colors,  "options": options, "cached_figure": cached_figure, "dataset_description": dataset_description}
-    dataset_data[dataset_name] = {"data": data, "nodes": nodes, "node2trace": node2trace, "label2colors": label2colors,  "options": options, "cached_figure": cached_figure, "markdown": markdown }
+    dataset_data[dataset_name] = {"data": data, "nodes": nodes, "node2trace": node2trace, "label2colors": label2colors,  "node_search": node_search, "snapshot_frames": snapshot_frames, "markdown": markdown, "background_raster": background_raster }
 
 
 print("Start the app ...")
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+
+# Callback latencies and response sizes are served at `/metrics`. Installed first, so that sizes are measured after
+# compression
+install_metrics(app.server)
+
+# Callback and layout responses are compressed with brotli or gzip, whichever the browser accepts
+if args.response_compression != "none":
+    enable_compression(app.server, ["br", "gzip"] if args.response_compression == "br" else ["gzip"])
+
+# With `--background_delivery asset`, the background traces of each dataset are a static file, which browsers and
+# proxies cache across visits. The initial figure only holds placeholders for them, which `assets/background.js` fills in
+static_assets = StaticAssets()
+static_assets.install(app.server, app.config.routes_pathname_prefix)
+
+for global_store_data in dataset_data.values():
+    global_store_data['background_asset'] = None
+    if args.background_delivery == "asset" and not args.debug:
+        snapshot_frames = global_store_data['snapshot_frames']
+
+        # The leading traces of the figure that are the same at every snapshot
+        background_traces = []
+        for trace in snapshot_frames.get_figure()['data']:
+            if trace.get('name') not in BACKGROUND_LAYER_NAMES or trace['name'] in snapshot_frames.dynamic_traces:
+                break
+            background_traces += [trace]
+
+        if background_traces:
+            global_store_data['background_asset'] = dict(
+                url=app.get_relative_path(static_assets.publish("background", dict(data=background_traces))),
+                num_traces=len(background_traces))
+
 with open('dygetviz/static/Plotly_Button_Explanations.html', 'r') as file:
     plotly_button_explanations = file.read()
 
@@ -116,7 +186,7 @@ app.layout = html.Div(
                     [
                         dcc.Dropdown(
                             id='add-trajectory',
-                            options=options,
+                            options=node_search.get_initial_options(),
                             value='',
                             multi=True,
                             placeholder="Select a node",
@@ -148,6 +218,24 @@ app.layout = html.Div(
         ),
         # html.Div("✨: a category. \n\"(1)\": a node label.", id="note"),
 
+        # Time slider. Each position only requests the points of the displayed traces at that snapshot
+        dcc.Slider(
+            id='snapshot-slider',
+            min=0,
+            max=len(dataset_data[dataset_names[0]]['snapshot_frames']) - 1,
+            step=1,
+            value=len(dataset_data[dataset_names[0]]['snapshot_frames']) - 1,
+            marks=get_slider_marks(dataset_data[dataset_names[0]]['snapshot_frames'].names),
+        ),
+
+        # Names of the traces in the figure, in order, which the time slider updates
+        dcc.Store(
+            id='displayed-traces-store',
+            data=[]),
+
+        # The static file of the background of the displayed dataset
+        dcc.Store(id='background-asset-store'),
+
         # Store the nodes in `trajectory_names`
         dcc.Store(
             id='trajectory-names-store',
@@ -185,7 +273,7 @@ def generate_node_profile(profile: pd.DataFrame):
     profile['description'] = profile.apply(f, axis=1)
     return profile
 
-def add_background(fig, figure_name2trace, node2trace, plot_anomaly_labels, cached_frames):
+def add_background(fig, figure_name2trace, node2trace, plot_anomaly_labels):
     if figure_name2trace.get("background") is None:
         trace = node2trace['background']
         # trace.hovertemplate = HOVERTEMPLATE
@@ -193,8 +281,6 @@ def add_background(fig, figure_name2trace, node2trace, plot_anomaly_labels, cach
     if figure_name2trace.get("background") is None and plot_anomaly_labels:
         trace = node2trace['anomaly']
         fig.add_trace(trace)
-    print("adding cached frames", cached_frames)
-    fig.frames = cached_frames
 
 def add_traces(fig, figure_name2trace):
     for name, trace in figure_name2trace.items():
@@ -217,17 +303,23 @@ def convert_scatter_to_scattergl(scatter):
     Output('add-trajectory', 'options'),
     Output('dataset-title', 'children'),
     Output('data-desc', 'children'),
+    Output('displayed-traces-store', 'data'),
+    Output('snapshot-slider', 'max'),
+    Output('snapshot-slider', 'marks'),
+    Output('snapshot-slider', 'value'),
+    Output('background-asset-store', 'data'),
     Input('dataset-selector', 'value'),
     Input('add-trajectory', 'value'),
     Input('dygetviz', 'clickData'),
     State('dygetviz', 'figure'),
     State('add-trajectory', 'options'),
+    State('snapshot-slider', 'value'),
     # Input('update-color-button', 'n_clicks'),
     # State('node-selector', 'value'),
     # State('color-picker', 'value'),
 
 )
-def update_graph(dataset_name, trajectory_names, clickData, current_figure, trajectory_options
+def update_graph(dataset_name, trajectory_names, clickData, current_figure, trajectory_options, idx_snapshot
                  # do_update_color, selected_node, selected_color,
     ):
 
@@ -246,7 +338,7 @@ def update_graph(dataset_name, trajectory_names, clickData, current_figure, traj
     # data = dataset_data[dataset_name]['data']
     
     global_store_data = dataset_data[dataset_name]
-    nodes, node2trace, label2colors, options, cached_figure = (global_store_data['nodes'], global_store_data['node2trace'], global_store_data['label2colors'], global_store_data['options'], global_store_data['cached_figure'])
+    nodes, node2trace, label2colors, node_search, snapshot_frames = (global_store_data['nodes'], global_store_data['node2trace'], global_store_data['label2colors'], global_store_data['node_search'], global_store_data['snapshot_frames'])
 
     # Update dataset description
     markdown = global_store_data['markdown']
@@ -267,23 +359,11 @@ def update_graph(dataset_name, trajectory_names, clickData, current_figure, traj
     # This is the template for displaying metadata when hovering over a node
 
 
-    # fig = go.Figure(data=cached_figure.data, cached_figure.frames, cached_figure.layout)
-    fig = cached_figure
-    fig.update_layout(
-        plot_bgcolor='white',
-        xaxis=dict(
-            showgrid=False,
-            zeroline=False,
-            showline=False,
-            showticklabels=False
-        ),
-        yaxis=dict(
-            showgrid=False,
-            zeroline=False,
-            showline=False,
-            showticklabels=False
-        ),
-    )
+    # The figure at the snapshot of the time slider. The slider keeps its position if the dataset has enough snapshots
+    last_snapshot = len(snapshot_frames) - 1
+    idx_displayed = last_snapshot if idx_snapshot is None else min(idx_snapshot, last_snapshot)
+    fig = snapshot_frames.get_figure(idx_displayed)
+    trace_names = [trace.get('name') for trace in fig['data']]
 
     if current_figure is None or action_name == 'dataset-selector':
         figure_name2trace = {}
@@ -292,32 +372,39 @@ def update_graph(dataset_name, trajectory_names, clickData, current_figure, traj
     else:
         figure_name2trace = {trace['name']: trace for idx, trace in
                              enumerate(current_figure['data'])}
+
+        # Keep the rasterized background of the current viewport, which `update_background_raster` rendered, instead of
+        # the full extent. The figure from `snapshot_frames` is shared, so its layout is copied
+        current_images = current_figure.get('layout', {}).get('images')
+        if global_store_data['background_raster'] is not None and current_images:
+            fig = {**fig, 'layout': {**fig['layout'], 'images': current_images}}
     if action_name == '' or action_name == 'dataset-selector':
         """Launch the app for the first time. 
         
         Only add the background nodes
         """
-        fig = cached_figure
-        
-        # print(fig)
-
-        return fig, trajectory_names, options, title, markdown
+        background_asset = global_store_data['background_asset']
+        if background_asset is not None:
+            num_traces = background_asset['num_traces']
+            fig = {**fig, 'data': get_placeholders(fig['data'][:num_traces]) + fig['data'][num_traces:]}
 
+        # print(fig)
 
-
-    if action_name == 'add-trajectory':
-
-        fig = cached_figure
+        return (fig, trajectory_names, node_search.get_initial_options(), title, markdown, trace_names, last_snapshot,
+                get_slider_marks(snapshot_frames.names),
+                idx_displayed if idx_displayed != idx_snapshot else dash.no_update, background_asset)
 
 
 
-    elif action_name == 'dygetviz':
+    # Adding a trajectory displays the whole figure at the current snapshot
+    if action_name == 'dygetviz':
         # Add annotations when user clicks on a node
         """
                 Upon clicking a node, if the node's display is on, we turn the display off. If its display is off, we turn the display on.
                 """
 
-        if clickData:
+        # Labels cannot be toggled on a rasterized background
+        if clickData and global_store_data['background_raster'] is None:
             del figure_name2trace['background']
             point_data = clickData['points'][0]
             point_idx = point_data['pointIndex']
@@ -359,7 +446,74 @@ def update_graph(dataset_name, trajectory_names, clickData, current_figure, traj
 
 
     # print(fig)
-    return fig, trajectory_names, trajectory_options, title, markdown
+    return (fig, trajectory_names, trajectory_options, title, markdown, trace_names, dash.no_update, dash.no_update,
+            dash.no_update, dash.no_update)
+
+
+if any(global_store_data['background_asset'] is not None for global_store_data in dataset_data.values()):
+    app.clientside_callback(
+        ClientsideFunction(namespace='dygetviz', function_name='loadBackground'),
+        Output('dygetviz', 'figure', allow_duplicate=True),
+        Input('dygetviz', 'figure'),
+        State('background-asset-store', 'data'),
+        prevent_initial_call=True,
+    )
+
+
+@app.callback(
+    Output('dygetviz', 'figure', allow_duplicate=True),
+    Input('snapshot-slider', 'value'),
+    State('displayed-traces-store', 'data'),
+    State('dataset-selector', 'value'),
+    prevent_initial_call=True,
+)
+@timed_callback("snapshot")
+def update_snapshot(idx_snapshot, trace_names, dataset_name):
+    """Move the displayed trajectories to the snapshot selected on the time slider, sending only their points."""
+    delta = dataset_data[dataset_name]['snapshot_frames'].get_delta(idx_snapshot, trace_names)
+    if not delta:
+        return dash.no_update
+
+    patched_figure = dash.Patch()
+    for idx_trace, name in enumerate(trace_names):
+        for field, values in delta.get(name, {}).items():
+            patched_figure['data'][idx_trace][field] = values
+
+    return patched_figure
+
+
+@app.callback(
+    Output('add-trajectory', 'options', allow_duplicate=True),
+    Input('add-trajectory', 'search_value'),
+    State('add-trajectory', 'value'),
+    State('dataset-selector', 'value'),
+    prevent_initial_call=True,
+)
+def update_node_options(search_value, selected_values, dataset_name):
+    """Look up the nodes and categories of the current dataset that match what the user typed in the dropdown."""
+    if not search_value:
+        return dash.no_update
+
+    return dataset_data[dataset_name]['node_search'].get_search_options(search_value, selected_values)
+
+
+if args.background_mode == "raster":
+    @app.callback(
+        Output('dygetviz', 'figure', allow_duplicate=True),
+        Input('dygetviz', 'relayoutData'),
+        State('dataset-selector', 'value'),
+        prevent_initial_call=True,
+    )
+    def update_background_raster(relayout_data, dataset_name):
+        """Re-render the rasterized background when the user pans or zooms."""
+        image = dataset_data[dataset_name]['background_raster'].render_relayout(relayout_data)
+
+        if image is None:
+            return dash.no_update
+
+        patched_figure = dash.Patch()
+        patched_figure['layout']['images'] = [image]
+        return patched_figure
 
 
 if __name__ == "__main__":
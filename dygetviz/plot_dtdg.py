@@ -2,9 +2,11 @@
 
 Created 2023.7
 """
+import json
 import logging
 import os.path as osp
 import pickle
+import time
 import traceback
 import warnings
 from collections import defaultdict
@@ -14,7 +16,6 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import plotly.io as pio
-import torch
 from tqdm import tqdm
 
 
@@ -24,9 +25,13 @@ from const import *
 from data.dataloader import load_data
 from utils.utils_logging import configure_default_logging
 from utils.utils_misc import project_setup, get_visualization_name
-from utils.utils_training import pairwise_cos_sim
 from utils.utils_visual import get_colors, get_hovertemplate
 from visualization.anchor_nodes_generator import get_dataframe_for_visualization
+from visualization.projection import CoherentKNNProjector, MLPProjector, NeighborIndex, knn_project, knn_search, \
+    neighbors_to_coords, neighborhood_preservation
+from visualization.trace_store import write_trace_store_from_figure
+from visualization.trajectory_cache import append_snapshots_to_figure, find_cache_manifest, get_cache_paths, \
+    get_new_snapshot_indices, save_cache_manifest
 
 
 
@@ -42,8 +47,109 @@ K = 10
 
 ################################
 
+def compare_with_knn_projection(embedding_test_all: np.ndarray, elapsed: float, z: np.ndarray,
+                                idx_projected_nodes: np.ndarray, idx_reference_node: np.ndarray,
+                                embedding_train: np.ndarray, idx_self_reference: np.ndarray, nn: int,
+                                interpolation: float, device: str, num_snapshots: int = 10):
+    r"""Report the throughput and the neighborhood preservation of a projection against the k-NN projection.
+
+    The k-NN projection is only computed on `num_snapshots` evenly spaced snapshots.
+    """
+
+    idx_snapshots = np.unique(np.linspace(0, len(embedding_test_all) - 1, num=num_snapshots).astype(int))
+
+    start_time = time.time()
+    embedding_test_knn = [knn_project(z[idx_snapshot, idx_projected_nodes], z[idx_snapshot, idx_reference_node],
+                                      embedding_train, idx_self_reference, nn, interpolation, device)
+                          for idx_snapshot in idx_snapshots]
+    elapsed_knn = time.time() - start_time
+
+    preservation = np.mean([neighborhood_preservation(embedding_test_all[idx_snapshot], coords_knn, k=nn)
+                            for idx_snapshot, coords_knn in zip(idx_snapshots, embedding_test_knn)])
+
+    num_points = embedding_test_all.shape[0] * embedding_test_all.shape[1]
+    num_points_knn = len(idx_snapshots) * embedding_test_all.shape[1]
+
+    logger.info(f"Throughput: {num_points / max(elapsed, 1e-9):.0f} points/s (k-NN: "
+                f"{num_points_knn / max(elapsed_knn, 1e-9):.0f} points/s). Neighborhood preservation against the k-NN "
+                f"projection ({nn}-NN, {len(idx_snapshots)} snapshots): {preservation:.3f}")
+
+
+def append_to_visualization_cache(visual_dir: str, visualization_name: str, manifest: dict, z: np.ndarray,
+                                  node_presence: np.ndarray, snapshot_names, idx_projected_nodes: np.ndarray,
+                                  idx_reference_node: np.ndarray, idx_self_reference: np.ndarray, nn: int,
+                                  interpolation: float, device: str):
+    r"""Project only the snapshots that are new relative to the cache manifest and append them to the cache.
+
+    The anchor coordinates are read from the cache instead of refitting the visualization model, so the new
+    snapshots share the reference frame of the cached ones. Only the new snapshots are projected, but the figure
+    (`Trajectory_*.json` and `.html`) and the trace store (`Traces_*.bin`) are rewritten as a whole, so writing the
+    cache still takes time proportional to the total number of snapshots.
+
+    Returns:
+        dict: The updated figure, or None if the cache is already up to date.
+    """
+
+    cache_paths = get_cache_paths(visual_dir, visualization_name)
+    idx_new_snapshots = get_new_snapshot_indices(manifest, snapshot_names)
+
+    if len(idx_new_snapshots) == 0:
+        logger.info(f"{visualization_name} is up to date ({len(snapshot_names)} snapshots).")
+        return None
+
+    logger.info(f"Appending {len(idx_new_snapshots)} new snapshots to {visualization_name}")
+
+    embedding_train = np.load(cache_paths["anchors"])
+    coords = np.load(cache_paths["coords"])
+
+    if manifest.get("projection_engine") == "mlp":
+        projector = MLPProjector(embedding_train, idx_self_reference, interpolation).load(cache_paths["projector"])
+        new_coords = projector.project(z[idx_new_snapshots][:, idx_projected_nodes])
+
+    else:
+        with np.load(cache_paths["neighbors"]) as f:
+            neighbors, self_coords = f["neighbors"], f["self_coords"]
+
+        new_neighbors = np.stack([
+            knn_search(z[idx_snapshot, idx_projected_nodes], z[idx_snapshot, idx_reference_node], idx_self_reference,
+                       neighbors.shape[2], device)
+            for idx_snapshot in tqdm(idx_new_snapshots, desc="Projecting new snapshots")])
+
+        new_coords = np.stack([neighbors_to_coords(embedding_train, idx_neighbors[:, :nn], idx_self_reference,
+                                                   interpolation) for idx_neighbors in new_neighbors])
+
+        NeighborIndex.save(cache_paths["neighbors"], np.concatenate([neighbors, new_neighbors], axis=0),
+                           self_coords)
+
+    coords = np.concatenate([coords, new_coords.astype(np.float32)], axis=0)
+
+    with open(cache_paths["figure"], 'r', encoding='utf-8') as f:
+        fig = json.load(f)
+
+    fig = append_snapshots_to_figure(fig, manifest, coords, node_presence[:, idx_projected_nodes],
+                                     [str(name) for name in snapshot_names], idx_new_snapshots)
+
+    with open(cache_paths["figure"], 'w', encoding='utf-8') as f:
+        json.dump(fig, f)
+
+    write_trace_store_from_figure(cache_paths["traces"], fig, manifest["num_background_traces"])
+
+    pio.write_html(fig, osp.join(visual_dir, f"Trajectory_{visualization_name}.html"), validate=False)
+
+    np.save(cache_paths["coords"], coords)
+    manifest["snapshot_names"] = [str(name) for name in snapshot_names]
+    save_cache_manifest(visual_dir, visualization_name, manifest)
+
+    logger.info(f"Per-node coordinate sheets ({visualization_name}.xlsx/.pkl) are not updated in append mode. "
+                f"Rebuild the cache without --append to refresh them.")
+
+    return fig
+
+
 def get_visualization_cache(dataset_name: str, device: str, model_name: str,
-                            visualization_dim, visualization_model_name: str):
+                            visualization_dim, visualization_model_name: str, append: bool = False,
+                            coherence_threshold: float = 0., coherence_expansion: int = 5,
+                            projection_engine: str = "knn"):
     r"""
 
     Args:
@@ -52,6 +158,13 @@ def get_visualization_cache(dataset_name: str, device: str, model_name: str,
         model_name (str): The DTDG model name (e.g. tgn, DyRep, etc.) that trained the embeddings
         visualization_dim (int): The dimension of the visualization, either 2 or 3 (2D or 3D).
         visualization_model_name (str): The visualization model (e.g. tsne, umap, etc.) that projects the embeddings to 2D/3D
+        append (bool): Only project the snapshots that are not in the existing cache and append them to the cached
+            trajectories and frames. Raises `FileNotFoundError` if no cache with a manifest exists.
+        coherence_threshold (float): If positive, reuse the neighbor sets of nodes whose embeddings drifted less than
+            this threshold since their last full top-k search (see `CoherentKNNProjector`). 0 disables the reuse.
+        coherence_expansion (int): Number of extra candidates kept from each full search for the reuse.
+        projection_engine (str): `knn` places each (node, snapshot) at the mean of its nearest anchor nodes. `mlp`
+            fits an MLP on the reference snapshot and projects all nodes and snapshots in one forward pass.
 
     Returns:
 
@@ -101,6 +214,9 @@ def get_visualization_cache(dataset_name: str, device: str, model_name: str,
     reference_node2idx = {node: idx for idx, node in enumerate(reference_nodes)}
     reference_idx2node = {idx: node for idx, node in enumerate(reference_nodes)}
 
+    # Position of each projected node among the reference nodes. -1 if the projected node is not a reference node
+    idx_self_reference = np.array([reference_node2idx.get(node, -1) for node in projected_nodes])
+
     if dataset_name in const.dataset_name2months:
         # All nodes with insufficient interactions should be set to 0 already
         assert \
@@ -110,6 +226,30 @@ def get_visualization_cache(dataset_name: str, device: str, model_name: str,
 
     ################################
 
+    if append:
+        figs = []
+        for nn in num_nearest_neighbors:
+            # Without a reference snapshot in the config, the default (the last snapshot) moved with the new
+            # snapshots, so the cache is looked up by the reference snapshot stored in its manifest
+            visualization_name, manifest = find_cache_manifest(visual_dir, get_visualization_name(
+                dataset_name, model_name, visualization_model_name, perplexity, nn, interpolation,
+                idx_reference_snapshot, projection_engine))
+
+            if manifest is None:
+                raise FileNotFoundError(f"No visualization cache with a manifest found for {visualization_name}. "
+                                        f"Build it without --append first.")
+
+            if manifest["projected_nodes"] != [str(node) for node in projected_nodes]:
+                raise ValueError("The projected nodes differ from the cached ones. Rebuild the visualization cache "
+                                 "without --append.")
+
+            figs += [append_to_visualization_cache(visual_dir, visualization_name, manifest, z, node_presence,
+                                                   snapshot_names, idx_projected_nodes, idx_reference_node,
+                                                   idx_self_reference, nn, interpolation, device)]
+
+        # Like a full run, returns the figure of the first number of nearest neighbors
+        return figs[0]
+
     outputs = get_dataframe_for_visualization(
         z[idx_reference_snapshot, idx_reference_node], args,
         nodes_li=reference_nodes, idx_reference_node=idx_reference_node,
@@ -132,7 +272,7 @@ def get_visualization_cache(dataset_name: str, device: str, model_name: str,
 
         visualization_name = get_visualization_name(dataset_name, model_name,
                                    visualization_model_name, perplexity, nn,
-                                   interpolation, idx_reference_snapshot)
+                                   interpolation, idx_reference_snapshot, projection_engine)
 
         embedding_train = outputs['embedding']
         df_visual = outputs['df_visual']
@@ -218,6 +358,28 @@ def get_visualization_cache(dataset_name: str, device: str, model_name: str,
 
         embedding_test_all = []
 
+        # The top-max(nn) neighbors of each (projected node, snapshot). With these, the Dash app can recompute the
+        # coordinates for any nn <= max(nn) and any interpolation without a neighbor search
+        max_nn = max(num_nearest_neighbors)
+        neighbor_index = []
+
+        if projection_engine == "mlp":
+            mlp_projector = MLPProjector(embedding_train, idx_self_reference, interpolation).fit(
+                z[idx_reference_snapshot, idx_reference_node])
+
+            start_time = time.time()
+            embedding_test_mlp = mlp_projector.project(z[:, idx_projected_nodes])
+            elapsed = time.time() - start_time
+
+            compare_with_knn_projection(embedding_test_mlp, elapsed, z, idx_projected_nodes, idx_reference_node,
+                                        embedding_train, idx_self_reference, nn, interpolation, device)
+
+        if coherence_threshold > 0 and projection_engine == "knn":
+            projector = CoherentKNNProjector(embedding_train, idx_self_reference, max_nn, interpolation,
+                                             coherence_threshold, coherence_expansion, device)
+        else:
+            projector = None
+
         for idx_snapshot, snapshot_name in enumerate(snapshot_names):
 
             # Original temporal node embeddings to be projected at snapshot `idx_snapshot`
@@ -234,40 +396,21 @@ def get_visualization_cache(dataset_name: str, device: str, model_name: str,
                                              idx_projected_nodes,
                                              :]
 
-            cos_sim_mat = pairwise_cos_sim(z_projected_embeds,
-                                           z_reference_embeds, device)
-
-            z_projected_coords_li = []
-
-            # Vectorize inner loop
-            all_possible_idx_reference_node = torch.tensor(
-                [reference_node2idx.get(node, -1)
-                 for node in projected_nodes], device=device)
-
-            # Compute top-k values for all nodes at once
-            cos_sim_topk_values, cos_sim_topk_indices = cos_sim_mat.topk(nn + 1,
-                                                                         largest=True)
-
-            mask = (cos_sim_topk_indices != all_possible_idx_reference_node[:,
-                                            None])
-            # For each row, keep the first nn `True`
-            mask = mask & (torch.concat(
-                [torch.ones((mask.shape[0], nn), dtype=torch.bool, device=device),
-                 (mask.sum(dim=1) <= nn).reshape(-1, 1)], dim=1))
-
-            cos_sim_topk_values = cos_sim_topk_values[mask].reshape(-1,
-                                                                    nn).cpu().numpy()
-            cos_sim_topk_indices = cos_sim_topk_indices[mask].reshape(-1,
-                                                                      nn).cpu().numpy()
+            if projection_engine == "mlp":
+                embedding_test = embedding_test_mlp[idx_snapshot]
 
-            z_projected_coords = np.array(
-                embedding_train[cos_sim_topk_indices].tolist()).mean(axis=1)
+            else:
+                if projector is None:
+                    idx_neighbors = knn_search(z_projected_embeds, z_reference_embeds, idx_self_reference, max_nn,
+                                               device)
+                else:
+                    idx_neighbors = projector.search(z_projected_embeds, z_reference_embeds)
 
-            # Algorithm 1 Line 12 (Vectorized)
-            embedding_test = embedding_train[
-                                 all_possible_idx_reference_node.cpu()] * interpolation + z_projected_coords * (
-                                         1 - interpolation)
+                neighbor_index += [idx_neighbors]
 
+                # The neighbors are sorted by similarity, so the first nn of the top-max(nn) are the top-nn
+                embedding_test = neighbors_to_coords(embedding_train, idx_neighbors[:, :nn], idx_self_reference,
+                                                     interpolation)
 
             # if DEBUG:
             for i, node in enumerate(projected_nodes):
@@ -286,6 +429,11 @@ def get_visualization_cache(dataset_name: str, device: str, model_name: str,
 
         embedding_test_all = np.stack(embedding_test_all)
 
+        if projector is not None:
+            logger.info(f"Temporal coherence: reused {projector.num_reused}/{projector.num_total} neighbor sets "
+                        f"(hit rate {projector.hit_rate:.1%}). Error bound on the cosine similarity of a missed "
+                        f"neighbor: {projector.error_bound:.4f}")
+
         colors = get_colors(len(projected_nodes))
         data = []
 
@@ -301,6 +449,9 @@ def get_visualization_cache(dataset_name: str, device: str, model_name: str,
         
         dataframes = {}
 
+        # Projected nodes that have a trajectory trace, in the order of the traces in each frame
+        trajectory_nodes = []
+
         for idx, node in enumerate(
                 tqdm(projected_nodes, desc=f"Adding trajectories")):
             num_total_snapshots = len(
@@ -434,6 +585,8 @@ def get_visualization_cache(dataset_name: str, device: str, model_name: str,
             for trace in fig_line.data:
                 fig = fig.add_trace(trace)
 
+            trajectory_nodes += [str(node)]
+
             frames = [
                 go.Frame(data=f.data + fig_line.frames[i].data, name=f.name)
                 for i, f in enumerate(fig.frames)]
@@ -485,6 +638,30 @@ def get_visualization_cache(dataset_name: str, device: str, model_name: str,
         pio.write_json(fig, osp.join(visual_dir,
                                      f"Trajectory_{visualization_name}.json"))
 
+        # Save the anchor and projected coordinates so that new snapshots can be appended with `--append`
+        cache_paths = get_cache_paths(visual_dir, visualization_name)
+        np.save(cache_paths["anchors"], np.asarray(embedding_train, dtype=np.float32))
+        np.save(cache_paths["coords"], embedding_test_all.astype(np.float32))
+        write_trace_store_from_figure(cache_paths["traces"], fig.to_plotly_json(), len(fig_scatter.data))
+        save_cache_manifest(visual_dir, visualization_name, {
+            "dataset_name": dataset_name,
+            "model_name": model_name,
+            "snapshot_names": [str(name) for name in snapshot_names],
+            "idx_reference_snapshot": int(idx_reference_snapshot),
+            "num_labeled_snapshots": len(snapshot_names),
+            "projected_nodes": [str(node) for node in projected_nodes],
+            "trajectory_nodes": trajectory_nodes,
+            "num_background_traces": len(fig_scatter.data),
+            "fields": fields,
+            "projection_engine": projection_engine,
+        })
+
+        if projection_engine == "mlp":
+            mlp_projector.save(cache_paths["projector"])
+        else:
+            NeighborIndex.save(cache_paths["neighbors"], np.stack(neighbor_index),
+                               np.asarray(embedding_train)[idx_self_reference])
+
         return fig
 
 
@@ -494,4 +671,7 @@ if __name__ == '__main__':
     args = parse_args()
     get_visualization_cache(dataset_name=args.dataset_name, device=args.device,
                             model_name=args.model, visualization_dim=2,
-                            visualization_model_name=args.visualization_model)
+                            visualization_model_name=args.visualization_model, append=args.append,
+                            coherence_threshold=args.coherence_threshold,
+                            coherence_expansion=args.coherence_expansion,
+                            projection_engine=args.projection_engine)
@@ -50,8 +50,10 @@ def set_seed(seed, use_torch=True):
 
 def get_visualization_name(dataset_name, model_name,
                            visualization_model_name, perplexity, nn,
-                           interpolation, idx_reference_snapshot):
-    return f"{dataset_name}_{model_name}_{visualization_model_name}_perplex{perplexity}_nn{nn}_interpolation{interpolation}_snapshot{idx_reference_snapshot}"
+                           interpolation, idx_reference_snapshot, projection_engine="knn"):
+    # Caches of the default `knn` projection engine keep the names they had before other engines existed
+    engine = "" if projection_engine == "knn" else f"_{projection_engine}"
+    return f"{dataset_name}_{model_name}_{visualization_model_name}_perplex{perplexity}_nn{nn}_interpolation{interpolation}{engine}_snapshot{idx_reference_snapshot}"
 
 
 def get_GPU_memory_allocated_to_tensor(t):
@@ -1,8 +1,8 @@
+import logging
 import os
 import os.path as osp
 import random
 from typing import Union
-import time 
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -41,6 +41,22 @@ except ImportError:
         def get_modified_time_of_file(*args, **kwargs):
             return ""
 
+try:
+    from .utils_misc import get_visualization_name
+except ImportError:
+    from utils.utils_misc import get_visualization_name
+
+try:
+    from ..visualization.metrics import StartupTimer
+    from ..visualization.node_search import NodeSearchIndex
+    from ..visualization.trace_store import load_trace_store
+    from ..visualization.trajectory_cache import resolve_visualization_name
+except ImportError:
+    from visualization.metrics import StartupTimer
+    from visualization.node_search import NodeSearchIndex
+    from visualization.trace_store import load_trace_store
+    from visualization.trajectory_cache import resolve_visualization_name
+
 try:
     from dash import dcc, html
     HAS_DASH = True
@@ -49,6 +65,8 @@ except ImportError:
     dcc = None
     html = None
 
+logger = logging.getLogger(__name__)
+
 def rgb_to_hex(color):
     # Convert a tuple of RGB values to a hex string
     r, g, b = [int(c * 255) for c in color]
@@ -102,7 +120,14 @@ def get_hovertemplate(fields_in_customdata, is_trajectory=False):
 
     return hovertemplate
 
-def get_nodes_and_options(data, visual_dir, visualization_model=const.TSNE):
+def get_nodes_and_options(data, visual_dir, visualization_model=const.TSNE, load_figure: bool = True,
+                          projection_engine: str = "knn"):
+    r"""Prepare the trajectories, colors and dropdown options of a dataset for the Dash servers.
+
+    `node2trace` is a `TraceStore`, which reads the trajectory of a node only when it is accessed. The full animated
+    figure is only deserialized if `load_figure` is True; otherwise None is returned in its place. The dropdown options
+    are returned as a `NodeSearchIndex`, which the servers query as the user types.
+    """
     dataset_name: str = data['dataset_name']
     model: str = data['model_name']
     annotation: dict = data.get("annotation", {})
@@ -127,40 +152,29 @@ def get_nodes_and_options(data, visual_dir, visualization_model=const.TSNE):
     idx2node = {idx: node for node, idx in node2idx.items()}
 
 
-    visualization_name = f"{dataset_name}_{model}_{visualization_model}_perplex{perplexity}_nn{data['num_nearest_neighbors'][0]}_interpolation{interpolation}_snapshot{idx_reference_snapshot}"
-    start_time = time.time()
-    print("Reading visualization cache...")
+    visualization_name = get_visualization_name(dataset_name, model, visualization_model, perplexity,
+                                                data['num_nearest_neighbors'][0], interpolation, idx_reference_snapshot,
+                                                projection_engine)
+    visualization_name = resolve_visualization_name(visual_dir, visualization_name)
+    # Durations of the stages are served at `/metrics` by the Dash servers
+    startup = StartupTimer(dataset_name)
+    startup.stage("cache_read", "Reading visualization cache ...")
 
     path = osp.join(visual_dir, f"Trajectory_{visualization_name}.json")
 
     get_modified_time_of_file(path)
-    fig_cached = pio.read_json(path)
-
-    end_time = time.time()
-
-    execution_time = end_time - start_time
-    print(f"Function execution time: {execution_time} seconds")
-    start_time = time.time()
-    
-    print("Generating node2trace...")
-    start_time = time.time()
-    node2trace = {
-        trace['name'].split(' ')[0]: trace for trace in fig_cached.data
-    }
-    end_time = time.time()
-
-    execution_time = end_time - start_time
-    print(f"Function execution time: {execution_time} seconds")
-    start_time = time.time()
-    print("Getting candidate nodes ...")
+    fig_cached = pio.read_json(path) if load_figure else None
+
+    startup.stage("node2trace", "Opening the trace store ...")
+    node2trace = load_trace_store(visual_dir, visualization_name)
+
+    startup.stage("nodes", "Getting candidate nodes ...")
 
     if dataset_name in ["DGraphFin"]:
         nodes = [n for n, l in node2label.items() if l in [0, 1]]
     else:
         nodes = list(node2idx.keys())
 
-    options = []
-
     # If there are multiple node categories, we can display a distinct color family for each type of nodes
     # NOTE: We specifically require that the first color palette is Blue (for normal nodes) and the second one is Red (for anomalous nodes)
     if display_node_type:
@@ -173,73 +187,33 @@ def get_nodes_and_options(data, visual_dir, visualization_model=const.TSNE):
         label2colors = {
             0: get_colors(10, "Spectral")
         }
-    end_time = time.time()
-
-    execution_time = end_time - start_time
-    print(f"Function execution time: {execution_time} seconds")
-    start_time = time.time()
-    print("Adding categories to the dropdown menu ...")
-    options_categories = []
-
-    for label, nodes_li in label2node.items():
-        options_categories.append({
-            "label": html.Span(
-                [
-                    "✨",
-                    html.Span(label, style={
-                        'font-size': 15,
-                        'padding-left': 10
-                    }),
-                ], style={
-                    'align-items': 'center',
-                    'justify-content': 'center'
-                }
-            ),
-            "value": label,
-        })
-
-    print("Adding nodes to the dropdown menu ...")
-
-    options_nodes = []
+
+    startup.stage("options", "Indexing nodes for the dropdown menu ...")
+
+    projected_node_set = set(projected_nodes)
+    node2name = {}
 
     for node, idx in node2idx.items():
         # Only add trajectories of projected or reference nodes
-        if not node in projected_nodes:
+        if node not in projected_node_set:
             continue
 
 
         # For the DGraphFin dataset, the background nodes (label = 2 or 3) are not meaningful due to insufficient information. So we do not visualize them
         if display_node_type and dataset_name in [
             "DGraphFin"] and node2label.get(node) is None:
-            print(f"\tIgnoring node {node} ...")
+            logger.debug(f"Ignoring node {node} ...")
             continue
 
         if display_node_type:
             label = node2label[node]
 
-            name = f"{node} ({label})"
+            node2name[node] = f"{node} ({label})"
 
         else:
-            name = node
-
-        options_nodes.append({
-            "label": html.Span(
-                [
-                    html.Span(name, style={
-                        'font-size': 15,
-                        'padding-left': 10
-                    }),
-                ], style={
-                    'align-items': 'center',
-                    'justify-content': 'center'
-                }
-            ),
-            "value": node,  # Get a random node as the default value.
-        })
-    end_time = time.time()
-
-    execution_time = end_time - start_time
-    print(f"Function execution time: {execution_time} seconds")
-
-    options = options_categories + options_nodes
-    return nodes, node2trace, label2colors, options, fig_cached
\ No newline at end of file
+            node2name[node] = node
+
+    node_search = NodeSearchIndex(list(label2node.keys()), node2name)
+    startup.finish()
+
+    return nodes, node2trace, label2colors, node_search, fig_cached
\ No newline at end of file
@@ -0,0 +1,203 @@
+"""Coalescing and admission control of the expensive work of the Dash apps.
+
+When several users select the same heavy category at once, each callback would build the same fragments in parallel,
+multiplying the work and the memory it takes. Two mechanisms bound this:
+
+- `SingleFlight` coalesces identical computations: while a fragment is being built, other requests for it wait for
+  and share the result instead of building it again.
+- `WorkQueue` limits how many callbacks of each operation (e.g. `add-trajectory`, `projection`) run at once. Further
+  requests wait in a bounded queue. When the queue is full, or a request waited too long for a slot, it is rejected
+  with `Busy`, which the app shows as a "server busy" message instead of piling up work.
+
+Queue depths, running requests, wait times, rejections and coalesced computations are served at `/metrics`.
+"""
+
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    from .metrics import REGISTRY
+    from .utils import ForkSafeLock
+except ImportError:
+    from visualization.metrics import REGISTRY
+    from visualization.utils import ForkSafeLock
+
+QUEUE_DEPTH = REGISTRY.gauge("dygetviz_queue_depth", "Requests waiting for a slot, by operation", ("operation",))
+QUEUE_RUNNING = REGISTRY.gauge("dygetviz_queue_running", "Requests holding a slot, by operation", ("operation",))
+QUEUE_WAIT_SECONDS = REGISTRY.histogram("dygetviz_queue_wait_seconds", "Time that requests waited for a slot",
+                                        ("operation",))
+QUEUE_REJECTED = REGISTRY.counter("dygetviz_queue_rejected_total", "Requests rejected because the server was busy",
+                                  ("operation",))
+COALESCED = REGISTRY.counter("dygetviz_coalesced_total",
+                             "Computations that were shared with an identical one in flight", ("name",))
+
+
+class Busy(Exception):
+    r"""Raised when an operation is rejected because too many requests are running or waiting.
+
+    Args:
+        operation (str): Name of the operation
+    """
+
+    def __init__(self, operation: str):
+        super().__init__(f"The server is busy with other {operation} requests. Please try again in a moment.")
+        self.operation = operation
+
+
+def parse_limits(spec: str) -> dict:
+    """Concurrency limits per operation from a string like `add-trajectory:4,projection:2`."""
+    limits = {}
+    for item in spec.split(","):
+        if item.strip():
+            operation, limit = item.rsplit(":", 1)
+            limits[operation.strip()] = int(limit)
+
+    return limits
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    r"""Thread-safe coalescing of identical computations that are in flight at the same time.
+
+    Args:
+        name (str): Name of the computations, as a label of `/metrics`
+    """
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self._reset()
+
+        # Background jobs run in forked processes, which would inherit the computations of the server's threads
+        self._lock = ForkSafeLock(on_fork=self._reset)
+
+    def _reset(self):
+        self._flights = {}
+        self.coalesced = 0
+
+    def do(self, key, compute):
+        r"""The result of `compute`, shared with all calls for `key` while it runs.
+
+        Args:
+            key: Identifies the computation. Must be hashable
+            compute: Called without arguments if no computation for `key` is in flight
+
+        Returns:
+            The result of `compute`. An exception raised by `compute` is raised in every call that waited for it
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            COALESCED.inc(name=self.name)
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = compute()
+            return flight.result
+
+        except BaseException as error:
+            flight.error = error
+            raise
+
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+class WorkQueue:
+    r"""Thread-safe admission control with a concurrency limit and a bounded queue per operation.
+
+    Args:
+        limits (dict): Maximum number of requests of each operation that run at once. Operations without a limit are
+            not queued
+        max_waiting (int): Maximum number of requests of an operation that wait for a slot. Further requests are
+            rejected
+        timeout (float): Seconds that a request waits for a slot before it is rejected
+    """
+
+    def __init__(self, limits: dict, max_waiting: int = 16, timeout: float = 10.):
+        self.limits = {operation: limit for operation, limit in limits.items() if limit > 0}
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+
+        self._running = defaultdict(int)
+        self._waiting = defaultdict(int)
+        self._condition = threading.Condition()
+
+        self.rejected = defaultdict(int)
+
+    def _update_gauges(self, operation: str):
+        QUEUE_DEPTH.set(self._waiting[operation], operation=operation)
+        QUEUE_RUNNING.set(self._running[operation], operation=operation)
+
+    def _reject(self, operation: str):
+        self.rejected[operation] += 1
+        QUEUE_REJECTED.inc(operation=operation)
+        raise Busy(operation)
+
+    @contextmanager
+    def slot(self, operation: str):
+        r"""Hold a slot of `operation` while the block runs, waiting for one if all are taken.
+
+        Raises:
+            Busy: If the queue of the operation is full, or no slot was free within `timeout`
+        """
+        limit = self.limits.get(operation)
+        if limit is None:
+            yield
+            return
+
+        start = time.perf_counter()
+        with self._condition:
+            if self._running[operation] >= limit:
+                if self._waiting[operation] >= self.max_waiting:
+                    self._reject(operation)
+
+                self._waiting[operation] += 1
+                self._update_gauges(operation)
+                try:
+                    has_slot = self._condition.wait_for(lambda: self._running[operation] < limit, self.timeout)
+                finally:
+                    self._waiting[operation] -= 1
+
+                if not has_slot:
+                    self._update_gauges(operation)
+                    self._reject(operation)
+
+            self._running[operation] += 1
+            self._update_gauges(operation)
+
+        QUEUE_WAIT_SECONDS.observe(time.perf_counter() - start, operation=operation)
+
+        try:
+            yield
+
+        finally:
+            with self._condition:
+                self._running[operation] -= 1
+                self._update_gauges(operation)
+                self._condition.notify_all()
+
+    def get_stats(self) -> dict:
+        """Running and waiting requests, and rejections, of each operation."""
+        with self._condition:
+            return {operation: {"limit": limit, "running": self._running[operation],
+                                "waiting": self._waiting[operation], "rejected": self.rejected[operation]} for
+                    operation, limit in self.limits.items()}
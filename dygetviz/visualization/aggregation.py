@@ -0,0 +1,242 @@
+"""Aggregated rendering of node categories for the Dash apps.
+
+Selecting a category used to add one trajectory per member node, which means tens of thousands of traces for large
+labels. With `--category_rendering aggregate`, a category is drawn as two traces instead: the median path of its
+members and a band around it. At each snapshot, the band's radius is a percentile of the members' distances to the
+median, so the band with the default 75th percentile covers the closest 75% of the members.
+
+Aggregates are computed with vectorized NumPy over a (#snapshots, #members, 2) array of member coordinates, in which
+absent members are NaN, and cached per category and projection setting. The style of the traces is built once per
+category and color as a ready-to-send dictionary, like the templates of `trace_store.make_trace_template`.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+from matplotlib import colors as mcolors
+
+try:
+    from .utils import ForkSafeLock
+except ImportError:
+    from visualization.utils import ForkSafeLock
+
+
+def stack_member_coords(member_traces, presence: np.ndarray) -> np.ndarray:
+    r"""Stack the trajectories of the members of a category into one array.
+
+    Args:
+        member_traces (list): Trajectory (trace or dict) of each member. A trajectory has one point per snapshot in
+            which the member is present
+        presence (np.ndarray): Whether each member is present in each snapshot, (#snapshots, #members)
+
+    Returns:
+        np.ndarray: Coordinates of the members, (#snapshots, #members, 2). NaN where a member is absent
+    """
+
+    presence = np.asarray(presence, dtype=bool)
+    coords = np.full(presence.shape + (2,), np.nan)
+
+    for idx_member, trace in enumerate(member_traces):
+        idx_snapshots = presence[:, idx_member].nonzero()[0]
+        coords[idx_snapshots, idx_member, 0] = np.asarray(trace['x'], dtype=np.float64)[:len(idx_snapshots)]
+        coords[idx_snapshots, idx_member, 1] = np.asarray(trace['y'], dtype=np.float64)[:len(idx_snapshots)]
+
+    return coords
+
+
+def aggregate_trajectories(coords: np.ndarray, percentile: float = 75., num_samples: int = 0) -> dict:
+    r"""Median path and percentile band of a set of trajectories.
+
+    Args:
+        coords (np.ndarray): Coordinates of the members, (#snapshots, #members, 2). NaN where a member is absent
+        percentile (float): The band's radius at a snapshot is this percentile of the members' distances to the median
+        num_samples (int): Number of representative members to pick, i.e. the members closest to the median path on
+            average
+
+    Returns:
+        dict: `median` (#snapshots, 2), `radius` (#snapshots,) and `count` (#snapshots,) of present members. The median
+            and radius are NaN at snapshots without members. `representatives` holds the indices of the picked members.
+    """
+
+    coords = np.asarray(coords, dtype=np.float64)
+    present = ~np.isnan(coords[..., 0])
+    count = present.sum(axis=1)
+
+    median = np.full((coords.shape[0], 2), np.nan)
+    radius = np.full(coords.shape[0], np.nan)
+
+    nonempty = count > 0
+    if nonempty.any():
+        median[nonempty] = np.nanmedian(coords[nonempty], axis=1)
+
+    distances = np.linalg.norm(coords - median[:, None, :], axis=2)
+    if nonempty.any():
+        radius[nonempty] = np.nanpercentile(distances[nonempty], percentile, axis=1)
+
+    representatives = np.zeros(0, dtype=np.int64)
+    if num_samples > 0 and coords.shape[1] > 0:
+        with np.errstate(invalid='ignore'):
+            mean_distances = np.nansum(distances, axis=0) / present.sum(axis=0)
+
+        mean_distances[~np.isfinite(mean_distances)] = np.inf
+        representatives = np.argsort(mean_distances, kind='stable')[:num_samples]
+        representatives = representatives[np.isfinite(mean_distances[representatives])]
+
+    return dict(median=median, radius=radius, count=count, representatives=representatives)
+
+
+def get_band_polygon(median: np.ndarray, radius: np.ndarray):
+    r"""Outline of the band around a path, as a closed polygon.
+
+    The path is offset by `radius` on both sides along its normals. The polygon runs along one side and back along the
+    other.
+
+    Args:
+        median (np.ndarray): Points of the path, (#points, 2)
+        radius (np.ndarray): Radius of the band at each point, (#points,)
+
+    Returns:
+        tuple: x and y coordinates of the polygon
+    """
+
+    if len(median) == 0:
+        return np.zeros(0), np.zeros(0)
+
+    if len(median) == 1:
+        tangent = np.array([[1., 0.]])
+    else:
+        tangent = np.gradient(median, axis=0)
+
+    norm = np.linalg.norm(tangent, axis=1, keepdims=True)
+    normal = np.divide(np.stack([-tangent[:, 1], tangent[:, 0]], axis=1), norm, out=np.zeros_like(tangent),
+                       where=norm > 0)
+
+    left = median + normal * radius[:, None]
+    right = median - normal * radius[:, None]
+    polygon = np.concatenate([left, right[::-1], left[:1]])
+
+    return polygon[:, 0], polygon[:, 1]
+
+
+def get_category_points(aggregate: dict, name: str, snapshot_names: list) -> dict:
+    r"""Per-point fields of the traces that display the aggregate of a category.
+
+    Args:
+        aggregate (dict): Output of `aggregate_trajectories`
+        name (str): Displayed name of the category
+        snapshot_names (list): Name of each snapshot
+
+    Returns:
+        dict: Fields of the `band` and `median` traces
+    """
+
+    nonempty = aggregate['count'] > 0
+    median = aggregate['median'][nonempty]
+    band_x, band_y = get_band_polygon(median, aggregate['radius'][nonempty])
+
+    hovertext = [f"{name} | Snapshot: {snapshot_names[idx]} | Median of {aggregate['count'][idx]} nodes" for idx in
+                 nonempty.nonzero()[0]]
+
+    return dict(band=dict(x=band_x, y=band_y, hovertext=None),
+                median=dict(x=median[:, 0], y=median[:, 1], hovertext=hovertext))
+
+
+def get_category_templates(name: str, color: str, percentile: float = 75.) -> dict:
+    r"""Ready-to-send styles of the traces that display the aggregate of a category, without their points.
+
+    Like the templates of `trace_store.make_trace_template`, they are plain dictionaries that are never validated, and
+    must not be modified.
+
+    Args:
+        name (str): Displayed name of the category
+        color (str): Color of the median path. The band has the same color, but translucent
+        percentile (float): Percentile used for the band, for its name
+
+    Returns:
+        dict: `band` and `median` templates
+    """
+
+    fillcolor = "rgba({:.0f}, {:.0f}, {:.0f}, 0.25)".format(*(np.array(mcolors.to_rgb(color)) * 255))
+
+    band = dict(type='scatter', fill='toself', fillcolor=fillcolor, line=dict(width=0), mode='lines',
+                hoverinfo='skip', name=f"{name} (p{percentile:g} band)", legendgroup=str(name), showlegend=False)
+
+    median = dict(type='scatter', mode='lines+markers', line=dict(color=color, width=4), marker=dict(size=6),
+                  name=f"{name} (median)", legendgroup=str(name), hovertemplate='<b>%{hovertext}</b><extra></extra>')
+
+    return dict(band=band, median=median)
+
+
+def get_category_traces(aggregate: dict, name: str, color: str, snapshot_names: list, percentile: float = 75.) -> dict:
+    r"""Traces that display the aggregate of a category.
+
+    Args:
+        aggregate (dict): Output of `aggregate_trajectories`
+        name (str): Displayed name of the category
+        color (str): Color of the median path. The band has the same color, but translucent
+        snapshot_names (list): Name of each snapshot
+        percentile (float): Percentile used for the band, for its name
+
+    Returns:
+        dict: `band` and `median` trace dictionaries
+    """
+
+    points = get_category_points(aggregate, name, snapshot_names)
+    templates = get_category_templates(name, color, percentile)
+
+    return {part: {**templates[part], **points[part]} for part in templates}
+
+
+class CategoryAggregator:
+    r"""Thread-safe cache of the aggregates of node categories, and of the templates of their traces.
+
+    Args:
+        percentile (float): Percentile of the members' distances to the median that bounds the band
+        num_samples (int): Number of representative members picked for each category
+        max_cache_size (int): Maximum number of cached aggregates, and of cached templates
+    """
+
+    def __init__(self, percentile: float = 75., num_samples: int = 0, max_cache_size: int = 256):
+        self.percentile = percentile
+        self.num_samples = num_samples
+        self.max_cache_size = max_cache_size
+        self._cache = OrderedDict()
+        self._templates = OrderedDict()
+        self._lock = ForkSafeLock()
+
+    def _get_cached(self, cache: OrderedDict, key, build):
+        with self._lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+                return value
+
+        value = build()
+
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.max_cache_size:
+                cache.popitem(last=False)
+
+        return value
+
+    def get(self, key, get_coords) -> dict:
+        r"""The aggregate of a category.
+
+        Args:
+            key: Identifies the category and the coordinates, e.g. (label, nn, interpolation)
+            get_coords: Called without arguments on a cache miss. Returns the member coordinates, (#snapshots,
+                #members, 2)
+
+        Returns:
+            dict: Output of `aggregate_trajectories`
+        """
+
+        return self._get_cached(self._cache, key,
+                                lambda: aggregate_trajectories(get_coords(), self.percentile, self.num_samples))
+
+    def get_templates(self, name: str, color: str) -> dict:
+        """The `band` and `median` templates of a category, see `get_category_templates`."""
+        return self._get_cached(self._templates, (name, color),
+                                lambda: get_category_templates(name, color, self.percentile))
@@ -57,7 +57,7 @@ def get_dataframe_for_visualization(z, args, nodes_li, idx_reference_node, **kwa
         )
         embedding_train = visualization_model.fit_transform(z)
 
-    position = np.array(embedding_train.tolist()) if args.visualization_model == const.TSNE else embedding_train[:, :args.visualization_dim]
+    position = np.asarray(embedding_train) if args.visualization_model == const.TSNE else embedding_train[:, :args.visualization_dim]
 
     df_visual = pd.DataFrame(position, columns=['x', 'y'])
 
@@ -71,34 +71,8 @@ def get_dataframe_for_visualization(z, args, nodes_li, idx_reference_node, **kwa
         const.IDX_NODE: 'int32',
     })
 
-    def process_row(row):
-        node = row["node"]
-        idx_node = row[const.IDX_NODE]
-        name = ""
-        if node in highlighted_nodes:
-            return {
-                'node_size': 60,
-                'node_color': node_type_to_color['highlighted'],
-                'node_type': 'highlighted',
-                'display_name': node
-            }
-
-        if plot_anomaly_labels and node2label[node] == 1:
-            return {
-                'node_size': 5,
-                'node_color': node_type_to_color['anomaly'],
-                'node_type': 'anomaly',
-                'display_name': ""
-            }
-
-        return {
-            'node_size': 5,
-            'node_color': node_type_to_color['background'],
-            'node_type': 'background',
-            'display_name': name
-        }
-
-    df_visual = pd.concat([df_visual, df_visual.apply(process_row, axis=1, result_type="expand")], axis=1)
+    df_visual = pd.concat([df_visual, get_node_styles(df_visual[const.NODE].values, highlighted_nodes,
+                                                      plot_anomaly_labels, node2label)], axis=1)
 
     if metadata_df is not None:
 
@@ -107,4 +81,44 @@ def get_dataframe_for_visualization(z, args, nodes_li, idx_reference_node, **kwa
     return {
         'df_visual': df_visual,
         "embedding": embedding_train,
-    }
\ No newline at end of file
+    }
+
+
+def get_node_styles(nodes: np.ndarray, highlighted_nodes, plot_anomaly_labels: bool, node2label: dict) -> pd.DataFrame:
+    r"""Assign the size, color, type and display name of each anchor node with vectorized masks.
+
+    Highlighted nodes take precedence over anomalous nodes. All other nodes are background nodes.
+
+    Returns:
+        pd.DataFrame: with columns `node_size`, `node_color`, `node_type` (categorical) and `display_name`
+    """
+
+    nodes = np.asarray(nodes).astype(str)
+
+    is_highlighted = np.isin(nodes, np.asarray(highlighted_nodes).astype(str))
+
+    if plot_anomaly_labels:
+        is_anomaly = (pd.Series(nodes).map(node2label) == 1).values & ~is_highlighted
+    else:
+        is_anomaly = np.zeros(len(nodes), dtype=bool)
+
+    node_type = np.full(len(nodes), 'background', dtype=object)
+    node_type[is_anomaly] = 'anomaly'
+    node_type[is_highlighted] = 'highlighted'
+
+    node_size = np.full(len(nodes), node_type_to_size['background'], dtype=np.uint8)
+    node_size[is_highlighted] = node_type_to_size['highlighted']
+
+    display_name = np.full(len(nodes), "", dtype=object)
+    display_name[is_highlighted] = nodes[is_highlighted]
+
+    # Only the observed types become categories, so that plotly does not create empty traces for unused colors. They
+    # are ordered by their first appearance, like the values of an object column, which sets the order of the traces
+    node_type = pd.Categorical(node_type, categories=pd.unique(node_type))
+
+    return pd.DataFrame({
+        'node_size': node_size,
+        'node_color': node_type.rename_categories([node_type_to_color[t] for t in node_type.categories]),
+        'node_type': node_type,
+        'display_name': pd.Categorical(display_name, categories=pd.unique(display_name)),
+    })
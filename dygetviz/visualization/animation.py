@@ -0,0 +1,199 @@
+"""Animation frames of a cached trajectory figure, served one snapshot at a time.
+
+The cached figures (`Trajectory_*.json`) hold one plotly animation frame per snapshot, each with the background and
+every trajectory up to that snapshot. Embedding them in the figure makes the browser download all frames, i.e. the
+trajectories once per snapshot, before anything is displayed. The multi-dataset servers instead display a single
+snapshot and move between snapshots with a server-side time slider. Each slider position sends only the delta of that
+snapshot: the points of the displayed trajectories up to the snapshot, and the background if it changes across
+snapshots.
+
+Deltas are kept in a bounded LRU cache. After a snapshot is requested, its neighbours are built in a background
+thread, so that stepping through the slider is served from the cache.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    from .payload import encode_trace
+    from .trajectory_cache import decode_plotly_array
+except ImportError:
+    from visualization.payload import encode_trace
+    from visualization.trajectory_cache import decode_plotly_array
+
+# Fields of a trace that change between animation frames
+POINT_FIELDS = ("x", "y", "text", "hovertext", "customdata")
+
+# Layout properties of the embedded plotly animation, i.e. its slider and play buttons
+ANIMATION_LAYOUT_FIELDS = ("sliders", "updatemenus")
+
+
+def _decode_points(trace: dict) -> dict:
+    # Typed arrays read from the cache are decoded, so that they are re-encoded in the format of the Dash apps
+    return {field: decode_plotly_array(values) if field in POINT_FIELDS and isinstance(values, dict) else values for
+            field, values in trace.items()}
+
+
+def _equal_points(trace_a, trace_b) -> bool:
+    for field in POINT_FIELDS:
+        values_a, values_b = trace_a[field], trace_b[field]
+        if values_a is None or values_b is None:
+            if values_a is not values_b:
+                return False
+
+        elif not np.array_equal(np.asarray(values_a, dtype=object), np.asarray(values_b, dtype=object)):
+            return False
+
+    return True
+
+
+def get_slider_marks(names: list, max_marks: int = 12) -> dict:
+    """Marks of a `dcc.Slider` over snapshots, labeling at most `max_marks` evenly spaced snapshots and the last one."""
+    step = max(1, int(np.ceil(len(names) / max_marks)))
+    marks = {idx: str(names[idx]) for idx in range(0, len(names), step)}
+    if names:
+        marks[len(names) - 1] = str(names[-1])
+    return marks
+
+
+class SnapshotFrames:
+    r"""Thread-safe access to the animation frames of a cached trajectory figure, one snapshot at a time.
+
+    Traces are matched across frames by name. Traces whose points are the same in every frame, e.g. the background,
+    are static and only sent with the figure.
+
+    Args:
+        fig (go.Figure): The cached figure, with one frame per snapshot
+        max_size (int): Maximum number of deltas held in memory
+        decimals (int): Round coordinates to this many decimals. None keeps the precision of 32-bit floats
+        prefetch (int): Number of snapshots on each side of a requested snapshot to build in the background
+    """
+
+    def __init__(self, fig, max_size: int = 64, decimals: int = None, prefetch: int = 1):
+        self.max_size = max_size
+        self.decimals = decimals
+        self.prefetch = prefetch
+
+        self.names = [str(frame.name) if frame.name is not None else str(idx) for idx, frame in enumerate(fig.frames)]
+
+        # Traces of each frame by name
+        self._frames = [{trace["name"]: trace for trace in frame.data} for frame in fig.frames]
+
+        self.dynamic_traces = set()
+        for name, trace in (self._frames[-1].items() if self._frames else []):
+            if any(frame.get(name) is None or not _equal_points(frame[name], trace) for frame in self._frames[:-1]):
+                self.dynamic_traces.add(name)
+
+        self.layout = {field: value for field, value in fig.layout.to_plotly_json().items() if
+                       field not in ANIMATION_LAYOUT_FIELDS}
+
+        # Traces of the figure, in display order. The points of the dynamic ones are filled in from a frame
+        self._templates = []
+        for trace in fig.data:
+            trace = trace.to_plotly_json()
+            if trace.get("name") in self.dynamic_traces:
+                trace = {field: values for field, values in trace.items() if field not in POINT_FIELDS}
+            self._templates += [encode_trace(_decode_points(trace), decimals)]
+
+        self._cache = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def get_points(self, idx_snapshot: int, names=None) -> dict:
+        r"""The points of the dynamic traces at a snapshot, e.g. to update a `go.Figure`.
+
+        Args:
+            idx_snapshot (int): Index of the frame
+            names: Names of the traces to return. None returns all dynamic traces
+
+        Returns:
+            dict: Maps the name of each trace to its per-point fields
+        """
+        points = {}
+        for name, trace in self._frames[idx_snapshot].items():
+            if name in self.dynamic_traces and (names is None or name in names):
+                points[name] = _decode_points({field: trace[field] for field in POINT_FIELDS if trace[field] is not None})
+
+        return points
+
+    def _build_delta(self, idx_snapshot: int) -> dict:
+        return {name: encode_trace(fields, self.decimals) for name, fields in self.get_points(idx_snapshot).items()}
+
+    def _put(self, idx_snapshot: int, delta: dict):
+        with self._lock:
+            self._cache[idx_snapshot] = delta
+            self._cache.move_to_end(idx_snapshot)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def _prefetch(self, idx_snapshots: list):
+        for idx_snapshot in idx_snapshots:
+            delta = self._build_delta(idx_snapshot)
+            self._put(idx_snapshot, delta)
+            with self._lock:
+                self._pending.discard(idx_snapshot)
+                self.prefetched += 1
+
+    def _start_prefetch(self, idx_snapshot: int):
+        neighbours = [idx_snapshot + offset * sign for offset in range(1, self.prefetch + 1) for sign in [1, -1]]
+        with self._lock:
+            neighbours = [idx for idx in neighbours if
+                          0 <= idx < len(self) and idx not in self._cache and idx not in self._pending]
+            self._pending.update(neighbours)
+
+        if neighbours:
+            threading.Thread(target=self._prefetch, args=(neighbours,), daemon=True).start()
+
+    def get_delta(self, idx_snapshot: int, names=None) -> dict:
+        r"""The points of the dynamic traces at a snapshot, encoded to be sent to the browser.
+
+        Deltas are cached and shared between sessions, so they must not be modified.
+
+        Args:
+            idx_snapshot (int): Index of the frame
+            names: Names of the displayed traces. None returns all dynamic traces
+
+        Returns:
+            dict: Maps the name of each trace to its per-point fields
+        """
+        with self._lock:
+            delta = self._cache.get(idx_snapshot)
+            if delta is not None:
+                self._cache.move_to_end(idx_snapshot)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if delta is None:
+            delta = self._build_delta(idx_snapshot)
+            self._put(idx_snapshot, delta)
+
+        if self.prefetch:
+            self._start_prefetch(idx_snapshot)
+
+        if names is None:
+            return delta
+
+        names = set(names)
+        return {name: fields for name, fields in delta.items() if name in names}
+
+    def get_figure(self, idx_snapshot: int = -1) -> dict:
+        """The figure at a snapshot, without the animation frames and controls."""
+        delta = self.get_delta(idx_snapshot % len(self)) if len(self) else {}
+        data = [{**template, **delta.get(template.get("name"), {})} for template in self._templates]
+        return {"data": data, "layout": self.layout}
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._cache), "max_size": self.max_size, "hits": self.hits, "misses": self.misses,
+                    "prefetched": self.prefetched}
+
@@ -0,0 +1,48 @@
+"""Trajectories shipped to the browser, so that the Dash app can add and remove them without a server round-trip.
+
+With `--trajectory_toggling clientside`, the page carries the trajectories of every node that can be selected, in two
+`dcc.Store` components: their styling and labels, which never change, and their coordinates, which the server only
+re-sends when the projection controls change. The clientside callbacks in `assets/trajectories.js` then add, remove
+and recolour trajectories, and toggle background labels, in the browser.
+
+Coordinates are sent as base64 typed arrays in plotly's format (`{"dtype": "f4", "bdata": ...}`), concatenated over all
+nodes, which is about a third of the size of JSON lists of floats.
+"""
+
+import json
+
+import numpy as np
+from plotly.utils import PlotlyJSONEncoder
+
+try:
+    from .payload import encode_typed_array
+except ImportError:
+    from visualization.payload import encode_typed_array
+
+
+def pack_coordinates(node2coords: dict) -> dict:
+    r"""Concatenate the trajectories of several nodes into typed arrays.
+
+    Args:
+        node2coords (dict): Maps each node to the x and y coordinates of its trajectory
+
+    Returns:
+        dict: `nodes`, and the x and y coordinates of the i-th node at `offsets[i]:offsets[i + 1]` of `x` and `y`
+    """
+
+    nodes = list(node2coords)
+    lengths = [len(node2coords[node][0]) for node in nodes]
+    x = [np.asarray(node2coords[node][0], dtype=np.float32) for node in nodes]
+    y = [np.asarray(node2coords[node][1], dtype=np.float32) for node in nodes]
+
+    return {
+        "nodes": nodes,
+        "offsets": np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]).tolist(),
+        "x": encode_typed_array(np.concatenate(x) if x else []),
+        "y": encode_typed_array(np.concatenate(y) if y else []),
+    }
+
+
+def get_payload_size(payload) -> int:
+    """Number of bytes of a payload when sent to the browser."""
+    return len(json.dumps(payload, cls=PlotlyJSONEncoder))
@@ -0,0 +1,65 @@
+"""Shared, read-only data plane for serving the Dash apps with several worker processes.
+
+Under a multi-process WSGI server (see `wsgi.py`), every worker would otherwise hold its own copy of the arrays the
+callbacks read: node presence, the neighbor index and the background coordinates. `SharedArrays` writes each array
+once as an `.npy` file next to the visualization cache and maps it read-only, so all workers read the same pages of the
+OS page cache. The trajectories are already memory-mapped through the trace store.
+"""
+
+import os
+import os.path as osp
+
+import numpy as np
+
+
+class SharedArrays:
+    r"""Directory of `.npy` files that processes map read-only.
+
+    An array is built and written the first time it is attached, and again whenever its file is older than
+    `reference_path`, e.g. after the visualization cache was rebuilt.
+
+    Args:
+        directory (str): Directory of the array files
+        reference_path (str): Arrays written before this file was modified are rebuilt
+    """
+
+    def __init__(self, directory: str, reference_path: str = None):
+        self.directory = directory
+        self.reference_path = reference_path
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, name: str) -> str:
+        return osp.join(self.directory, f"{name}.npy")
+
+    def is_stale(self, name: str) -> bool:
+        path = self.get_path(name)
+
+        if not osp.exists(path):
+            return True
+
+        return self.reference_path is not None and osp.exists(self.reference_path) and osp.getmtime(
+            path) < osp.getmtime(self.reference_path)
+
+    def attach(self, name: str, build) -> np.ndarray:
+        r"""Map an array read-only, writing it first if needed.
+
+        Args:
+            name (str): Name of the array
+            build: Called without arguments if the file is missing or stale. Returns the array, which must not have an
+                object dtype
+
+        Returns:
+            np.ndarray: The array, memory-mapped read-only
+        """
+
+        if self.is_stale(name):
+            array = np.asarray(build())
+            if array.dtype == object:
+                raise ValueError(f"Cannot share the object array {name}")
+
+            # Write to a temporary file first, so that other processes never map a partially written file
+            path_tmp = f"{self.get_path(name)}.{os.getpid()}.tmp.npy"
+            np.save(path_tmp, array)
+            os.replace(path_tmp, self.get_path(name))
+
+        return np.load(self.get_path(name), mmap_mode='r')
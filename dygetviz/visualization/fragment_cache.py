@@ -0,0 +1,145 @@
+"""Cache of figure fragments for the Dash apps.
+
+Many users open the same dataset and add the same popular nodes. The traces that the callbacks send for these --
+the background of the initial figure, and each trajectory for a given color and projection setting -- are identical
+across sessions, so they are built once and kept in a bounded LRU cache in memory. An optional on-disk tier keeps them
+across restarts and between the worker processes of a WSGI server.
+
+Numeric arrays in cached fragments are NumPy arrays, which Dash sends as base64 typed arrays instead of JSON lists.
+Cached fragments are shared between sessions and must not be modified.
+"""
+
+import hashlib
+import json
+import os
+import os.path as osp
+import pickle
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    from .utils import ForkSafeLock
+except ImportError:
+    from visualization.utils import ForkSafeLock
+
+# Per-point fields that are converted to NumPy arrays before caching
+NUMERIC_FIELDS = ("x", "y")
+
+
+def get_fragment_key(*parts) -> str:
+    """A stable key for the parts that determine a fragment, e.g. (visualization name, node, color, nn)."""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def pack_trace(trace: dict) -> dict:
+    """A copy of a trace dict whose coordinate lists are NumPy arrays. Lists with missing values are kept."""
+    packed = dict(trace)
+
+    for field in NUMERIC_FIELDS:
+        values = packed.get(field)
+        if isinstance(values, (list, tuple)) and all(isinstance(v, (int, float)) for v in values):
+            packed[field] = np.asarray(values, dtype=np.float64)
+
+    return packed
+
+
+class FragmentCache:
+    r"""Thread-safe LRU cache of figure fragments with an optional on-disk tier.
+
+    Args:
+        max_size (int): Maximum number of fragments held in memory
+        cache_dir (str): Directory of the on-disk tier. None keeps fragments in memory only
+    """
+
+    def __init__(self, max_size: int = 256, cache_dir: str = None):
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self._cache = OrderedDict()
+        self._lock = ForkSafeLock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _get_disk_path(self, key: str) -> str:
+        return osp.join(self.cache_dir, f"{key}.pkl")
+
+    def _put(self, key: str, fragment):
+        with self._lock:
+            self._cache[key] = fragment
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def contains(self, key: str) -> bool:
+        """Whether the fragment for `key` is held in either tier, i.e. `get` would not build it."""
+        with self._lock:
+            if key in self._cache:
+                return True
+
+        return self.cache_dir is not None and osp.exists(self._get_disk_path(key))
+
+    def get(self, key: str, build):
+        r"""The fragment for `key`, built on a miss in both tiers.
+
+        Args:
+            key (str): Key of the fragment, see `get_fragment_key`
+            build: Called without arguments on a miss. Returns the fragment, which must be picklable
+
+        Returns:
+            The fragment
+        """
+
+        with self._lock:
+            if key in self._cache:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        if self.cache_dir is not None and osp.exists(self._get_disk_path(key)):
+            try:
+                with open(self._get_disk_path(key), 'rb') as f:
+                    fragment = pickle.load(f)
+
+            except (OSError, EOFError, pickle.UnpicklingError):
+                fragment = None
+
+            if fragment is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._put(key, fragment)
+                return fragment
+
+        with self._lock:
+            self.misses += 1
+        fragment = build()
+        self._put(key, fragment)
+
+        if self.cache_dir is not None:
+            # Written to a temporary file first, so that other processes never read a partially written fragment
+            path_tmp = f"{self._get_disk_path(key)}.{os.getpid()}.tmp"
+            with open(path_tmp, 'wb') as f:
+                pickle.dump(fragment, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path_tmp, self._get_disk_path(key))
+
+        return fragment
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._cache)
+
+    def get_stats(self) -> dict:
+        """Hit and miss counts of the cache."""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "size": len(self),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups > 0 else 0.,
+        }
@@ -0,0 +1,59 @@
+"""Background jobs for the slow interactions of the Dash app.
+
+Most interactions are answered within a single callback. Selecting a large category or moving the projection sliders
+with many trajectories displayed can however recompute thousands of trajectories, which would block a server worker and
+leave the user without feedback. Such requests are run as Dash background callbacks instead: a separate process builds
+the missing figure fragments into the on-disk tier of the fragment cache and reports its progress, which the app shows
+as a progress bar. Changing the selection or the sliders again cancels the job. When the job is done, the regular
+callback assembles the figure from the cached fragments, so that only the job runs in another process while the
+session state stays on the server.
+
+Jobs use Dash's `DiskcacheManager`, which also caches their results: a repeated request with the same arguments is
+answered without starting a process.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def get_job_manager(cache_dir: str, cache_by=None, expire: int = None):
+    r"""A manager that runs Dash background callbacks in separate processes.
+
+    Args:
+        cache_dir (str): Directory of the disk cache that holds the progress and results of the jobs
+        cache_by (list): Functions without arguments whose return values are part of the key of cached results, e.g.
+            the version of the data
+        expire (int): Seconds after which cached results are removed. None keeps them
+
+    Returns:
+        dash.DiskcacheManager: The manager, or None if `diskcache` is not installed
+    """
+    try:
+        import diskcache
+        from dash import DiskcacheManager
+
+        return DiskcacheManager(diskcache.Cache(cache_dir), cache_by=cache_by, expire=expire)
+
+    except ImportError:
+        logger.warning("Install diskcache, multiprocess and psutil (`pip install dash[diskcache]`) to run slow "
+                       "interactions as background jobs. Running them in the callbacks instead")
+        return None
+
+
+def run_tasks(tasks: list, set_progress=None, num_updates: int = 20):
+    r"""Run tasks in order and report the progress of a background job.
+
+    Args:
+        tasks (list): Functions without arguments
+        set_progress: The first argument of a Dash background callback with `progress`, called with (done, total). None
+            does not report progress
+        num_updates (int): Approximate number of progress reports, since each is written to the disk cache
+    """
+    step = max(1, len(tasks) // num_updates)
+
+    for idx_task, task in enumerate(tasks):
+        task()
+
+        if set_progress is not None and ((idx_task + 1) % step == 0 or idx_task + 1 == len(tasks)):
+            set_progress((idx_task + 1, len(tasks)))
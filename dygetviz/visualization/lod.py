@@ -0,0 +1,100 @@
+"""Viewport-aware level of detail for the background scatter of the Dash apps.
+
+A large background is never sent to the browser in full. `ViewportIndex` buckets the anchor coordinates into a
+uniform grid once at startup. For a viewport, it returns the points inside it, subsampled at the same rate in every
+grid cell so that the displayed density matches the true density, and capped at a point budget. Zooming in leaves fewer
+points in the viewport, so more of them -- eventually all -- are displayed individually.
+"""
+
+import numpy as np
+
+
+class ViewportIndex:
+    r"""Grid index over 2D points for viewport queries with a point budget.
+
+    Points are sorted by grid cell, and shuffled within each cell, so the first `k` points of a cell are a random
+    sample of it. Subsampling a viewport therefore takes a prefix of each overlapping cell.
+
+    Args:
+        x (np.ndarray): x coordinates of the points
+        y (np.ndarray): y coordinates of the points
+        budget (int): Maximum number of points returned by a query
+        grid_size (int): Number of grid cells along each axis
+        seed (int): Seed of the shuffling and the rounding of per-cell sample sizes
+    """
+
+    def __init__(self, x, y, budget: int = 20000, grid_size: int = 256, seed: int = 42):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.budget = budget
+        self.grid_size = grid_size
+
+        self.x_min, self.x_max = self.x.min(), self.x.max()
+        self.y_min, self.y_max = self.y.min(), self.y.max()
+        self.cell_width = max(np.ptp(self.x), 1e-12) / grid_size
+        self.cell_height = max(np.ptp(self.y), 1e-12) / grid_size
+
+        cells = self._cell(self.x, self.x_min, self.cell_width) * grid_size + self._cell(self.y, self.y_min,
+                                                                                       self.cell_height)
+
+        rng = np.random.default_rng(seed)
+        permutation = rng.permutation(len(cells))
+        self.order = permutation[np.argsort(cells[permutation], kind='stable')]
+
+        # CSR layout: the points of cell c are self.order[self.cell_start[c]:self.cell_start[c + 1]]
+        counts = np.bincount(cells, minlength=grid_size * grid_size)
+        self.cell_start = np.concatenate([[0], np.cumsum(counts)])
+
+        # Fixed per-cell offsets for rounding sample sizes, so that a viewport always returns the same points
+        self.cell_offset = rng.random(grid_size * grid_size)
+
+    def _cell(self, values, lo, size):
+        return np.clip(np.floor((values - lo) / size).astype(np.int64), 0, self.grid_size - 1)
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def query(self, x_range=None, y_range=None, budget: int = None) -> np.ndarray:
+        r"""Indices of a density-preserving sample of the points in a viewport.
+
+        Args:
+            x_range (tuple): Visible range of the x axis. Default: everything
+            y_range (tuple): Visible range of the y axis. Default: everything
+            budget (int): Maximum number of points. Default: `self.budget`
+
+        Returns:
+            np.ndarray: Sorted indices of the points to display
+        """
+
+        budget = self.budget if budget is None else budget
+        x_range = x_range or (-np.inf, np.inf)
+        y_range = y_range or (-np.inf, np.inf)
+
+        col_lo, col_hi = self._cell(np.clip(x_range, self.x_min, self.x_max), self.x_min, self.cell_width)
+        row_lo, row_hi = self._cell(np.clip(y_range, self.y_min, self.y_max), self.y_min, self.cell_height)
+        cells = (np.arange(col_lo, col_hi + 1)[:, None] * self.grid_size + np.arange(row_lo, row_hi + 1)[None, :]
+                 ).ravel()
+
+        starts = self.cell_start[cells]
+        counts = self.cell_start[cells + 1] - starts
+
+        # Sample every overlapping cell at the same rate
+        rate = min(1., budget / max(counts.sum(), 1))
+        if rate < 1.:
+            counts = np.floor(counts * rate + self.cell_offset[cells]).astype(np.int64)
+
+        # Concatenate self.order[start:start + count] over the cells
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        indices = self.order[np.repeat(starts, counts) + offsets]
+
+        # Cells on the border of the viewport are only partially visible
+        inside = (self.x[indices] >= x_range[0]) & (self.x[indices] <= x_range[1]) & \
+                 (self.y[indices] >= y_range[0]) & (self.y[indices] <= y_range[1])
+
+        indices = indices[inside]
+
+        # Rounding up in many cells can exceed the budget by a little. Thin out evenly across the cells
+        if len(indices) > budget:
+            indices = indices[np.linspace(0, len(indices) - 1, budget).astype(np.int64)]
+
+        return np.sort(indices)
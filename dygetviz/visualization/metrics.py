@@ -0,0 +1,344 @@
+"""Metrics of the Dash apps, served in the Prometheus text format at `/metrics`.
+
+- Startup: `StartupTimer` records how long each stage of the startup takes, e.g. reading the data or the cache.
+- Callbacks: `install_metrics` times every Dash callback request, labeled by its action (e.g. `add-trajectory`,
+  `click`), in three phases:
+
+  - `parse`: from the start of the request until the callback has read its inputs and session,
+  - `build`: until the callback returns,
+  - `serialize`: until the response is serialized and compressed.
+
+  Callbacks wrapped in `timed_callback` name their action and may end the parse phase with `end_parse`. For other
+  callbacks, the action is the input that triggered them and the whole callback counts as `build`.
+- Responses: the size of each callback and layout response on the wire.
+
+The few metric types needed are implemented here, so that `prometheus_client` is not needed.
+"""
+
+import functools
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 3e5, 1e6, 3e6, 1e7, 3e7)
+
+# Requests that are timed by `install_metrics`
+TIMED_PATHS = ("/_dash-update-component", "/_dash-layout")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+
+    escaped = {name: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for name, value in
+               labels.items()}
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value not in (float('inf'), float('-inf')) else ("+Inf" if value > 0 else "-Inf")
+
+
+class Gauge:
+    r"""A value per combination of labels that can go up and down, e.g. the duration of a startup stage.
+
+    Args:
+        name (str): Name of the metric
+        documentation (str): Description of the metric
+        labelnames (tuple): Names of the labels
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._get_key(labels)] = float(value)
+
+    def inc(self, value: float = 1., **labels):
+        key = self._get_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.) + value
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._get_key(labels), 0.)
+
+    def collect(self) -> list:
+        with self._lock:
+            return [f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_value(value)}" for
+                    key, value in self._values.items()]
+
+
+class Counter(Gauge):
+    """A value per combination of labels that only goes up, e.g. the number of cache hits."""
+
+    type_name = "counter"
+
+
+class Histogram:
+    r"""Distribution of observed values per combination of labels, e.g. of callback latencies.
+
+    Args:
+        name (str): Name of the metric
+        documentation (str): Description of the metric
+        labelnames (tuple): Names of the labels
+        buckets (tuple): Upper bounds of the buckets, in increasing order. A bucket for +Inf is added
+    """
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+        # Count per bucket (not cumulative), sum and count of the observations for each combination of labels
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        idx_bucket = next(idx for idx, bound in enumerate(self.buckets) if value <= bound)
+
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0., 0))
+            counts = list(counts)
+            counts[idx_bucket] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def get_count(self, **labels) -> int:
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), (None, 0., 0))[2]
+
+    def get_sum(self, **labels) -> float:
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), (None, 0., 0))[1]
+
+    def collect(self) -> list:
+        lines = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} "
+                                 f"{cumulative}")
+
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+
+        return lines
+
+
+class MetricsRegistry:
+    """The metrics of a process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = OrderedDict()
+        self._collectors = []
+
+    def _register(self, metric_class, name: str, *args, **kwargs):
+        if name not in self._metrics:
+            self._metrics[name] = metric_class(name, *args, **kwargs)
+        return self._metrics[name]
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def add_collector(self, collector):
+        """Call `collector` without arguments before each rendering, e.g. to copy the hit counts of a cache."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines += metric.collect()
+
+        return "\n".join(lines) + "\n"
+
+
+# Metrics of this process
+REGISTRY = MetricsRegistry()
+
+STARTUP_SECONDS = REGISTRY.gauge("dygetviz_startup_stage_seconds", "Duration of each stage of the startup",
+                                 ("dataset", "stage"))
+CALLBACK_SECONDS = REGISTRY.histogram("dygetviz_callback_seconds",
+                                      "Latency of the Dash callbacks by action and phase (parse, build, serialize, "
+                                      "total)", ("action", "phase"))
+RESPONSE_BYTES = REGISTRY.histogram("dygetviz_response_bytes",
+                                    "Size of the responses of the Dash callbacks and layout on the wire", ("action",),
+                                    buckets=SIZE_BUCKETS)
+
+CACHE_ENTRIES = REGISTRY.gauge("dygetviz_cache_entries", "Number of entries in each cache", ("cache",))
+CACHE_LOOKUPS = REGISTRY.counter("dygetviz_cache_lookups_total", "Lookups in each cache by result",
+                                 ("cache", "result"))
+
+
+class StartupTimer:
+    r"""Times consecutive stages of the startup. Starting a stage ends the previous one.
+
+    Args:
+        dataset (str): Name of the dataset, as a label of the stages
+
+    Attributes:
+        started (list): Names of the stages started so far, in order
+        message (str): Message of the latest stage that has one
+    """
+
+    def __init__(self, dataset: str = ""):
+        self.dataset = dataset
+        self.started = []
+        self.message = None
+        self._stage = None
+        self._start = None
+
+    def stage(self, name: str, message: str = None):
+        r"""Start a stage.
+
+        Args:
+            name (str): Name of the stage, e.g. `load_data`
+            message (str): Logged when the stage starts
+        """
+        self.finish()
+
+        if message is not None:
+            logger.info(message)
+            self.message = message
+
+        self.started.append(name)
+        self._stage = name
+        self._start = time.perf_counter()
+
+    def finish(self):
+        """End the current stage."""
+        if self._stage is None:
+            return
+
+        seconds = time.perf_counter() - self._start
+        STARTUP_SECONDS.set(seconds, dataset=self.dataset, stage=self._stage)
+        logger.debug(f"Stage {self._stage} of {self.dataset}: {seconds:.3f} s")
+        self._stage = None
+
+
+def _get_request_state():
+    """Timings of the current Dash request, or None outside of a timed request."""
+    import flask
+
+    if not flask.has_request_context():
+        return None
+
+    return flask.g.get("dygetviz_metrics")
+
+
+def end_parse(action: str = None):
+    """End the parse phase of the current callback, and name its action, e.g. `add-trajectory` or `click`."""
+    state = _get_request_state()
+    if state is not None:
+        state["parsed"] = time.perf_counter()
+        if action is not None:
+            state["action"] = action
+
+
+def timed_callback(action: str = None):
+    r"""Decorator for Dash callbacks that marks the end of their build phase.
+
+    Args:
+        action (str): Name of the action of the callback. The callback can also name it with `end_parse`
+    """
+
+    def decorator(callback):
+        @functools.wraps(callback)
+        def wrapper(*args, **kwargs):
+            state = _get_request_state()
+            if state is not None and action is not None:
+                state["action"] = action
+
+            try:
+                return callback(*args, **kwargs)
+
+            finally:
+                if state is not None:
+                    state["built"] = time.perf_counter()
+
+        return wrapper
+
+    return decorator
+
+
+def _get_triggered_action(request) -> str:
+    """The input that triggered a callback request, e.g. `dygetviz.relayoutData`, or `initial`."""
+    payload = request.get_json(silent=True) or {}
+    changed = payload.get("changedPropIds") or []
+    return changed[0] if changed else "initial"
+
+
+def install_metrics(server, path: str = "/metrics"):
+    r"""Time the Dash requests of a Flask server and serve the metrics at `path`.
+
+    Install the metrics before `enable_compression`, so that response sizes are measured after compression.
+
+    Args:
+        server (flask.Flask): The server of a Dash app
+        path (str): Path of the metrics endpoint
+    """
+    import flask
+
+    @server.before_request
+    def start_request_timer():
+        if flask.request.path.endswith(TIMED_PATHS):
+            flask.g.dygetviz_metrics = {"start": time.perf_counter()}
+
+    @server.after_request
+    def record_request_metrics(response):
+        state = flask.g.pop("dygetviz_metrics", None)
+        if state is None:
+            return response
+
+        end = time.perf_counter()
+        if flask.request.path.endswith("/_dash-layout"):
+            action = "layout"
+        else:
+            action = state.get("action") or _get_triggered_action(flask.request)
+
+        if "built" in state:
+            parsed = state.get("parsed", state["start"])
+            CALLBACK_SECONDS.observe(parsed - state["start"], action=action, phase="parse")
+            CALLBACK_SECONDS.observe(state["built"] - parsed, action=action, phase="build")
+            CALLBACK_SECONDS.observe(end - state["built"], action=action, phase="serialize")
+
+        CALLBACK_SECONDS.observe(end - state["start"], action=action, phase="total")
+
+        if not response.direct_passthrough:
+            RESPONSE_BYTES.observe(len(response.get_data()), action=action)
+
+        return response
+
+    @server.route(path)
+    def get_metrics():
+        return flask.Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,129 @@
+"""Server-side search for the node picker of the Dash apps.
+
+The dropdown that adds trajectories no longer embeds one option per projected node in the layout. It starts with the
+node categories and the first few nodes, and every keystroke queries `NodeSearchIndex` through the dropdown's
+`search_value`, which returns the top matches. The layout size no longer depends on the number of nodes.
+"""
+
+import bisect
+import itertools
+import re
+
+try:
+    from dash import html
+    HAS_DASH = True
+except ImportError:
+    HAS_DASH = False
+    html = None
+
+
+def make_option(value, name: str, is_category: bool = False) -> dict:
+    """A dropdown option for a node or a node category."""
+    children = [html.Span(name, style={
+        'font-size': 15,
+        'padding-left': 10
+    })]
+
+    if is_category:
+        children = ["✨"] + children
+
+    return {
+        "label": html.Span(children, style={
+            'align-items': 'center',
+            'justify-content': 'center'
+        }),
+        "value": value,
+    }
+
+
+class NodeSearchIndex:
+    r"""Case-insensitive prefix and substring index over the names of nodes and node categories.
+
+    Prefix matches are found by binary search over the sorted names. Substring matches are found by a regular
+    expression scan over all names joined into a single string, which runs in C and stops after enough matches.
+
+    Args:
+        categories (list): Values of the node categories (labels)
+        nodes (dict): Map from node values to their displayed names, e.g. "node (label)"
+        limit (int): Maximum number of matches returned by a search
+    """
+
+    def __init__(self, categories, nodes: dict, limit: int = 50):
+        self.limit = limit
+        self.entries = [(category, str(category), True) for category in categories] + [
+            (node, str(name), False) for node, name in nodes.items()]
+        self.num_categories = len(categories)
+
+        names = [name.lower() for _, name, _ in self.entries]
+        self._sorted_names, self._sorted_indices = map(list, zip(*sorted(zip(names, range(len(names)))))) if \
+            names else ([], [])
+
+        # Names joined by newlines. `_offsets[i]` is the position of the i-th name in `_joined`
+        self._joined = "\n".join(names)
+        self._offsets = [0] + list(itertools.accumulate(len(name) + 1 for name in names[:-1]))
+
+        self._value2idx = {value: idx for idx, (value, _, _) in enumerate(self.entries)}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def search(self, query: str, limit: int = None) -> list:
+        r"""Values of the entries that match `query`.
+
+        Exact matches come first, then prefix matches in alphabetical order, then other substring matches in the
+        order of the entries.
+        """
+
+        limit = self.limit if limit is None else limit
+        query = (query or "").strip().lower()
+
+        if not query:
+            return [value for value, _, _ in self.entries[:limit]]
+
+        matches = []
+        seen = set()
+
+        def add(idx):
+            if idx not in seen:
+                seen.add(idx)
+                matches.append(idx)
+
+        start = bisect.bisect_left(self._sorted_names, query)
+        for pos in range(start, len(self._sorted_names)):
+            if len(matches) >= limit or not self._sorted_names[pos].startswith(query):
+                break
+            add(self._sorted_indices[pos])
+
+        if len(matches) < limit and "\n" not in query:
+            for match in re.finditer(re.escape(query), self._joined):
+                add(bisect.bisect_right(self._offsets, match.start()) - 1)
+                if len(matches) >= limit:
+                    break
+
+        # Exact matches come first
+        matches.sort(key=lambda idx: self.entries[idx][1].lower() != query)
+        return [self.entries[idx][0] for idx in matches]
+
+    def get_options(self, values) -> list:
+        """Dropdown options for the given values. Values that are not in the index are skipped."""
+        options = []
+        for value in values or []:
+            idx = self._value2idx.get(value)
+            if idx is not None:
+                options += [make_option(*self.entries[idx])]
+
+        return options
+
+    def get_initial_options(self) -> list:
+        """Options before the user types anything: all categories and the first nodes."""
+        return self.get_options([value for value, _, _ in self.entries[:self.num_categories + self.limit]])
+
+    def get_search_options(self, search_value: str, selected_values) -> list:
+        """Options for a search in the dropdown. The selected values are kept so that the dropdown can display them."""
+        if isinstance(selected_values, (str, int)):
+            selected_values = [selected_values] if selected_values != '' else []
+
+        values = list(selected_values or [])
+        selected = set(values)
+        values += [value for value in self.search(search_value) if value not in selected]
+        return self.get_options(values)
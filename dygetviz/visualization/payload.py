@@ -0,0 +1,106 @@
+"""Compact responses for the Dash apps.
+
+By default, Dash sends figures as plain JSON, in which every coordinate is a float with up to 17 digits. The Dash
+apps instead send numeric per-point fields as base64 typed arrays in plotly's format (`{"dtype": "f4", "bdata": ...}`),
+which plotly.js decodes without parsing. Coordinates are sent as 32-bit floats, optionally rounded to a number of
+decimals so that they compress better. On top of that, callback and layout responses are compressed with brotli or
+gzip, whichever the browser accepts.
+"""
+
+import base64
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Per-point fields that are sent as typed arrays if they are numeric
+NUMERIC_FIELDS = ("x", "y", "customdata")
+
+
+def encode_typed_array(values, dtype: str = "f4") -> dict:
+    """Encode numbers as a base64 typed array, which plotly.js and `assets/trajectories.js` decode."""
+    array = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder('<'))
+    return {"dtype": dtype, "bdata": base64.b64encode(array.tobytes()).decode('ascii')}
+
+
+def encode_numbers(values, decimals: int = None):
+    r"""Encode numeric per-point values as a typed array. Other values are returned as they are.
+
+    Args:
+        values: A list or array of numbers, e.g. coordinates, or of other values, e.g. strings
+        decimals (int): Round floats to this many decimals. None keeps the precision of 32-bit floats
+
+    Returns:
+        A typed array of 32-bit floats for floats, of 32-bit integers for integers, or `values`
+    """
+
+    if values is None or isinstance(values, (dict, str)):
+        return values
+
+    array = np.asarray(values)
+    if array.ndim != 1:
+        return values
+
+    if array.dtype == object:
+        # Lists of Python numbers, e.g. read from JSON, become float arrays. Missing values are kept as they are
+        if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+            return values
+
+        array = array.astype(np.float64)
+
+    if np.issubdtype(array.dtype, np.integer) and np.abs(array).max(initial=0) < 2 ** 31:
+        return encode_typed_array(array, "i4")
+
+    if np.issubdtype(array.dtype, np.floating):
+        if decimals is not None:
+            array = np.round(array, decimals)
+
+        return encode_typed_array(array, "f4")
+
+    return values
+
+
+def encode_trace(trace: dict, decimals: int = None) -> dict:
+    r"""A copy of a trace, or of the per-point fields of a trace, whose numeric fields are typed arrays.
+
+    Other arrays, e.g. of hover texts, become lists, which plotly serializes much faster than object arrays.
+    """
+    if not isinstance(trace, dict):
+        return trace
+
+    encoded = {}
+    for field, values in trace.items():
+        if field in NUMERIC_FIELDS:
+            values = encode_numbers(values, decimals)
+
+        encoded[field] = values.tolist() if isinstance(values, np.ndarray) else values
+
+    return encoded
+
+
+def enable_compression(server, algorithms=("br", "gzip")) -> bool:
+    r"""Compress the responses of a Flask server with the first of `algorithms` that the browser accepts.
+
+    Args:
+        server (flask.Flask): The server of a Dash app
+        algorithms (tuple): Compression algorithms in order of preference
+
+    Returns:
+        bool: Whether compression is enabled, which needs `flask-compress`
+    """
+
+    try:
+        from flask_compress import Compress
+
+    except ImportError:
+        logger.warning("Install flask-compress to compress the responses of the Dash app")
+        return False
+
+    # Read when `Compress` is initialized. Responses are compressed on every request, so the fastest levels are used.
+    # They are within a few percent of the default levels on figures, at a fraction of the time
+    server.config["COMPRESS_ALGORITHM"] = list(algorithms)
+    server.config.setdefault("COMPRESS_BR_LEVEL", 1)
+    server.config.setdefault("COMPRESS_LEVEL", 1)
+    Compress(server)
+    return True
@@ -0,0 +1,401 @@
+"""Project temporal node embeddings into the 2D reference frame of the anchor nodes.
+
+The anchor (reference) nodes are embedded once at the reference snapshot, e.g. by t-SNE. Every other
+(node, snapshot) pair is then placed at the mean coordinate of its nearest anchor nodes, blended with the node's
+own anchor coordinate (Algorithm 1 in the paper).
+"""
+
+import numpy as np
+import torch
+
+try:
+    from ..utils.utils_training import pairwise_cos_sim
+except ImportError:
+    from utils.utils_training import pairwise_cos_sim
+
+
+def knn_search(z_projected_embeds: np.ndarray, z_reference_embeds: np.ndarray, idx_self_reference: np.ndarray,
+               nn: int, device: str = "cpu") -> np.ndarray:
+    r"""Find the nearest reference nodes of each projected node by cosine similarity, excluding the node itself.
+
+    Returns:
+        np.ndarray: Indices of the nearest reference nodes, sorted by decreasing similarity, (#projected_nodes, nn)
+    """
+
+    cos_sim_mat = pairwise_cos_sim(z_projected_embeds, z_reference_embeds, device)
+
+    idx_self_reference = torch.as_tensor(idx_self_reference, device=device)
+
+    # Compute top-k values for all nodes at once
+    cos_sim_topk_values, cos_sim_topk_indices = cos_sim_mat.topk(nn + 1, largest=True)
+
+    mask = (cos_sim_topk_indices != idx_self_reference[:, None])
+    # For each row, keep the first nn `True`
+    mask = mask & (torch.concat(
+        [torch.ones((mask.shape[0], nn), dtype=torch.bool, device=device),
+         (mask.sum(dim=1) <= nn).reshape(-1, 1)], dim=1))
+
+    return cos_sim_topk_indices[mask].reshape(-1, nn).cpu().numpy()
+
+
+def knn_project(z_projected_embeds: np.ndarray, z_reference_embeds: np.ndarray, embedding_train: np.ndarray,
+                idx_self_reference: np.ndarray, nn: int, interpolation: float, device: str = "cpu"):
+    r"""Project one snapshot of node embeddings onto the anchor coordinates.
+
+    Args:
+        z_projected_embeds (np.ndarray): Embeddings of the projected nodes at this snapshot, (#projected_nodes, embed_dim)
+        z_reference_embeds (np.ndarray): Embeddings of the reference nodes at this snapshot, (#reference_nodes, embed_dim)
+        embedding_train (np.ndarray): 2D coordinates of the reference nodes, (#reference_nodes, 2)
+        idx_self_reference (np.ndarray): Position of each projected node among the reference nodes, or -1 if the
+            projected node is not a reference node.
+        nn (int): Number of nearest neighbors
+        interpolation (float): Weight of the node's own anchor coordinate
+
+    Returns:
+        np.ndarray: 2D coordinates of the projected nodes, (#projected_nodes, 2)
+    """
+
+    idx_neighbors = knn_search(z_projected_embeds, z_reference_embeds, idx_self_reference, nn, device)
+
+    return neighbors_to_coords(embedding_train, idx_neighbors, np.asarray(idx_self_reference), interpolation)
+
+
+def neighbors_to_coords(embedding_train: np.ndarray, idx_neighbors: np.ndarray, idx_self_reference: np.ndarray,
+                        interpolation: float):
+    r"""Place each node at the mean coordinate of its nearest anchor nodes, blended with its own anchor coordinate.
+
+    Args:
+        embedding_train (np.ndarray): 2D coordinates of the reference nodes, (#reference_nodes, 2)
+        idx_neighbors (np.ndarray): Indices of the nearest reference nodes, (#projected_nodes, nn)
+        idx_self_reference (np.ndarray): Position of each projected node among the reference nodes, or -1
+        interpolation (float): Weight of the node's own anchor coordinate
+    """
+
+    embedding_train = np.asarray(embedding_train)
+
+    z_projected_coords = embedding_train[idx_neighbors].mean(axis=1)
+
+    # Algorithm 1 Line 12 (Vectorized)
+    embedding_test = embedding_train[idx_self_reference] * interpolation + z_projected_coords * (
+            1 - interpolation)
+
+    return embedding_test
+
+
+class CoherentKNNProjector:
+    r"""k-NN projection that reuses neighbor sets across consecutive snapshots.
+
+    A full top-k search keeps the `nn + expansion` most similar reference nodes of each projected node as its
+    candidates. At later snapshots, a node whose drift since its last full search is below `threshold` only re-ranks
+    its candidates. Otherwise, it falls back to a full search.
+
+    The drift of a node is :math:`\|q_t - q_s\| + \max_r \|r_t - r_s\|`, where :math:`q` and :math:`r` are the
+    L2-normalized embeddings of the node and of the reference nodes, and :math:`s` is the snapshot of the last full
+    search. It bounds how much any cosine similarity may have changed since snapshot :math:`s`, so a reference node
+    outside the candidates has a similarity of at most `floor + drift`, where `floor` is the smallest candidate
+    similarity at snapshot :math:`s`. `error_bound` reports the largest amount by which such a node may exceed the
+    similarity of the nn-th selected neighbor. It is 0 if every reused neighbor set is provably exact.
+
+    Args:
+        embedding_train (np.ndarray): 2D coordinates of the reference nodes, (#reference_nodes, 2)
+        idx_self_reference (np.ndarray): Position of each projected node among the reference nodes, or -1
+        nn (int): Number of nearest neighbors
+        interpolation (float): Weight of the node's own anchor coordinate
+        threshold (float): Maximum drift for which the neighbor set of the last full search is reused
+        expansion (int): Number of extra candidates kept from each full search
+    """
+
+    def __init__(self, embedding_train: np.ndarray, idx_self_reference: np.ndarray, nn: int, interpolation: float,
+                 threshold: float, expansion: int = 5, device: str = "cpu"):
+        self.embedding_train = np.asarray(embedding_train)
+        self.idx_self_reference = np.asarray(idx_self_reference)
+        self.nn = nn
+        self.interpolation = interpolation
+        self.threshold = threshold
+        self.expansion = expansion
+        self.device = device
+
+        # State of the last full search of each projected node
+        self.candidates = None  # (#projected_nodes, nn + expansion)
+        self.floor = None  # (#projected_nodes,)
+        self.searched_embeds = None  # (#projected_nodes, embed_dim)
+        self.searched_snapshot = None  # (#projected_nodes,)
+        self.reference_embeds = {}  # Normalized reference embeddings at the snapshots of the last full searches
+
+        self.num_snapshots = 0
+        self.num_reused = 0
+        self.num_total = 0
+        self.error_bound = 0.
+
+    @property
+    def hit_rate(self) -> float:
+        return self.num_reused / self.num_total if self.num_total > 0 else 0.
+
+    def _full_search(self, idx_nodes: torch.Tensor, q: torch.Tensor, r: torch.Tensor):
+        num_candidates = min(self.nn + self.expansion, r.shape[0] - 1)
+
+        cos_sim_mat = torch.matmul(q[idx_nodes], r.t())
+        topk_values, topk_indices = cos_sim_mat.topk(num_candidates + 1, largest=True)
+
+        idx_self = torch.as_tensor(self.idx_self_reference, device=self.device)[idx_nodes]
+        mask = topk_indices != idx_self[:, None]
+        # For each row, keep the first `num_candidates` `True`
+        mask = mask & (torch.concat(
+            [torch.ones((mask.shape[0], num_candidates), dtype=torch.bool, device=self.device),
+             (mask.sum(dim=1) <= num_candidates).reshape(-1, 1)], dim=1))
+
+        self.candidates[idx_nodes] = topk_indices[mask].reshape(-1, num_candidates)
+        self.floor[idx_nodes] = topk_values[:, -1]
+        self.searched_embeds[idx_nodes] = q[idx_nodes]
+        self.searched_snapshot[idx_nodes] = self.num_snapshots
+
+    def project(self, z_projected_embeds: np.ndarray, z_reference_embeds: np.ndarray) -> np.ndarray:
+        """Project the next snapshot. Snapshots must be passed in temporal order."""
+        return neighbors_to_coords(self.embedding_train, self.search(z_projected_embeds, z_reference_embeds),
+                                   self.idx_self_reference, self.interpolation)
+
+    def search(self, z_projected_embeds: np.ndarray, z_reference_embeds: np.ndarray) -> np.ndarray:
+        """Find the nearest neighbors at the next snapshot, sorted by decreasing similarity, (#projected_nodes, nn).
+        Snapshots must be passed in temporal order."""
+        from torch.nn.functional import normalize
+
+        q = normalize(torch.as_tensor(z_projected_embeds, device=self.device).float(), dim=1)
+        r = normalize(torch.as_tensor(z_reference_embeds, device=self.device).float(), dim=1)
+
+        if self.candidates is None:
+            num_candidates = min(self.nn + self.expansion, r.shape[0] - 1)
+            self.candidates = torch.zeros((q.shape[0], num_candidates), dtype=torch.long, device=self.device)
+            self.floor = torch.zeros(q.shape[0], device=self.device)
+            self.searched_embeds = torch.zeros_like(q)
+            self.searched_snapshot = torch.zeros(q.shape[0], dtype=torch.long, device=self.device)
+            self._full_search(torch.arange(q.shape[0], device=self.device), q, r)
+            self.reference_embeds = {self.num_snapshots: r}
+            is_reused = torch.zeros(q.shape[0], dtype=torch.bool, device=self.device)
+
+        else:
+            # Largest drift of any reference node since each snapshot of a previous full search
+            reference_drift = torch.zeros(q.shape[0], device=self.device)
+            for idx_snapshot, r_searched in self.reference_embeds.items():
+                reference_drift[self.searched_snapshot == idx_snapshot] = (r - r_searched).norm(dim=1).max()
+
+            drift = (q - self.searched_embeds).norm(dim=1) + reference_drift
+            is_reused = drift < self.threshold
+
+            idx_searched = (~is_reused).nonzero().flatten()
+            if len(idx_searched) > 0:
+                self._full_search(idx_searched, q, r)
+                self.reference_embeds[self.num_snapshots] = r
+
+            # Only keep the reference embeddings that are still needed to compute the drift
+            self.reference_embeds = {idx_snapshot: r_searched for idx_snapshot, r_searched in
+                                     self.reference_embeds.items() if (self.searched_snapshot == idx_snapshot).any()}
+
+        # Re-rank the candidates at this snapshot
+        candidate_sim = torch.einsum("pd,pcd->pc", q, r[self.candidates])
+        topk_values, topk_positions = candidate_sim.topk(self.nn, dim=1, largest=True)
+        idx_neighbors = torch.gather(self.candidates, 1, topk_positions)
+
+        if is_reused.any():
+            gap = self.floor[is_reused] + drift[is_reused] - topk_values[is_reused, -1]
+            self.error_bound = max(self.error_bound, gap.clamp(min=0).max().item())
+
+        self.num_reused += int(is_reused.sum().item())
+        self.num_total += q.shape[0]
+        self.num_snapshots += 1
+
+        return idx_neighbors.cpu().numpy()
+
+
+class NeighborIndex:
+    r"""Precomputed nearest anchor nodes of each (projected node, snapshot).
+
+    Stores the top-`max_nn` neighbors, so that the coordinates for any `nn <= max_nn` and any interpolation can be
+    recomputed with a cumulative sum and a linear blend, without a neighbor search.
+
+    Args:
+        neighbors (np.ndarray): Indices of the nearest reference nodes sorted by decreasing similarity,
+            (#snapshots, #projected_nodes, max_nn)
+        self_coords (np.ndarray): Anchor coordinate of each projected node, (#projected_nodes, 2)
+        embedding_train (np.ndarray): 2D coordinates of the reference nodes, (#reference_nodes, 2)
+        cumsum (np.ndarray): Precomputed `get_cumsum(neighbors, embedding_train)`, e.g. memory-mapped
+    """
+
+    def __init__(self, neighbors: np.ndarray, self_coords: np.ndarray, embedding_train: np.ndarray,
+                 cumsum: np.ndarray = None):
+        self.neighbors = neighbors
+        self.self_coords = np.asarray(self_coords, dtype=np.float32)
+        self.cumsum = self.get_cumsum(neighbors, embedding_train) if cumsum is None else cumsum
+
+    @staticmethod
+    def get_cumsum(neighbors: np.ndarray, embedding_train: np.ndarray) -> np.ndarray:
+        """Running sums of the neighbor coordinates. `cumsum[t, p, k]` is the sum of the first k + 1 neighbors."""
+        return np.cumsum(np.asarray(embedding_train, dtype=np.float32)[neighbors], axis=2)
+
+    @property
+    def max_nn(self) -> int:
+        return self.neighbors.shape[2]
+
+    @property
+    def num_snapshots(self) -> int:
+        return self.neighbors.shape[0]
+
+    @staticmethod
+    def save(path: str, neighbors: np.ndarray, self_coords: np.ndarray):
+        np.savez(path, neighbors=neighbors.astype(np.int32), self_coords=np.asarray(self_coords, dtype=np.float32))
+
+    @classmethod
+    def load(cls, path: str, embedding_train: np.ndarray):
+        with np.load(path) as f:
+            return cls(f["neighbors"], f["self_coords"], embedding_train)
+
+    @classmethod
+    def load_shared(cls, path: str, embedding_train: np.ndarray, shared_arrays):
+        """Load the index with its arrays memory-mapped from a `SharedArrays`, so that worker processes share them."""
+
+        def read(name):
+            with np.load(path) as f:
+                return f[name]
+
+        neighbors = shared_arrays.attach("neighbors", lambda: read("neighbors"))
+        self_coords = shared_arrays.attach("self_coords", lambda: read("self_coords"))
+        cumsum = shared_arrays.attach("neighbor_cumsum", lambda: cls.get_cumsum(neighbors, embedding_train))
+        return cls(neighbors, self_coords, embedding_train, cumsum=cumsum)
+
+    def get_coords(self, nn: int, interpolation: float, idx_projected=slice(None)) -> np.ndarray:
+        r"""Coordinates of the projected nodes for `nn` nearest neighbors and `interpolation`.
+
+        Args:
+            idx_projected: Positions of the projected nodes to compute. All projected nodes by default.
+
+        Returns:
+            np.ndarray: (#snapshots, #selected projected nodes, 2)
+        """
+        if not 1 <= nn <= self.max_nn:
+            raise ValueError(f"nn must be between 1 and {self.max_nn}, got {nn}")
+
+        return self.self_coords[idx_projected] * interpolation + self.cumsum[:, idx_projected, nn - 1] / nn * (
+                1 - interpolation)
+
+
+class MLPProjector:
+    r"""Parametric projection: a small MLP that regresses the anchor coordinates from the embeddings.
+
+    The MLP is fit once on the reference nodes at the reference snapshot. Afterwards, every node at every snapshot
+    is mapped to 2D with batched matrix multiplies, without any nearest neighbor search. As in the k-NN projection,
+    the predicted coordinate is blended with the node's own anchor coordinate.
+
+    Args:
+        embedding_train (np.ndarray): 2D coordinates of the reference nodes, (#reference_nodes, 2)
+        idx_self_reference (np.ndarray): Position of each projected node among the reference nodes, or -1
+        interpolation (float): Weight of the node's own anchor coordinate
+        hidden_dim (int): Hidden dimension of the MLP
+    """
+
+    def __init__(self, embedding_train: np.ndarray, idx_self_reference: np.ndarray, interpolation: float,
+                 hidden_dim: int = 128):
+        self.embedding_train = np.asarray(embedding_train)
+        self.idx_self_reference = np.asarray(idx_self_reference)
+        self.interpolation = interpolation
+        self.hidden_dim = hidden_dim
+        self.model = None
+
+        # Standardize the targets so that the MLP does not depend on the scale of the visualization
+        self.coords_mean = self.embedding_train.mean(axis=0)
+        self.coords_std = self.embedding_train.std(axis=0) + 1e-8
+
+    def _build_model(self, embed_dim: int):
+        self.model = torch.nn.Sequential(
+            torch.nn.Linear(embed_dim, self.hidden_dim),
+            torch.nn.ReLU(),
+            torch.nn.Linear(self.hidden_dim, self.hidden_dim),
+            torch.nn.ReLU(),
+            torch.nn.Linear(self.hidden_dim, 2),
+        )
+
+    def fit(self, z_reference_embeds: np.ndarray, epochs: int = 50, batch_size: int = 1024, lr: float = 1e-3):
+        r"""Fit the MLP on the embeddings of the reference nodes at the reference snapshot.
+
+        Args:
+            z_reference_embeds (np.ndarray): (#reference_nodes, embed_dim)
+        """
+        from torch.nn.functional import normalize
+        from tqdm import trange
+
+        x = normalize(torch.as_tensor(np.asarray(z_reference_embeds), dtype=torch.float), dim=1)
+        y = torch.as_tensor((self.embedding_train - self.coords_mean) / self.coords_std, dtype=torch.float)
+
+        self._build_model(x.shape[1])
+        optimizer = torch.optim.Adam(self.model.parameters(), lr=lr)
+
+        self.model.train()
+        for _ in trange(epochs, desc="Fitting MLP projector"):
+            permutation = torch.randperm(x.shape[0])
+            for i in range(0, x.shape[0], batch_size):
+                idx_batch = permutation[i:i + batch_size]
+                loss = torch.nn.functional.mse_loss(self.model(x[idx_batch]), y[idx_batch])
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+
+        self.model.eval()
+        return self
+
+    @torch.no_grad()
+    def predict(self, z: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+        r"""Map embeddings of any leading shape (..., embed_dim) to 2D coordinates (..., 2) on CPU."""
+        from torch.nn.functional import normalize
+
+        z = np.asarray(z)
+        x = torch.as_tensor(z.reshape(-1, z.shape[-1]), dtype=torch.float)
+
+        coords = torch.cat([self.model(normalize(x[i:i + batch_size], dim=1)) for i in
+                            range(0, x.shape[0], batch_size)]).numpy()
+        coords = coords * self.coords_std + self.coords_mean
+
+        return coords.reshape(*z.shape[:-1], 2)
+
+    def project(self, z_projected_embeds: np.ndarray) -> np.ndarray:
+        r"""Project the projected nodes at all snapshots in a single forward pass.
+
+        Args:
+            z_projected_embeds (np.ndarray): (#snapshots, #projected_nodes, embed_dim), or a single snapshot
+                (#projected_nodes, embed_dim)
+        """
+        return self.embedding_train[self.idx_self_reference] * self.interpolation + self.predict(
+            z_projected_embeds) * (1 - self.interpolation)
+
+    def save(self, path: str):
+        torch.save({"hidden_dim": self.hidden_dim, "state_dict": self.model.state_dict()}, path)
+
+    def load(self, path: str):
+        checkpoint = torch.load(path, map_location="cpu")
+        self.hidden_dim = checkpoint["hidden_dim"]
+        state_dict = checkpoint["state_dict"]
+        self._build_model(state_dict["0.weight"].shape[1])
+        self.model.load_state_dict(state_dict)
+        self.model.eval()
+        return self
+
+
+def neighborhood_preservation(coords: np.ndarray, coords_reference: np.ndarray, k: int = 10) -> float:
+    r"""Mean fraction of each point's k nearest neighbors in `coords_reference` that are also among its k nearest
+    neighbors in `coords`.
+
+    Args:
+        coords (np.ndarray): (#points, 2)
+        coords_reference (np.ndarray): (#points, 2)
+    """
+    k = min(k, len(coords) - 1)
+    if k < 1:
+        return 1.
+
+    def get_knn(x):
+        x = torch.as_tensor(np.asarray(x), dtype=torch.float)
+        dist = torch.cdist(x, x)
+        dist.fill_diagonal_(float("inf"))
+        return dist.topk(k, largest=False).indices
+
+    knn, knn_reference = get_knn(coords), get_knn(coords_reference)
+    overlap = (knn[:, :, None] == knn_reference[:, None, :]).any(dim=2).float().mean(dim=1)
+
+    return overlap.mean().item()
@@ -0,0 +1,194 @@
+"""Raster rendering of the background nodes for the Dash apps.
+
+With `--background_mode raster`, the background nodes are not sent to the browser as one marker per node. Instead,
+the server bins their 2D coordinates into a density image for the current viewport and the figure displays it as a
+layout image below the trajectories. When the user pans or zooms, only a new image is sent.
+
+Rendered images are kept in an LRU cache. Viewports are snapped outward to a grid that depends on the zoom level, so
+small pans and repeated zooms reuse cached images.
+"""
+
+import base64
+import io
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from matplotlib import colors as mcolors
+from matplotlib import image as mimage
+
+# Fraction of the viewport that viewports are snapped to. Smaller values give tighter images but fewer cache hits
+SNAP_FRACTION = 0.25
+
+
+def get_relayout_viewport(relayout_data: dict):
+    r"""Read the viewport from a `relayoutData` event of a plotly graph.
+
+    Returns:
+        tuple: (x_range, y_range), where a range is None if it is the full extent (e.g. after a double click). None if
+            the event did not change the viewport.
+    """
+
+    if not relayout_data:
+        return None
+
+    # Double clicks reset the axes
+    if relayout_data.get('xaxis.autorange'):
+        return None, None
+
+    if 'xaxis.range[0]' not in relayout_data and 'yaxis.range[0]' not in relayout_data:
+        return None
+
+    x_range = (relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']) \
+        if 'xaxis.range[0]' in relayout_data else None
+    y_range = (relayout_data['yaxis.range[0]'], relayout_data['yaxis.range[1]']) \
+        if 'yaxis.range[0]' in relayout_data else None
+
+    return x_range, y_range
+
+
+class BackgroundRaster:
+    r"""Renders the background nodes as density images. Thread-safe.
+
+    Args:
+        x (np.ndarray): x coordinates of the background nodes
+        y (np.ndarray): y coordinates of the background nodes
+        width (int): Width of the rendered images in pixels
+        height (int): Height of the rendered images in pixels
+        color (str): Color of the nodes
+        opacity (float): Opacity of the densest pixel
+        max_cache_size (int): Maximum number of images in the cache
+    """
+
+    def __init__(self, x, y, width: int = 800, height: int = 700, color: str = '#B2B2B2', opacity: float = 0.8,
+                 max_cache_size: int = 128):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.width = width
+        self.height = height
+        self.rgb = np.array(mcolors.to_rgb(color))
+        self.opacity = opacity
+        self.max_cache_size = max_cache_size
+
+        # Full extent of the nodes, with a margin so that nodes on the border are not cut in half
+        margin_x = max(np.ptp(self.x), 1e-6) * 0.05
+        margin_y = max(np.ptp(self.y), 1e-6) * 0.05
+        self.x_range = (float(self.x.min() - margin_x), float(self.x.max() + margin_x))
+        self.y_range = (float(self.y.min() - margin_y), float(self.y.max() + margin_y))
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def snap_viewport(self, x_range, y_range):
+        r"""Snap a viewport outward to the grid of its zoom level.
+
+        Returns:
+            tuple: The cache key, i.e. (zoom level, x grid range, y grid range), and the snapped x and y ranges
+        """
+
+        x_range = x_range or self.x_range
+        y_range = y_range or self.y_range
+
+        # Zoom level 0 displays the full extent. Each level halves the width of the viewport
+        zoom = max(0, int(math.floor(math.log2((self.x_range[1] - self.x_range[0]) /
+                                               max(x_range[1] - x_range[0], 1e-12)))))
+
+        key = (zoom,)
+        snapped = []
+        for (lo, hi), (full_lo, full_hi) in [(x_range, self.x_range), (y_range, self.y_range)]:
+            step = (full_hi - full_lo) / 2 ** zoom * SNAP_FRACTION
+            idx_lo, idx_hi = math.floor((lo - full_lo) / step), math.ceil((hi - full_lo) / step)
+            key += (idx_lo, idx_hi)
+            snapped += [(full_lo + idx_lo * step, full_lo + idx_hi * step)]
+
+        return key, snapped[0], snapped[1]
+
+    def rasterize(self, x_range, y_range) -> np.ndarray:
+        """Count the nodes in each pixel of the viewport. Row 0 is the top of the image."""
+        col = np.floor((self.x - x_range[0]) / (x_range[1] - x_range[0]) * self.width).astype(np.int64)
+        row = np.floor((y_range[1] - self.y) / (y_range[1] - y_range[0]) * self.height).astype(np.int64)
+        inside = (col >= 0) & (col < self.width) & (row >= 0) & (row < self.height)
+
+        counts = np.bincount(row[inside] * self.width + col[inside], minlength=self.width * self.height)
+        return counts.reshape(self.height, self.width)
+
+    def to_png(self, counts: np.ndarray) -> str:
+        """Encode the counts as a PNG data URI. The opacity of each pixel grows logarithmically with its count."""
+        rgba = np.zeros(counts.shape + (4,))
+        rgba[..., :3] = self.rgb
+        if counts.max() > 0:
+            rgba[..., 3] = np.log1p(counts) / np.log1p(counts.max()) * self.opacity
+
+        buffer = io.BytesIO()
+        mimage.imsave(buffer, rgba, format='png')
+        return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+    def render(self, x_range=None, y_range=None) -> dict:
+        r"""Render the background for a viewport as a plotly layout image.
+
+        Args:
+            x_range (tuple): Visible range of the x axis. Default: the full extent
+            y_range (tuple): Visible range of the y axis. Default: the full extent
+
+        Returns:
+            dict: An entry of `layout.images`
+        """
+
+        key, x_range, y_range = self.snap_viewport(x_range, y_range)
+
+        # Callbacks of all sessions share the cache
+        with self._lock:
+            image = self._cache.get(key)
+            if image is not None:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return image
+
+            self.misses += 1
+
+        image = dict(source=self.to_png(self.rasterize(x_range, y_range)), xref='x', yref='y', x=x_range[0],
+                     y=y_range[1], sizex=x_range[1] - x_range[0], sizey=y_range[1] - y_range[0], sizing='stretch',
+                     layer='below', name='background')
+
+        with self._lock:
+            self._cache[key] = image
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cache_size:
+                self._cache.popitem(last=False)
+
+        return image
+
+    def render_relayout(self, relayout_data: dict):
+        """Render the background for the viewport in a `relayoutData` event. Returns None if the viewport did not
+        change."""
+        viewport = get_relayout_viewport(relayout_data)
+        return None if viewport is None else self.render(*viewport)
+
+    def get_axis_ranges(self) -> dict:
+        """Axis ranges to set on the initial figure, since the image alone does not autoscale the axes."""
+        return dict(xaxis_range=list(self.x_range), yaxis_range=list(self.y_range))
+
+
+def replace_background_with_raster(fig, background_raster: BackgroundRaster, name: str = 'background'):
+    r"""Remove the background trace from a figure and all of its animation frames, and display the raster instead.
+
+    The trace is removed at the same position in every frame, so the remaining traces keep matching across frames.
+
+    Args:
+        fig (go.Figure): The figure, modified in place
+        background_raster (BackgroundRaster): Renders the background
+        name (str): Name of the background trace
+
+    Returns:
+        go.Figure: the figure
+    """
+
+    fig.data = [trace for trace in fig.data if trace.name != name]
+    for frame in fig.frames:
+        frame.data = [trace for trace in frame.data if trace.name != name]
+
+    fig.update_layout(images=[background_raster.render()], **background_raster.get_axis_ranges())
+    return fig
@@ -0,0 +1,174 @@
+"""Per-session view state of the Dash apps, kept on the server.
+
+The browser only holds a session id (in a `dcc.Store`). Everything else that describes what a user sees -- the traces
+in the figure, the colors of the selected trajectories and the labels toggled on the background -- is kept here, so
+callbacks neither upload the figure nor modify module-level data shared by all users.
+
+By default, sessions are kept in the memory of the process, so all requests of a session must reach the same process.
+With a cache directory, they are kept in a `diskcache.Cache` instead, which the worker processes of a WSGI server
+share, so that any worker can serve any request (see `wsgi.py`).
+"""
+
+import threading
+import uuid
+from collections import OrderedDict
+
+
+class ViewState:
+    r"""What one browser session currently displays.
+
+    Attributes:
+        figure_traces (list): Names (keys of `node2trace`) of the traces in the figure, in order
+        node2color (dict): Colors of the displayed trajectories
+        selection (list): Values of the dropdown that the displayed trajectories were selected with
+        toggled_labels (set): Indices of the background points whose label was toggled by a click
+        background_indices (np.ndarray): Indices of the background points in the figure, or None if all points are
+            displayed
+        viewport (tuple): Visible (x_range, y_range) of the figure. A range is None if the axis is not zoomed
+        lock (threading.Lock): Held while a callback reads or updates the state
+    """
+
+    # Attributes that describe what the session displays
+    FIELDS = ("figure_traces", "node2color", "selection", "toggled_labels", "background_indices", "viewport")
+
+    def __init__(self):
+        self.figure_traces = []
+        self.node2color = {}
+        self.selection = []
+        self.toggled_labels = set()
+        self.background_indices = None
+        self.viewport = (None, None)
+        self.lock = threading.Lock()
+
+    def reset(self, figure_traces: list):
+        self.figure_traces = list(figure_traces)
+        self.node2color = {}
+        self.selection = []
+        self.toggled_labels = set()
+        self.background_indices = None
+        self.viewport = (None, None)
+
+    def toggle_label(self, point_idx: int) -> bool:
+        """Toggle the label of a background point. Returns True if the point is now toggled."""
+        if point_idx in self.toggled_labels:
+            self.toggled_labels.remove(point_idx)
+            return False
+
+        self.toggled_labels.add(point_idx)
+        return True
+
+
+class _SharedStateLock:
+    """Holds a `SharedViewState` across processes. The state is loaded on acquiring the lock and saved on releasing it."""
+
+    def __init__(self, state, lock):
+        self.state = state
+        self._lock = lock
+
+    def __enter__(self):
+        self._lock.acquire()
+        self.state.load()
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self.state.save()
+        finally:
+            self._lock.release()
+
+
+class SharedViewState(ViewState):
+    r"""A `ViewState` kept in a cache that several processes share.
+
+    Args:
+        cache (diskcache.Cache): The cache of the sessions
+        session_id (str): Id of the session
+        expire (float): Seconds after its last update that the session is dropped
+        lock_expire (float): Seconds after which the lock of a session is released if its holder died
+    """
+
+    def __init__(self, cache, session_id: str, expire: float, lock_expire: float = 60.):
+        import diskcache
+
+        super().__init__()
+        self._cache = cache
+        self._key = ("session", session_id)
+        self.expire = expire
+        self.lock = _SharedStateLock(self, diskcache.Lock(cache, ("lock", session_id), expire=lock_expire))
+
+    def load(self) -> bool:
+        """Read the latest state of the session. Returns False if the session is unknown (e.g. expired)."""
+        fields = self._cache.get(self._key)
+        if fields is None:
+            return False
+
+        for field, value in fields.items():
+            setattr(self, field, value)
+        return True
+
+    def save(self):
+        self._cache.set(self._key, {field: getattr(self, field) for field in ViewState.FIELDS}, expire=self.expire)
+
+
+class SessionStore:
+    r"""Thread-safe map from session ids to `ViewState`.
+
+    Only the `max_sessions` most recently used sessions are kept. A session that was evicted starts over from the
+    initial figure.
+
+    Args:
+        max_sessions (int): Number of sessions kept in memory
+        cache_dir (str): If given, keep the sessions in a `diskcache.Cache` in this directory instead, which processes
+            share. Sessions are then dropped `expire` seconds after their last update rather than by count
+        expire (float): Lifetime of the sessions in `cache_dir`
+    """
+
+    def __init__(self, max_sessions: int = 1000, cache_dir: str = None, expire: float = 86400.):
+        self.max_sessions = max_sessions
+        self.expire = expire
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._cache = None
+        if cache_dir is not None:
+            import diskcache
+
+            self._cache = diskcache.Cache(cache_dir)
+
+    @staticmethod
+    def new_session_id() -> str:
+        return uuid.uuid4().hex
+
+    def get(self, session_id: str):
+        """The state of a session, or None if the session is unknown (e.g. evicted)."""
+        if self._cache is not None:
+            state = SharedViewState(self._cache, session_id, self.expire)
+            return state if state.load() else None
+
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is not None:
+                self._sessions.move_to_end(session_id)
+            return state
+
+    def create(self, session_id: str) -> ViewState:
+        if self._cache is not None:
+            state = SharedViewState(self._cache, session_id, self.expire)
+            state.save()
+            return state
+
+        with self._lock:
+            state = self._sessions[session_id] = ViewState()
+            self._sessions.move_to_end(session_id)
+
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+            return state
+
+    def __len__(self) -> int:
+        if self._cache is not None:
+            return sum(1 for key in self._cache.iterkeys() if key[0] == "session")
+
+        with self._lock:
+            return len(self._sessions)
@@ -0,0 +1,132 @@
+"""Zoom-adaptive simplification of trajectories for the Dash apps.
+
+Long trajectories (e.g. 522 snapshots in Chickenpox) are not sent point by point. For each trajectory, a
+Douglas-Peucker pass assigns every point an importance: the distance from the simplified line at the moment the point
+is inserted. Importances never increase from parent to child, so they form a multi-resolution hierarchy: keeping the
+points with importance above a tolerance gives the Douglas-Peucker simplification for that tolerance.
+
+The hierarchy is computed once per trajectory. The tolerance is derived from the data units covered by one pixel in
+the current viewport, so zooming in reveals more points, and deviations smaller than a pixel are never drawn.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    from .utils import ForkSafeLock
+except ImportError:
+    from visualization.utils import ForkSafeLock
+
+
+def douglas_peucker_importance(x, y, keep=()) -> np.ndarray:
+    r"""Importance of each point of a polyline in the Douglas-Peucker hierarchy.
+
+    Args:
+        x (np.ndarray): x coordinates of the points, in order
+        y (np.ndarray): y coordinates of the points, in order
+        keep: Indices of points that are always kept. The first and last points are always kept
+
+    Returns:
+        np.ndarray: Importance of each point. Kept points have infinite importance
+    """
+
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    n = len(x)
+    importance = np.zeros(n)
+
+    if n == 0:
+        return importance
+
+    # Points that are always kept split the polyline into independent sections
+    anchors = sorted({0, n - 1} | {int(idx) for idx in keep if 0 <= idx < n})
+    importance[anchors] = np.inf
+
+    stack = [(start, end, np.inf) for start, end in zip(anchors[:-1], anchors[1:])]
+
+    while stack:
+        start, end, parent = stack.pop()
+        if end - start < 2:
+            continue
+
+        # Distance of the inner points to the segment between `start` and `end`
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        length_sq = dx * dx + dy * dy
+
+        if length_sq > 0:
+            t = np.clip((px * dx + py * dy) / length_sq, 0., 1.)
+            distances = np.hypot(px - t * dx, py - t * dy)
+        else:
+            distances = np.hypot(px, py)
+
+        idx = start + 1 + int(np.argmax(distances))
+
+        # A point is never more important than the point that split its parent section
+        importance[idx] = min(distances[idx - start - 1], parent)
+
+        stack += [(start, idx, importance[idx]), (idx, end, importance[idx])]
+
+    return importance
+
+
+class TrajectorySimplifier:
+    r"""Caches the importance hierarchy of trajectories and selects the points to draw for a viewport. Thread-safe.
+
+    Args:
+        pixel_tolerance (float): Deviations below this many pixels are not drawn
+        plot_width (int): Width of the plot in pixels
+        plot_height (int): Height of the plot in pixels
+        max_cache_size (int): Maximum number of cached hierarchies
+    """
+
+    def __init__(self, pixel_tolerance: float = 1., plot_width: int = 800, plot_height: int = 700,
+                 max_cache_size: int = 4096):
+        self.pixel_tolerance = pixel_tolerance
+        self.plot_width = plot_width
+        self.plot_height = plot_height
+        self.max_cache_size = max_cache_size
+        self._cache = OrderedDict()
+        self._lock = ForkSafeLock()
+
+    def get_importance(self, key, x, y, keep=()) -> np.ndarray:
+        """The importance hierarchy of a trajectory, computed on the first request for `key`."""
+        with self._lock:
+            importance = self._cache.get(key)
+            if importance is not None:
+                self._cache.move_to_end(key)
+                return importance
+
+        importance = douglas_peucker_importance(x, y, keep)
+
+        with self._lock:
+            self._cache[key] = importance
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cache_size:
+                self._cache.popitem(last=False)
+
+        return importance
+
+    def get_tolerance(self, x_range, y_range) -> float:
+        """Tolerance in data units for a viewport: the data units covered by `pixel_tolerance` pixels."""
+        data_per_pixel = min((x_range[1] - x_range[0]) / self.plot_width,
+                             (y_range[1] - y_range[0]) / self.plot_height)
+        return self.pixel_tolerance * data_per_pixel
+
+    def select(self, key, x, y, x_range, y_range, keep=()) -> np.ndarray:
+        r"""Indices of the points of a trajectory to draw in a viewport.
+
+        Args:
+            key: Identifies the trajectory and the coordinates, e.g. (node, nn, interpolation)
+            x (np.ndarray): x coordinates of the trajectory
+            y (np.ndarray): y coordinates of the trajectory
+            x_range (tuple): Visible range of the x axis
+            y_range (tuple): Visible range of the y axis
+            keep: Indices of points that are always drawn, besides the first and last points
+
+        Returns:
+            np.ndarray: Sorted indices of the points to draw
+        """
+
+        importance = self.get_importance(key, x, y, keep)
+        return np.nonzero(importance >= self.get_tolerance(x_range, y_range))[0]
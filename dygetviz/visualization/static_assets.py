@@ -0,0 +1,93 @@
+"""Data that is identical for every user, served by the Dash apps as content-hashed static files.
+
+The background of a visualization cache does not change between users or interactions, but sent inside a callback
+response it is downloaded again on every visit, and neither browsers nor reverse proxies can cache it. Instead, the
+background traces are published once as a JSON file whose name contains the hash of its content, e.g.
+`/_dygetviz/static/background-3f2a9c1b0d4e5f6a.json`. Since the content of a URL never changes, it is served with
+`Cache-Control: immutable` and a one-year lifetime, and with an ETag so that revalidations are answered with
+`304 Not Modified`. A second visit to the same dataset transfers almost nothing.
+
+The figure sent by the callbacks holds placeholders for these traces, which the clientside callback in
+`assets/background.js` fills in from the static file.
+"""
+
+import hashlib
+import json
+import threading
+
+from plotly.utils import PlotlyJSONEncoder
+
+# The content of a URL never changes, so browsers and proxies may keep it for a year without revalidating
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Fields of a trace that its placeholder keeps
+PLACEHOLDER_FIELDS = ["name", "type", "mode"]
+
+
+def get_placeholders(traces: list) -> list:
+    """The traces without their points, which `assets/background.js` fills in from a published file."""
+    return [{field: value for field, value in trace.items() if field in PLACEHOLDER_FIELDS} for trace in traces]
+
+
+class StaticAssets:
+    r"""Thread-safe registry of content-hashed JSON files, served by a Flask server.
+
+    Args:
+        url_prefix (str): Path under which the files are served
+    """
+
+    def __init__(self, url_prefix: str = "/_dygetviz/static"):
+        self.url_prefix = url_prefix.rstrip("/")
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def publish(self, name: str, payload) -> str:
+        r"""Publish a JSON payload as a static file.
+
+        Args:
+            name (str): Prefix of the file name, e.g. `background`
+            payload: The content, serialized with plotly's JSON encoder, so it may hold NumPy arrays
+
+        Returns:
+            str: The path of the file, which changes whenever its content changes. It is relative to the prefix of the
+                Dash app, see `install`
+        """
+        body = json.dumps(payload, cls=PlotlyJSONEncoder, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        filename = f"{name}-{digest}.json"
+
+        with self._lock:
+            self._assets[filename] = (body, digest)
+
+        return f"{self.url_prefix}/{filename}"
+
+    def get(self, filename: str):
+        """The body and the content hash of a published file, or None."""
+        with self._lock:
+            return self._assets.get(filename)
+
+    def install(self, server, routes_pathname_prefix: str = "/"):
+        r"""Serve the published files from a Flask server.
+
+        The files are served under the same prefix as the routes of the Dash app, so that `app.get_relative_path`
+        turns the paths returned by `publish` into the URLs that the browser requests, also behind a proxy.
+
+        Args:
+            server (flask.Flask): The server of a Dash app
+            routes_pathname_prefix (str): Prefix of the routes of the Dash app, i.e. `app.config.routes_pathname_prefix`
+        """
+        import flask
+
+        @server.route(f"{routes_pathname_prefix.rstrip('/')}{self.url_prefix}/<filename>")
+        def get_static_asset(filename):
+            asset = self.get(filename)
+            if asset is None:
+                flask.abort(404)
+
+            body, digest = asset
+            response = flask.Response(body, mimetype="application/json")
+            response.headers["Cache-Control"] = CACHE_CONTROL
+            response.set_etag(digest)
+
+            # Answers `If-None-Match` with `304 Not Modified`
+            return response.make_conditional(flask.request)
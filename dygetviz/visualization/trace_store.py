@@ -0,0 +1,293 @@
+"""Indexed per-node trace store for the Dash apps.
+
+`Traces_{visualization_name}.bin` holds every trace of the cached trajectory figure in a single file:
+
+- an 8-byte magic string, followed by the format version (uint32) and the length of the header (uint64),
+- a JSON header with the offset table, i.e. `{"layers": {name: [offset, length]}, "nodes": {node: [offset, length]}}`,
+- the JSON-encoded traces, concatenated. Offsets are relative to the end of the header.
+
+`layers` are the background traces (`background`, `anomaly`, ...) that are displayed on every figure. `nodes` are the
+full trajectories of the projected nodes, keyed by node id as in `node2trace`.
+
+At startup, the Dash apps only read the header and the background layers. A trajectory is read (through mmap) only when
+a user adds it to the figure, so startup time and memory do not grow with the number of projected nodes.
+"""
+
+import json
+import logging
+import mmap
+import os
+import os.path as osp
+import struct
+from collections import OrderedDict
+
+try:
+    import plotly.graph_objects as go
+    from plotly.utils import PlotlyJSONEncoder
+    HAS_PLOTLY = True
+except ImportError:
+    HAS_PLOTLY = False
+
+try:
+    from .trajectory_cache import decode_plotly_array, get_cache_paths, load_cache_manifest
+except ImportError:
+    from visualization.trajectory_cache import decode_plotly_array, get_cache_paths, load_cache_manifest
+
+try:
+    from .utils import ForkSafeLock
+except ImportError:
+    from visualization.utils import ForkSafeLock
+
+MAGIC = b"DYGTRACE"
+STORE_VERSION = 1
+_PREFIX = struct.Struct("<IQ")
+
+logger = logging.getLogger(__name__)
+
+# Names of the background traces, see `const.color_to_node_type`
+BACKGROUND_LAYER_NAMES = ("highlighted", "reference", "projected", "background", "anomaly")
+
+# Fields of a stored trace that are sent to the browser
+TEMPLATE_FIELDS = ("x", "y", "xaxis", "yaxis", "customdata", "hovertemplate", "hovertext", "legendgroup", "mode", "name",
+                   "showlegend", "selectedpoints", "text", "textposition")
+
+
+def _trace_key(trace: dict) -> str:
+    # Trajectories are named "{node} ({label})" in `plot_dtdg`
+    return str(trace['name']).split(' ')[0]
+
+
+def _decode_typed_arrays(value):
+    """Replace the base64 typed arrays written by plotly with lists so that the stored traces are plain JSON."""
+    if isinstance(value, dict):
+        if "bdata" in value and "dtype" in value:
+            return decode_plotly_array(value)
+        return {k: _decode_typed_arrays(v) for k, v in value.items()}
+
+    if isinstance(value, (list, tuple)):
+        return [_decode_typed_arrays(v) for v in value]
+
+    return value
+
+
+def write_trace_store(path: str, layers: dict, traces: dict):
+    r"""Write the background layers and per-node traces to an indexed trace store.
+
+    The file is written to a temporary path first and then moved into place, so a running server never reads a
+    partially written store.
+
+    Args:
+        path (str): Path of the trace store
+        layers (dict): Background traces, keyed by trace name
+        traces (dict): Trajectories, keyed by node id
+    """
+
+    payloads = []
+    header = {"layers": {}, "nodes": {}}
+    offset = 0
+
+    for section, section_traces in [("layers", layers), ("nodes", traces)]:
+        for key, trace in section_traces.items():
+            payload = json.dumps(_decode_typed_arrays(trace), cls=PlotlyJSONEncoder if HAS_PLOTLY else None,
+                                 separators=(',', ':')).encode('utf-8')
+            header[section][str(key)] = [offset, len(payload)]
+            payloads += [payload]
+            offset += len(payload)
+
+    header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+
+    path_tmp = f"{path}.tmp"
+    with open(path_tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_PREFIX.pack(STORE_VERSION, len(header)))
+        f.write(header)
+        for payload in payloads:
+            f.write(payload)
+
+    os.replace(path_tmp, path)
+
+
+def write_trace_store_from_figure(path: str, fig_dict: dict, num_background_traces: int):
+    r"""Build the trace store from a cached trajectory figure.
+
+    The background layers are taken from `fig_dict['data']`. The trajectories are taken from the last animation
+    frame, which covers all snapshots (the initial `data` only holds the first point of each trajectory).
+
+    Args:
+        path (str): Path of the trace store
+        fig_dict (dict): The trajectory figure, as a dictionary (e.g. read from `Trajectory_*.json`)
+        num_background_traces (int): Number of background traces at the start of each frame
+    """
+
+    data = list(fig_dict["data"])
+    frames = fig_dict.get("frames") or []
+    trajectories = list(frames[-1]["data"]) if frames else data
+
+    layers = {_trace_key(trace): trace for trace in data[:num_background_traces]}
+    traces = {}
+    for trace in trajectories[num_background_traces:]:
+        trace = dict(trace)
+        trace.pop("visible", None)
+        traces[_trace_key(trace)] = trace
+
+    write_trace_store(path, layers, traces)
+
+
+class TraceStore:
+    r"""Read-only, lazily loaded mapping from node ids (and background layer names) to plotly traces.
+
+    Supports the subset of the `dict` interface that the Dash apps use on `node2trace`: `store[key]`, `key in store`,
+    `len(store)` and iteration over keys. The background layers are held in memory, so changes to them (e.g. toggled
+    labels) persist across callbacks. Trajectories are deserialized on every access and can be modified freely.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a trace store")
+
+            version, header_length = _PREFIX.unpack(f.read(_PREFIX.size))
+            if version != STORE_VERSION:
+                raise ValueError(f"Unsupported trace store version {version} in {path}")
+
+            header = json.loads(f.read(header_length).decode('utf-8'))
+            self._data_offset = len(MAGIC) + _PREFIX.size + header_length
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._layer_offsets = header["layers"]
+        self._node_offsets = header["nodes"]
+        self.layers = {name: self._to_trace(self.read(name)) for name in self._layer_offsets}
+
+    @staticmethod
+    def _to_trace(trace: dict):
+        return go.Figure(data=[trace]).data[0]
+
+    def read(self, key: str) -> dict:
+        """Read the raw trace dictionary of a node or a background layer."""
+        offset, length = self._layer_offsets[key] if key in self._layer_offsets else self._node_offsets[key]
+        start = self._data_offset + offset
+        return json.loads(self._mm[start:start + length].decode('utf-8'))
+
+    @property
+    def nodes(self) -> list:
+        return list(self._node_offsets)
+
+    def __getitem__(self, key):
+        if key in self.layers:
+            return self.layers[key]
+
+        if key not in self._node_offsets:
+            raise KeyError(key)
+
+        return self._to_trace(self.read(key))
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __contains__(self, key) -> bool:
+        return key in self.layers or key in self._node_offsets
+
+    def __iter__(self):
+        yield from self.layers
+        yield from self._node_offsets
+
+    def __len__(self) -> int:
+        return len(self.layers) + len(self._node_offsets)
+
+    def close(self):
+        self._mm.close()
+
+
+def make_trace_template(trace: dict, line: dict = None, marker: dict = None) -> dict:
+    r"""A ready-to-send trace dictionary, built once from a stored trace.
+
+    Keeps the fields in `TEMPLATE_FIELDS`, the line color, dash, shape and width, and the marker size and symbol, then
+    applies the style in `line` and `marker`. Unlike a `go.Scatter`, the dictionary is never validated or copied.
+
+    Templates are shared between callbacks and sessions and must not be modified. Callbacks build a shallow copy with the
+    fields that differ instead, e.g. `{**template, 'x': x}`.
+    """
+
+    template = {field: trace[field] for field in TEMPLATE_FIELDS if field in trace}
+    template["type"] = "scatter"
+    template["line"] = {**{k: v for k, v in trace.get("line", {}).items() if k in ["color", "dash", "shape", "width"]},
+                        **(line or {})}
+    template["marker"] = {**{k: v for k, v in trace.get("marker", {}).items() if k in ["size", "symbol"]},
+                          **(marker or {})}
+
+    # Traces without labels only draw markers
+    if template.get("mode") == "markers+text" and not any(template.get("text") or []):
+        template["mode"] = "markers"
+
+    return template
+
+
+class TraceTemplates:
+    r"""Thread-safe templates (see `make_trace_template`) of the trajectories in a trace store, with a common style.
+
+    A template is built on the first access to a node and kept in an LRU cache, so that subsequent accesses neither read
+    the store nor build any object.
+
+    Args:
+        store (TraceStore): The trace store
+        line (dict): Line style of the trajectories
+        marker (dict): Marker style of the trajectories
+        max_cache_size (int): Maximum number of cached templates
+    """
+
+    def __init__(self, store, line: dict = None, marker: dict = None, max_cache_size: int = 4096):
+        self.store = store
+        self.line = line
+        self.marker = marker
+        self.max_cache_size = max_cache_size
+        self._cache = OrderedDict()
+        self._lock = ForkSafeLock()
+
+    def __getitem__(self, key) -> dict:
+        with self._lock:
+            template = self._cache.get(key)
+            if template is not None:
+                self._cache.move_to_end(key)
+                return template
+
+        template = make_trace_template(self.store.read(key), self.line, self.marker)
+
+        with self._lock:
+            self._cache[key] = template
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cache_size:
+                self._cache.popitem(last=False)
+
+        return template
+
+
+def load_trace_store(visual_dir: str, visualization_name: str) -> TraceStore:
+    r"""Open the trace store of a visualization cache.
+
+    Caches written before trace stores existed are converted once: the trajectory figure is read in full, and the
+    store is written next to it so that subsequent startups only read the header and the background layers.
+    """
+
+    paths = get_cache_paths(visual_dir, visualization_name)
+
+    if not osp.exists(paths["traces"]) or osp.getmtime(paths["traces"]) < osp.getmtime(paths["figure"]):
+        logger.info(f"Building the trace store {paths['traces']} ...")
+
+        with open(paths["figure"], 'r', encoding='utf-8') as f:
+            fig_dict = json.load(f)
+
+        manifest = load_cache_manifest(visual_dir, visualization_name)
+        if manifest is not None:
+            num_background_traces = manifest["num_background_traces"]
+        else:
+            # Older caches have no manifest. The background traces come first and are named after node types.
+            num_background_traces = 0
+            while (num_background_traces < len(fig_dict["data"]) and
+                   _trace_key(fig_dict["data"][num_background_traces]) in BACKGROUND_LAYER_NAMES):
+                num_background_traces += 1
+
+        write_trace_store_from_figure(paths["traces"], fig_dict, num_background_traces)
+
+    return TraceStore(paths["traces"])
@@ -0,0 +1,219 @@
+"""Manifest and incremental updates for the trajectory visualization cache.
+
+Besides `Trajectory_{visualization_name}.json`, a full run of `plot_dtdg.get_visualization_cache` writes:
+
+- `Manifest_{visualization_name}.json`: the snapshots, nodes and trace layout covered by the cache.
+- `Anchors_{visualization_name}.npy`: 2D coordinates of the reference (anchor) nodes, (#reference_nodes, 2).
+- `Coords_{visualization_name}.npy`: projected coordinates, (#snapshots, #projected_nodes, 2).
+- `Projector_{visualization_name}.pt`: the fitted MLP, only with `--projection_engine mlp`.
+- `Neighbors_{visualization_name}.npz`: the top-max(nn) anchor neighbors of each (projected node, snapshot), only
+  with `--projection_engine knn`. Used by the Dash app to change nn and interpolation on the fly.
+- `Traces_{visualization_name}.bin`: the background layers and full trajectories, indexed by node id, so that the Dash
+  apps can read single trajectories on demand. See `visualization.trace_store`.
+
+With these files, snapshots appended to `z` can be projected onto the same reference frame and appended to the
+cached trajectories and animation frames without refitting the visualization model or rebuilding existing frames.
+
+Without `idx_reference_snapshot` in the config of a dataset, the reference snapshot defaults to the last one, and
+appending snapshots changes the name that the current data gives the cache. The cache keeps its name, and is found
+through the reference snapshot stored in its manifest instead, see `find_cache_manifest`.
+"""
+
+import base64
+import copy
+import glob
+import json
+import logging
+import os.path as osp
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+def get_cache_paths(visual_dir: str, visualization_name: str) -> dict:
+    return {
+        "figure": osp.join(visual_dir, f"Trajectory_{visualization_name}.json"),
+        "manifest": osp.join(visual_dir, f"Manifest_{visualization_name}.json"),
+        "anchors": osp.join(visual_dir, f"Anchors_{visualization_name}.npy"),
+        "coords": osp.join(visual_dir, f"Coords_{visualization_name}.npy"),
+        "projector": osp.join(visual_dir, f"Projector_{visualization_name}.pt"),
+        "neighbors": osp.join(visual_dir, f"Neighbors_{visualization_name}.npz"),
+        "traces": osp.join(visual_dir, f"Traces_{visualization_name}.bin"),
+        "shared": osp.join(visual_dir, f"Shared_{visualization_name}"),
+    }
+
+
+def save_cache_manifest(visual_dir: str, visualization_name: str, manifest: dict):
+    manifest = {"version": MANIFEST_VERSION, **manifest}
+    with open(get_cache_paths(visual_dir, visualization_name)["manifest"], 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def load_cache_manifest(visual_dir: str, visualization_name: str):
+    """Load the cache manifest. Returns None if the cache was written before manifests existed."""
+    paths = get_cache_paths(visual_dir, visualization_name)
+
+    if not all(osp.exists(paths[name]) for name in ["figure", "manifest", "anchors", "coords"]):
+        return None
+
+    with open(paths["manifest"], 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+
+    if not osp.exists(paths["projector" if manifest.get("projection_engine") == "mlp" else "neighbors"]):
+        return None
+
+    return manifest
+
+
+def find_cache_manifest(visual_dir: str, visualization_name: str):
+    r"""Find the cache of a visualization, whose reference snapshot may differ from the one in its name.
+
+    Caches are matched by all other parts of their name, and by the reference snapshot stored in their manifest.
+
+    Returns:
+        tuple: The name of the cache and its manifest, or (`visualization_name`, None) if no cache matches
+
+    Raises:
+        ValueError: If several caches with different reference snapshots match
+    """
+
+    manifest = load_cache_manifest(visual_dir, visualization_name)
+    if manifest is not None:
+        return visualization_name, manifest
+
+    prefix = visualization_name.rsplit("_snapshot", 1)[0]
+    candidates = []
+    for path in sorted(glob.glob(osp.join(glob.escape(visual_dir), f"Manifest_{glob.escape(prefix)}_snapshot*.json"))):
+        name = osp.basename(path)[len("Manifest_"):-len(".json")]
+        manifest = load_cache_manifest(visual_dir, name)
+        if manifest is not None and name == f"{prefix}_snapshot{manifest.get('idx_reference_snapshot')}":
+            candidates += [(name, manifest)]
+
+    if len(candidates) > 1:
+        raise ValueError(f"Several visualization caches match {visualization_name}: "
+                         f"{', '.join(name for name, _ in candidates)}. Set `idx_reference_snapshot` in the config of "
+                         f"the dataset to select one.")
+
+    if len(candidates) == 0:
+        return visualization_name, None
+
+    logger.info(f"Using the visualization cache {candidates[0][0]}, whose reference snapshot differs from the default")
+    return candidates[0]
+
+
+def resolve_visualization_name(visual_dir: str, visualization_name: str) -> str:
+    """The name of the cache of a visualization, see `find_cache_manifest`. Existing caches are used as they are."""
+    if osp.exists(get_cache_paths(visual_dir, visualization_name)["figure"]):
+        return visualization_name
+
+    return find_cache_manifest(visual_dir, visualization_name)[0]
+
+
+def get_new_snapshot_indices(manifest: dict, snapshot_names) -> np.ndarray:
+    """Indices of the snapshots in `snapshot_names` that are not covered by the cache yet."""
+    cached_snapshot_names = [str(name) for name in manifest["snapshot_names"]]
+    snapshot_names = [str(name) for name in snapshot_names]
+
+    if snapshot_names[:len(cached_snapshot_names)] != cached_snapshot_names:
+        raise ValueError("The cached snapshots are not a prefix of the current snapshots. Rebuild the visualization "
+                         "cache without --append.")
+
+    return np.arange(len(cached_snapshot_names), len(snapshot_names))
+
+
+def thin_display_name(name: str, idx_point: int, num_snapshots: int) -> str:
+    """Only label every few points of a trajectory so that long trajectories stay readable."""
+    if num_snapshots <= 10:
+        return name
+    elif num_snapshots <= 20:
+        return name if idx_point % 3 == 0 else ""
+    else:
+        return name if idx_point % 10 == 0 else ""
+
+
+def decode_plotly_array(value) -> list:
+    """Convert an array serialized by plotly (either a list or a base64 typed array) into a list."""
+    if value is None:
+        return []
+
+    if isinstance(value, dict) and "bdata" in value:
+        arr = np.frombuffer(base64.b64decode(value["bdata"]), dtype=np.dtype(value["dtype"]))
+        if "shape" in value:
+            arr = arr.reshape([int(d) for d in str(value["shape"]).split(",")])
+        return arr.tolist()
+
+    return list(value)
+
+
+def append_snapshots_to_figure(fig_dict: dict, manifest: dict, coords: np.ndarray, node_presence: np.ndarray,
+                               snapshot_names, idx_new_snapshots) -> dict:
+    r"""Append animation frames for new snapshots to a cached trajectory figure in place.
+
+    Only the last cached frame is read, and the cached frames are not rebuilt. Each new frame still holds the
+    trajectories up to its snapshot, so building the new frames takes time proportional to the number of new snapshots
+    times the total number of snapshots.
+
+    Args:
+        fig_dict (dict): The cached figure, as read from `Trajectory_*.json`
+        manifest (dict): The cache manifest
+        coords (np.ndarray): Projected coordinates of all snapshots, (#snapshots, #projected_nodes, 2)
+        node_presence (np.ndarray): Presence of the projected nodes at all snapshots, (#snapshots, #projected_nodes)
+        snapshot_names: Names of all snapshots
+        idx_new_snapshots: Indices of the snapshots to append
+
+    Returns:
+        dict: the updated figure
+    """
+
+    frames = fig_dict["frames"]
+    num_background_traces = manifest["num_background_traces"]
+    background_traces = frames[-1]["data"][:num_background_traces]
+    templates = frames[-1]["data"][num_background_traces:]
+
+    idx_projected = [manifest["projected_nodes"].index(node) for node in manifest["trajectory_nodes"]]
+
+    # Labels are thinned like those of the cached points, i.e. by the number of snapshots when the cache was built
+    num_labeled_snapshots = manifest.get("num_labeled_snapshots", len(manifest["snapshot_names"]))
+
+    # The trajectories (up to the last cached snapshot) that the new points are appended to
+    points = []
+    for template in templates:
+        points += [{field: decode_plotly_array(template.get(field)) for field in
+                    ["x", "y", "text", "hovertext", "customdata"]}]
+
+    sliders = fig_dict.get("layout", {}).get("sliders", [])
+    slider_step_template = sliders[0]["steps"][-1] if sliders and sliders[0].get("steps") else None
+
+    for idx_snapshot in idx_new_snapshots:
+        traces = []
+        for template, p, node, point in zip(templates, idx_projected, manifest["trajectory_nodes"], points):
+            if node_presence[idx_snapshot, p]:
+                point["x"] += [float(coords[idx_snapshot, p, 0])]
+                point["y"] += [float(coords[idx_snapshot, p, 1])]
+                point["text"] += [thin_display_name(f"{node} ({snapshot_names[idx_snapshot]})", len(point["x"]) - 1,
+                                                    num_labeled_snapshots)]
+                point["hovertext"] += [f"Node: {node} | Snapshot: {snapshot_names[idx_snapshot]}"]
+                if point["customdata"]:
+                    point["customdata"] += [point["customdata"][-1]]
+
+            trace = dict(template)
+            for field, values in point.items():
+                if field in template or values:
+                    trace[field] = list(values)
+            traces += [trace]
+
+        frames += [{"data": background_traces + traces, "name": str(idx_snapshot)}]
+
+        if slider_step_template is not None:
+            step = copy.deepcopy(slider_step_template)
+            step["args"][0] = [str(idx_snapshot)]
+            step["label"] = str(idx_snapshot)
+            sliders[0]["steps"] += [step]
+
+    return fig_dict
@@ -0,0 +1,53 @@
+"""Helpers shared by the caches and coordinators of the Dash apps."""
+
+import os
+import threading
+
+# Guards the replacement of locks in a new process. Replaced itself in forked processes, by a single fork hook of the
+# module, so that no hook is registered per lock
+_replace_lock = threading.Lock()
+
+
+def _reset_replace_lock():
+    global _replace_lock
+    _replace_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_replace_lock)
+
+
+class ForkSafeLock:
+    r"""A `threading.Lock` that is recreated in forked processes, e.g. background jobs and preloaded WSGI workers.
+
+    A forked process inherits a lock in whatever state a thread of the parent left it. This lock notices the new process
+    id on its first use in a process, and then replaces the inherited lock.
+
+    Args:
+        on_fork: Called without arguments when the lock is replaced in a new process, e.g. to drop state that belongs
+            to threads of the parent. The new lock is not held while it runs
+    """
+
+    def __init__(self, on_fork=None):
+        self.on_fork = on_fork
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _get_lock(self) -> threading.Lock:
+        pid = os.getpid()
+        if self._pid != pid:
+            with _replace_lock:
+                if self._pid != pid:
+                    if self.on_fork is not None:
+                        self.on_fork()
+                    self._lock = threading.Lock()
+                    self._pid = pid
+
+        return self._lock
+
+    def __enter__(self):
+        self._get_lock().acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._lock.release()
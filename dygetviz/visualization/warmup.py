@@ -0,0 +1,175 @@
+"""Readiness, liveness and a non-blocking warm-up of the Dash app.
+
+`plot_dash.py` loads the data, the visualization cache and the node index at import time, which takes minutes on large
+datasets. Without a warm-up, the port only opens once everything is loaded: health checks fail in the meantime, and
+a restart is an outage.
+
+With `--warm_up`, `WarmUp.start` opens the port in a background thread before anything is loaded, while the module
+keeps loading. Until the app is ready, every page is a lightweight "warming up" page that shows the progress of the
+startup stages and reloads into the app when it is ready. Other requests, e.g. callbacks of a page opened before a
+restart, get `503 Service Unavailable` with a `Retry-After` header. Afterwards, all requests go to the Flask server of
+the app, which is only touched once it is complete.
+
+`WarmUp.install` adds the health checks to the Flask server, also without `--warm_up`:
+
+- `/healthz` (liveness): 200 as long as the process serves requests,
+- `/readyz` (readiness): 200 once the app is ready, otherwise 503. Both report the progress of the startup as JSON.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LIVENESS_PATH = "/healthz"
+READINESS_PATH = "/readyz"
+
+# Seconds after which clients should retry a request made while warming up
+RETRY_AFTER = 5
+
+WARM_UP_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{font-family: sans-serif; margin: 20vh auto; max-width: 480px; color: #333;}}
+.bar {{height: 12px; background: #e9ecef; border-radius: 6px; overflow: hidden;}}
+.fill {{height: 100%; background: #0d6efd; transition: width 0.5s;}}
+</style>
+</head>
+<body>
+<h3>{title} is warming up</h3>
+<div class="bar"><div class="fill" id="fill" style="width: {percent}%"></div></div>
+<p id="message">{message}</p>
+<script>
+setInterval(function () {{
+    fetch("{readiness_path}").then(function (response) {{
+        if (response.ok) {{
+            window.location.reload();
+        }}
+        return response.json();
+    }}).then(function (status) {{
+        document.getElementById("fill").style.width = Math.round(100 * status.progress) + "%";
+        document.getElementById("message").textContent = status.message || "";
+    }}).catch(function () {{}});
+}}, 1000);
+</script>
+</body>
+</html>
+"""
+
+
+class WarmUp:
+    r"""Progress and readiness of the startup of a Dash app, and a server that answers while it warms up.
+
+    Args:
+        startup (StartupTimer): Timer of the startup stages
+        stages (list): Names of all stages of the startup, to report the progress
+        title (str): Title of the app on the "warming up" page
+    """
+
+    def __init__(self, startup, stages: list, title: str = "DyGETViz"):
+        self.startup = startup
+        self.stages = list(stages)
+        self.title = title
+        self.server = None
+
+        self._ready = threading.Event()
+        self._start = time.time()
+        self._thread = None
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def get_status(self) -> dict:
+        """Readiness, progress (between 0 and 1) and current message of the startup."""
+        if self.is_ready:
+            progress, message = 1., "Ready"
+        else:
+            num_started = len(set(self.startup.started) & set(self.stages))
+            progress = max(0, num_started - 1) / max(1, len(self.stages))
+            message = self.startup.message
+
+        return dict(ready=self.is_ready, progress=progress, message=message, stages=list(self.startup.started),
+                    uptime=time.time() - self._start)
+
+    def set_ready(self, server=None):
+        r"""Mark the app as ready, and send all further requests to its server.
+
+        Args:
+            server (flask.Flask): The server of the Dash app. Only needed after `start`
+        """
+        if server is not None:
+            self.server = server
+
+        self._ready.set()
+        logger.info(f"Ready after {time.time() - self._start:.1f} s")
+
+    def install(self, server):
+        r"""Serve the liveness and readiness checks from a Flask server.
+
+        Args:
+            server (flask.Flask): The server of a Dash app
+        """
+        import flask
+
+        @server.route(LIVENESS_PATH)
+        def get_liveness():
+            return flask.jsonify(self.get_status())
+
+        @server.route(READINESS_PATH)
+        def get_readiness():
+            return flask.jsonify(self.get_status()), 200 if self.is_ready else 503
+
+    def _respond(self, start_response, status: str, body: str, content_type: str, headers=()):
+        body = body.encode("utf-8")
+        start_response(status, [("Content-Type", content_type), ("Content-Length", str(len(body))),
+                                ("Cache-Control", "no-store")] + list(headers))
+        return [body]
+
+    def __call__(self, environ, start_response):
+        """WSGI entry point: the app once it is ready, and the warm-up responses until then."""
+        if self.is_ready and self.server is not None:
+            return self.server(environ, start_response)
+
+        path = environ.get("PATH_INFO", "")
+        status = self.get_status()
+
+        if path.endswith(LIVENESS_PATH):
+            return self._respond(start_response, "200 OK", json.dumps(status), "application/json")
+
+        retry_after = [("Retry-After", str(RETRY_AFTER))]
+        if path.endswith(READINESS_PATH) or "text/html" not in environ.get("HTTP_ACCEPT", ""):
+            return self._respond(start_response, "503 Service Unavailable", json.dumps(status), "application/json",
+                                 retry_after)
+
+        page = WARM_UP_PAGE.format(title=self.title, percent=round(100 * status["progress"]),
+                                   message=status["message"] or "", readiness_path=READINESS_PATH)
+        return self._respond(start_response, "503 Service Unavailable", page, "text/html; charset=utf-8", retry_after)
+
+    def start(self, port: int, host: str = None):
+        r"""Open the port in a background thread, before the app is loaded.
+
+        The thread is a daemon, so the process still exits if loading the app fails. Call `wait` once the app is ready.
+
+        Args:
+            port (int): Port to listen on
+            host (str): Address to listen on. Default: `$HOST` or 127.0.0.1, like `Dash.run`
+        """
+        from werkzeug.serving import make_server
+
+        host = host or os.getenv("HOST", "127.0.0.1")
+        http_server = make_server(host, port, self, threaded=True)
+        self._thread = threading.Thread(target=http_server.serve_forever, name="warm-up-server", daemon=True)
+        self._thread.start()
+        logger.info(f"Serving on http://{host}:{port} while warming up")
+
+    def wait(self):
+        """Keep serving until the process is stopped."""
+        if self._thread is not None:
+            self._thread.join()
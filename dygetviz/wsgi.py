@@ -0,0 +1,54 @@
+"""WSGI entry point for serving the Dash apps with several worker processes.
+
+Run from the root of the repository, e.g. with 8 gunicorn workers:
+
+    DYGETVIZ_ARGS="--dataset_name Chickenpox --model GConvGRU" \
+        gunicorn --pythonpath dygetviz --preload --workers 8 --bind 0.0.0.0:8050 "wsgi:create_app()"
+
+With `--preload`, the app is built once in the master process and the workers are forked from it, so they share its
+memory until they write to it. Arrays that the callbacks read are memory-mapped read-only (see
+`visualization/data_plane.py`), and the trajectories are read from the memory-mapped trace store, so these stay shared
+in any case.
+
+Each request of a browser session may reach a different worker. The workers share the sessions of `plot_dash` through
+`--session_store diskcache`, which is the default here. With `--session_store memory`, run a single worker, or route
+all requests of a client to the same worker, e.g. with a proxy that hashes the client address.
+"""
+
+import gc
+import importlib
+import os
+import os.path as osp
+import shlex
+import sys
+
+
+def create_app(module: str = "plot_dash", argv=None):
+    r"""Build a Dash app and return its Flask server.
+
+    Args:
+        module (str): The app to serve: `plot_dash`, `plot_dash_server` or `plot_dash_server_wholeplots`
+        argv (list): Command line arguments of the app. Default: the `DYGETVIZ_ARGS` environment variable
+
+    Returns:
+        flask.Flask: The WSGI application
+    """
+
+    if argv is None:
+        argv = shlex.split(os.environ.get("DYGETVIZ_ARGS", ""))
+
+    # The workers must share the sessions, since each request may reach a different worker
+    if not any(arg == "--session_store" or arg.startswith("--session_store=") for arg in argv):
+        argv = list(argv) + ["--session_store", "diskcache"]
+
+    sys.path.insert(0, osp.dirname(osp.abspath(__file__)))
+
+    # The apps parse their arguments when they are imported
+    sys.argv = [f"{module}.py"] + list(argv)
+    app_module = importlib.import_module(module)
+
+    # Everything loaded so far lives until the process exits. Excluding it from garbage collection keeps the collector
+    # from writing to its pages in the workers, which would give each worker a private copy of them
+    gc.freeze()
+
+    return app_module.app.server
@@ -24,10 +24,11 @@ def read_requirements():
         # Fallback requirements list
         requirements = [
             "biopython",
-            "dash", 
+            "dash[diskcache]>=2.18", 
             "dash-ag-grid",
             "dash-bootstrap-components",
             "dash-dangerously-set-inner-html",
+            "Flask-Compress",
             "Markdown",
             "matplotlib",
             "numba", 
@@ -0,0 +1,7 @@
+"""Shared pytest configuration of the tests."""
+
+import os.path as osp
+import sys
+
+# Import the modules like the Dash apps do, without the package `__init__` and its training dependencies
+sys.path.insert(0, osp.join(osp.dirname(__file__), '..', 'dygetviz'))
@@ -0,0 +1,130 @@
+"""Test coalescing identical computations and admission control of the Dash callbacks."""
+
+import threading
+import time
+
+import pytest
+
+
+class TestSingleFlight:
+    """Test sharing computations that are in flight."""
+
+    def test_identical_computations_are_shared(self):
+        from visualization.admission import SingleFlight
+
+        flights = SingleFlight("test")
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {"x": [0., 1.]}
+
+        leader = threading.Thread(target=lambda: results.append(flights.do("category", compute)))
+        leader.start()
+        started.wait(5)
+
+        followers = [threading.Thread(target=lambda: results.append(flights.do("category", compute))) for _ in range(3)]
+        for follower in followers:
+            follower.start()
+        while flights.coalesced < 3:
+            time.sleep(0.01)
+
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+
+        assert len(calls) == 1 and len(results) == 4
+        assert all(result is results[0] for result in results)
+
+        # Later calls compute again
+        flights.do("category", lambda: calls.append(2))
+        assert calls == [1, 2]
+
+    def test_errors_are_raised(self):
+        from visualization.admission import SingleFlight
+
+        def compute():
+            raise ValueError("failed")
+
+        with pytest.raises(ValueError):
+            SingleFlight().do("category", compute)
+
+    def test_forked_process_drops_flights(self, monkeypatch):
+        import visualization.utils
+        from visualization.admission import SingleFlight
+
+        flights = SingleFlight()
+        flights._lock._lock.acquire()
+        flights._flights["category"] = object()
+
+        # A forked process sees a held lock and the computations of the parent's threads
+        pid = visualization.utils.os.getpid() + 1
+        monkeypatch.setattr(visualization.utils.os, "getpid", lambda: pid)
+        assert flights.do("category", lambda: 1) == 1
+        assert not flights._flights
+
+
+class TestWorkQueue:
+    """Test the concurrency limits and the bounded queue."""
+
+    def test_parse_limits(self):
+        from visualization.admission import parse_limits
+
+        assert parse_limits("add-trajectory:4, projection:2,") == {"add-trajectory": 4, "projection": 2}
+
+    def test_busy_when_saturated(self):
+        from visualization.admission import Busy, WorkQueue
+
+        queue = WorkQueue({"projection": 1}, max_waiting=1, timeout=5.)
+        release = threading.Event()
+        rejected = []
+
+        def run():
+            try:
+                with queue.slot("projection"):
+                    release.wait(5)
+            except Busy:
+                rejected.append(1)
+
+        running = threading.Thread(target=run)
+        running.start()
+        while queue.get_stats()["projection"]["running"] < 1:
+            time.sleep(0.01)
+
+        waiting = threading.Thread(target=run)
+        waiting.start()
+        while queue.get_stats()["projection"]["waiting"] < 1:
+            time.sleep(0.01)
+
+        # The only slot is taken and the queue is full
+        with pytest.raises(Busy):
+            with queue.slot("projection"):
+                pass
+
+        # Operations without a limit are not queued
+        with queue.slot("click"):
+            pass
+
+        release.set()
+        running.join(5)
+        waiting.join(5)
+        assert not rejected
+        assert queue.get_stats()["projection"] == {"limit": 1, "running": 0, "waiting": 0, "rejected": 1}
+
+    def test_busy_after_timeout(self):
+        from visualization.admission import Busy, WorkQueue
+
+        queue = WorkQueue({"viewport": 1}, timeout=0.05)
+        with queue.slot("viewport"):
+            with pytest.raises(Busy):
+                with queue.slot("viewport"):
+                    pass
+
+        assert queue.get_stats()["viewport"]["waiting"] == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,82 @@
+"""Test the aggregated rendering of node categories."""
+
+import numpy as np
+import pytest
+
+
+class TestAggregation:
+    """Test the median path, the percentile band and the representative members of a category."""
+
+    def test_aggregate_ignores_absent_members(self):
+        from visualization.aggregation import aggregate_trajectories
+
+        # 3 snapshots, 4 members. The last member is an outlier that is absent in the first snapshot
+        coords = np.zeros((3, 4, 2))
+        coords[:, :3, 0] = [[0., 1., 2.]] * 3
+        coords[:, 3] = 100.
+        coords[0, 3] = np.nan
+        coords[2] = np.nan
+
+        aggregate = aggregate_trajectories(coords, percentile=50., num_samples=2)
+
+        assert aggregate['count'].tolist() == [3, 4, 0]
+        assert np.allclose(aggregate['median'][0], [1., 0.])
+        assert np.isclose(aggregate['radius'][0], 1.)
+        assert np.all(np.isnan(aggregate['median'][2])) and np.isnan(aggregate['radius'][2])
+
+        # The members closest to the median path, never the outlier
+        assert 3 not in aggregate['representatives'].tolist()
+        assert len(aggregate['representatives']) == 2
+
+    def test_stack_member_coords_and_band(self):
+        from visualization.aggregation import get_band_polygon, stack_member_coords
+
+        presence = np.array([[1, 0], [1, 1], [0, 1]], dtype=bool)
+        coords = stack_member_coords([{'x': [0., 1.], 'y': [0., 0.]}, {'x': [2., 3.], 'y': [1., 1.]}], presence)
+
+        assert coords.shape == (3, 2, 2)
+        assert np.isnan(coords[2, 0]).all() and np.isnan(coords[0, 1]).all()
+        assert coords[1, 1].tolist() == [2., 1.]
+
+        # A horizontal path is offset vertically
+        x, y = get_band_polygon(np.array([[0., 0.], [1., 0.], [2., 0.]]), np.array([1., 1., 1.]))
+        assert len(x) == 7
+        assert sorted(set(np.round(y, 6))) == [-1., 1.]
+
+    def test_aggregator_caches_by_key(self):
+        from visualization.aggregation import CategoryAggregator
+
+        calls = []
+
+        def get_coords():
+            calls.append(1)
+            return np.random.randn(5, 10, 2)
+
+        aggregator = CategoryAggregator(max_cache_size=1)
+        aggregate = aggregator.get(("a", 4, 0.2), get_coords)
+        assert aggregator.get(("a", 4, 0.2), get_coords) is aggregate
+        assert len(calls) == 1
+
+        aggregator.get(("b", 4, 0.2), get_coords)
+        aggregator.get(("a", 4, 0.2), get_coords)
+        assert len(calls) == 3
+
+    def test_category_traces_are_dicts(self):
+        from visualization.aggregation import CategoryAggregator, aggregate_trajectories, get_category_traces
+
+        coords = np.random.randn(4, 6, 2)
+        traces = get_category_traces(aggregate_trajectories(coords), "a", "red", ["t0", "t1", "t2", "t3"])
+
+        assert isinstance(traces['band'], dict) and isinstance(traces['median'], dict)
+        assert traces['median']['line']['color'] == "red" and len(traces['median']['x']) == 4
+        assert traces['band']['fillcolor'] == "rgba(255, 0, 0, 0.25)"
+
+        aggregator = CategoryAggregator()
+        templates = aggregator.get_templates("a", "red")
+        assert aggregator.get_templates("a", "red") is templates
+        assert "x" not in templates['median']
+        assert aggregator.get_templates("a", "blue")['median']['line']['color'] == "blue"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,51 @@
+"""Test the styling of the anchor nodes."""
+
+import pandas as pd
+import pytest
+
+
+def get_node_styles_per_node(nodes, highlighted_nodes, plot_anomaly_labels, node2label) -> pd.DataFrame:
+    """The styles as assigned by the per-node loop that `get_node_styles` replaced."""
+    from const import node_type_to_color
+
+    def process_row(row):
+        node = row["node"]
+        if node in highlighted_nodes:
+            return {'node_size': 60, 'node_color': node_type_to_color['highlighted'], 'node_type': 'highlighted',
+                    'display_name': node}
+
+        if plot_anomaly_labels and node2label[node] == 1:
+            return {'node_size': 5, 'node_color': node_type_to_color['anomaly'], 'node_type': 'anomaly',
+                    'display_name': ""}
+
+        return {'node_size': 5, 'node_color': node_type_to_color['background'], 'node_type': 'background',
+                'display_name': ""}
+
+    return pd.DataFrame({"node": nodes}).apply(process_row, axis=1, result_type="expand")
+
+
+class TestNodeStyles:
+    """Test that the vectorized styling matches the per-node loop."""
+
+    # Highlighted nodes come first, so that the order of first appearance differs from the alphabetical one
+    nodes = ["h1", "b1", "a1", "b2", "h2", "a2", "b3"]
+    highlighted_nodes = ["h1", "h2"]
+    node2label = {"h1": 1, "b1": 0, "a1": 1, "b2": 0, "h2": 0, "a2": 1, "b3": 0}
+
+    @pytest.mark.parametrize("plot_anomaly_labels", [True, False])
+    def test_matches_per_node_loop(self, plot_anomaly_labels):
+        from visualization.anchor_nodes_generator import get_node_styles
+
+        styles = get_node_styles(self.nodes, self.highlighted_nodes, plot_anomaly_labels, self.node2label)
+        expected = get_node_styles_per_node(self.nodes, self.highlighted_nodes, plot_anomaly_labels, self.node2label)
+
+        for column in ["node_size", "node_color", "node_type", "display_name"]:
+            assert styles[column].tolist() == expected[column].tolist(), column
+
+        # Categories are ordered by first appearance, like the groups of the object columns of the loop
+        for column in ["node_color", "node_type", "display_name"]:
+            assert styles[column].cat.categories.tolist() == expected[column].unique().tolist(), column
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
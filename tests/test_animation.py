@@ -0,0 +1,81 @@
+"""Test serving the animation frames of a cached figure one snapshot at a time."""
+
+import base64
+import time
+
+import numpy as np
+import pytest
+
+
+def decode(encoded):
+    return np.frombuffer(base64.b64decode(encoded["bdata"]), dtype=np.dtype(encoded["dtype"]).newbyteorder('<'))
+
+
+def get_animated_figure(num_snapshots=4):
+    go = pytest.importorskip("plotly.graph_objects")
+
+    background = go.Scatter(x=[0., 1., 2.], y=[0., 1., 2.], name="background", mode="markers")
+    frames = []
+    for idx_snapshot in range(num_snapshots):
+        trajectories = [go.Scatter(x=np.arange(idx_snapshot + 1) + offset, y=np.arange(idx_snapshot + 1), name=name,
+                                   text=[f"{name} ({idx})" for idx in range(idx_snapshot + 1)])
+                        for offset, name in [(0., "a"), (10., "b")]]
+        frames += [go.Frame(data=[background] + trajectories, name=str(idx_snapshot))]
+
+    layout = dict(sliders=[dict(steps=[dict(label=str(idx)) for idx in range(num_snapshots)])],
+                  updatemenus=[dict(type="buttons")])
+    return go.Figure(data=frames[0].data, frames=frames, layout=layout)
+
+
+class TestSnapshotFrames:
+    """Test the deltas and figures of single snapshots."""
+
+    def test_get_delta(self):
+        from visualization.animation import SnapshotFrames
+
+        frames = SnapshotFrames(get_animated_figure(), prefetch=0)
+        assert len(frames) == 4
+        assert frames.dynamic_traces == {"a", "b"}
+
+        # Only the displayed trajectories are sent, and not the background, which is the same in every frame
+        delta = frames.get_delta(2, ["background", "b"])
+        assert list(delta) == ["b"]
+        assert np.allclose(decode(delta["b"]["x"]), [10., 11., 12.])
+        assert list(delta["b"]["text"]) == ["b (0)", "b (1)", "b (2)"]
+
+        frames.get_delta(2)
+        assert frames.get_stats()["hits"] == 1
+
+    def test_get_figure(self):
+        from visualization.animation import SnapshotFrames
+
+        figure = SnapshotFrames(get_animated_figure(), prefetch=0).get_figure()
+        assert "frames" not in figure
+        assert "sliders" not in figure["layout"] and "updatemenus" not in figure["layout"]
+        assert [trace["name"] for trace in figure["data"]] == ["background", "a", "b"]
+        assert np.allclose(decode(figure["data"][1]["x"]), [0., 1., 2., 3.])
+
+    def test_prefetch(self):
+        from visualization.animation import SnapshotFrames
+
+        frames = SnapshotFrames(get_animated_figure(), prefetch=1)
+        frames.get_delta(1)
+        for _ in range(100):
+            if frames.get_stats()["prefetched"] == 2:
+                break
+            time.sleep(0.01)
+
+        frames.get_delta(0)
+        frames.get_delta(2)
+        assert frames.get_stats()["hits"] == 2
+
+    def test_get_slider_marks(self):
+        from visualization.animation import get_slider_marks
+
+        marks = get_slider_marks([str(idx) for idx in range(30)], max_marks=10)
+        assert len(marks) <= 11
+        assert marks[0] == "0" and marks[29] == "29"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,42 @@
+"""Test the trajectories shipped to the browser for clientside toggling."""
+
+import base64
+
+import numpy as np
+import pytest
+
+
+class TestPackCoordinates:
+    """Test packing trajectories into typed arrays."""
+
+    def test_pack_coordinates(self):
+        from visualization.clientside import get_payload_size, pack_coordinates
+
+        node2coords = {
+            "a": (np.array([0., 1., 2.]), np.array([3., 4., 5.])),
+            "b": ([6.5], [7.5]),
+        }
+        packed = pack_coordinates(node2coords)
+
+        assert packed["nodes"] == ["a", "b"]
+        assert packed["offsets"] == [0, 3, 4]
+        assert packed["x"]["dtype"] == "f4"
+
+        x = np.frombuffer(base64.b64decode(packed["x"]["bdata"]), dtype='<f4')
+        y = np.frombuffer(base64.b64decode(packed["y"]["bdata"]), dtype='<f4')
+        assert np.array_equal(x, [0., 1., 2., 6.5]) and np.array_equal(y, [3., 4., 5., 7.5])
+
+        # Typed arrays are smaller than JSON lists of the same numbers
+        coords = np.random.randn(1000, 2)
+        assert get_payload_size(pack_coordinates({"a": (coords[:, 0], coords[:, 1])})) < get_payload_size(
+            coords.tolist()) / 2
+
+    def test_pack_no_coordinates(self):
+        from visualization.clientside import pack_coordinates
+
+        packed = pack_coordinates({})
+        assert packed["offsets"] == [0] and packed["x"]["bdata"] == ""
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
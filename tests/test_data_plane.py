@@ -0,0 +1,58 @@
+"""Test the shared, read-only data plane of the Dash apps."""
+
+import os
+import os.path as osp
+
+import numpy as np
+import pytest
+
+
+class TestSharedArrays:
+    """Test writing arrays once and mapping them read-only."""
+
+    def test_attach_writes_once_and_maps_read_only(self, tmp_path):
+        from visualization.data_plane import SharedArrays
+
+        reference_path = str(tmp_path / "Traces_test.bin")
+        open(reference_path, 'w').close()
+        shared_arrays = SharedArrays(str(tmp_path / "Shared_test"), reference_path)
+
+        calls = []
+
+        def build():
+            calls.append(1)
+            return np.arange(6, dtype=np.float32).reshape(2, 3)
+
+        array = shared_arrays.attach("coords", build)
+        assert isinstance(array, np.memmap) and not array.flags.writeable
+        assert np.array_equal(shared_arrays.attach("coords", build), np.arange(6).reshape(2, 3))
+        assert len(calls) == 1
+
+        # Rebuilding the cache makes the arrays stale
+        os.utime(reference_path, (osp.getmtime(shared_arrays.get_path("coords")) + 10,) * 2)
+        shared_arrays.attach("coords", build)
+        assert len(calls) == 2
+
+        with pytest.raises(ValueError):
+            shared_arrays.attach("names", lambda: np.array(["a", None], dtype=object))
+
+    def test_neighbor_index_load_shared(self, tmp_path):
+        from visualization.data_plane import SharedArrays
+        from visualization.projection import NeighborIndex
+
+        neighbors = np.random.randint(0, 10, size=(3, 5, 4))
+        self_coords = np.random.randn(5, 2)
+        embedding_train = np.random.randn(10, 2)
+
+        path = str(tmp_path / "Neighbors_test.npz")
+        NeighborIndex.save(path, neighbors, self_coords)
+
+        index = NeighborIndex.load(path, embedding_train)
+        shared_index = NeighborIndex.load_shared(path, embedding_train, SharedArrays(str(tmp_path / "Shared_test")))
+
+        assert isinstance(shared_index.cumsum, np.memmap)
+        assert np.allclose(index.get_coords(3, 0.2), shared_index.get_coords(3, 0.2))
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
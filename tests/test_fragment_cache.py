@@ -0,0 +1,55 @@
+"""Test the cache of figure fragments of the Dash apps."""
+
+import numpy as np
+import pytest
+
+
+class TestFragmentCache:
+    """Test the memory and disk tiers of the fragment cache."""
+
+    def test_memory_tier_is_bounded(self):
+        from visualization.fragment_cache import FragmentCache, get_fragment_key
+
+        cache = FragmentCache(max_size=2)
+        calls = []
+
+        def build(value):
+            calls.append(value)
+            return {'x': [value]}
+
+        keys = [get_fragment_key("Synth", node) for node in ["a", "b", "c"]]
+        assert cache.get(keys[0], lambda: build(0)) == {'x': [0]}
+        assert cache.get(keys[0], lambda: build(0)) == {'x': [0]}
+        cache.get(keys[1], lambda: build(1))
+        cache.get(keys[2], lambda: build(2))
+
+        # The least recently used fragment was evicted
+        cache.get(keys[0], lambda: build(0))
+        assert calls == [0, 1, 2, 0] and len(cache) == 2
+
+        stats = cache.get_stats()
+        assert (stats['hits'], stats['misses'], stats['disk_hits']) == (1, 4, 0)
+
+    def test_disk_tier_survives_restarts(self, tmp_path):
+        from visualization.fragment_cache import FragmentCache, get_fragment_key, pack_trace
+
+        key = get_fragment_key("Synth", "trajectory", "node1", 3, 0.2)
+        fragment = pack_trace({'x': [0, 1.5], 'y': [2., None], 'hovertext': ['a', 'b']})
+        assert isinstance(fragment['x'], np.ndarray) and isinstance(fragment['y'], list)
+
+        FragmentCache(cache_dir=str(tmp_path)).get(key, lambda: fragment)
+
+        cache = FragmentCache(cache_dir=str(tmp_path))
+        restored = cache.get(key, lambda: pytest.fail("The fragment should be read from disk"))
+        assert np.array_equal(restored['x'], [0, 1.5]) and restored['hovertext'] == ['a', 'b']
+        assert cache.get_stats()['disk_hits'] == 1
+
+    def test_fragment_key_is_stable(self):
+        from visualization.fragment_cache import get_fragment_key
+
+        assert get_fragment_key("Synth", ("label", "band"), 3) == get_fragment_key("Synth", ["label", "band"], 3)
+        assert get_fragment_key("Synth", "node1", 3) != get_fragment_key("Synth", "node1", 5)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,45 @@
+"""Test running slow interactions of the Dash app as background jobs."""
+
+import os
+
+import pytest
+
+
+class TestJobs:
+    """Test the progress of jobs and the fragments they share with the server."""
+
+    def test_run_tasks(self):
+        from visualization.jobs import run_tasks
+
+        done, progress = [], []
+        run_tasks([lambda idx=idx: done.append(idx) for idx in range(10)], progress.append, num_updates=3)
+        assert done == list(range(10))
+
+        # Progress is reported a few times, and always when the job is done
+        assert progress == [(3, 10), (6, 10), (9, 10), (10, 10)]
+
+    def test_get_job_manager(self, tmp_path):
+        pytest.importorskip("diskcache")
+        pytest.importorskip("dash")
+        from visualization.jobs import get_job_manager
+
+        assert get_job_manager(str(tmp_path), cache_by=[lambda: "version"], expire=60) is not None
+
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="Jobs run in forked processes")
+    def test_fragments_are_shared_through_disk(self, tmp_path):
+        from visualization.fragment_cache import FragmentCache, get_fragment_key
+
+        cache = FragmentCache(cache_dir=str(tmp_path))
+        key = get_fragment_key("Synth", "trajectory", "node1", 3, 0.2)
+        assert not cache.contains(key)
+
+        # The lock is held by a thread of the server while a job is forked
+        with cache._lock:
+            pid = os.fork()
+            if pid == 0:
+                cache.get(key, lambda: {'x': [0., 1.]})
+                os._exit(0)
+
+        os.waitpid(pid, 0)
+        assert cache.contains(key)
+        assert cache.get(key, lambda: pytest.fail("The fragment should be read from disk")) == {'x': [0., 1.]}
@@ -0,0 +1,51 @@
+"""Test the viewport-aware level of detail of the background scatter."""
+
+import numpy as np
+import pytest
+
+
+class TestViewportIndex:
+    """Test viewport queries with a point budget."""
+
+    def test_query_respects_budget_and_viewport(self):
+        from visualization.lod import ViewportIndex
+
+        x, y = np.random.randn(2, 20000)
+        index = ViewportIndex(x, y, budget=1000, grid_size=32)
+
+        indices = index.query()
+        assert 900 <= len(indices) <= 1000
+        assert len(np.unique(indices)) == len(indices)
+
+        indices = index.query((0., 1.), (0., 1.))
+        assert len(indices) <= 1000
+        assert np.all((x[indices] >= 0) & (x[indices] <= 1) & (y[indices] >= 0) & (y[indices] <= 1))
+
+        # The same viewport always returns the same points
+        assert np.array_equal(indices, index.query((0., 1.), (0., 1.)))
+
+    def test_zooming_in_reveals_all_points(self):
+        from visualization.lod import ViewportIndex
+
+        x, y = np.random.randn(2, 20000)
+        index = ViewportIndex(x, y, budget=1000, grid_size=32)
+
+        inside = np.nonzero((np.abs(x) <= 0.1) & (np.abs(y) <= 0.1))[0]
+        assert len(inside) < 1000
+        assert np.array_equal(index.query((-0.1, 0.1), (-0.1, 0.1)), inside)
+
+        assert len(index.query((10., 11.), (10., 11.))) == 0
+
+    def test_sample_preserves_density(self):
+        from visualization.lod import ViewportIndex
+
+        # 80% of the points are in the left half
+        x = np.concatenate([np.random.uniform(-1, 0, 8000), np.random.uniform(0, 1, 2000)])
+        y = np.random.uniform(-1, 1, 10000)
+
+        indices = ViewportIndex(x, y, budget=1000, grid_size=16).query()
+        assert abs((x[indices] < 0).mean() - 0.8) < 0.05
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,75 @@
+"""Test the metrics of the Dash apps."""
+
+import pytest
+
+
+class TestMetricsRegistry:
+    """Test rendering metrics in the Prometheus text format."""
+
+    def test_render(self):
+        from visualization.metrics import MetricsRegistry
+
+        registry = MetricsRegistry()
+        lookups = registry.counter("lookups_total", "Lookups", ("cache", "result"))
+        latency = registry.histogram("latency_seconds", "Latency", ("action",), buckets=(0.1, 1.))
+        registry.add_collector(lambda: lookups.set(3, cache="fragments", result="hits"))
+
+        latency.observe(0.05, action="click")
+        latency.observe(0.5, action="click")
+        latency.observe(5., action="click")
+
+        text = registry.render()
+        assert "# TYPE lookups_total counter" in text
+        assert 'lookups_total{cache="fragments",result="hits"} 3.0' in text
+        assert 'latency_seconds_bucket{action="click",le="0.1"} 1' in text
+        assert 'latency_seconds_bucket{action="click",le="1.0"} 2' in text
+        assert 'latency_seconds_bucket{action="click",le="+Inf"} 3' in text
+        assert 'latency_seconds_count{action="click"} 3' in text
+
+    def test_startup_timer(self):
+        from visualization.metrics import STARTUP_SECONDS, StartupTimer
+
+        startup = StartupTimer("Test")
+        startup.stage("load_data")
+        startup.stage("options")
+        startup.finish()
+
+        assert STARTUP_SECONDS.get(dataset="Test", stage="load_data") >= 0.
+        assert ("Test", "options") in STARTUP_SECONDS._values
+
+
+class TestInstallMetrics:
+    """Test timing the requests of a Flask server."""
+
+    def test_install_metrics(self):
+        flask = pytest.importorskip("flask")
+
+        from visualization.metrics import CALLBACK_SECONDS, RESPONSE_BYTES, end_parse, install_metrics, \
+            timed_callback
+
+        server = flask.Flask(__name__)
+        install_metrics(server)
+
+        @server.route("/_dash-update-component", methods=["POST"])
+        @timed_callback()
+        def update_component():
+            end_parse("add-trajectory")
+            return flask.jsonify(x=list(range(100)))
+
+        count = CALLBACK_SECONDS.get_count(action="add-trajectory", phase="build")
+        client = server.test_client()
+        response = client.post("/_dash-update-component", json={"changedPropIds": ["add-trajectory.value"]})
+
+        for phase in ["parse", "build", "serialize", "total"]:
+            assert CALLBACK_SECONDS.get_count(action="add-trajectory", phase=phase) >= 1
+        assert CALLBACK_SECONDS.get_count(action="add-trajectory", phase="build") == count + 1
+        assert RESPONSE_BYTES.get_sum(action="add-trajectory") >= len(response.get_data())
+
+        metrics = client.get("/metrics")
+        assert metrics.mimetype == "text/plain"
+        assert 'dygetviz_callback_seconds_count{action="add-trajectory",phase="total"}' in metrics.get_data(
+            as_text=True)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
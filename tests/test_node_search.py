@@ -0,0 +1,38 @@
+"""Test the server-side search of the node picker."""
+
+import pytest
+
+
+class TestNodeSearchIndex:
+    """Test prefix and substring search over node names."""
+
+    def test_search_orders_exact_prefix_and_substring_matches(self):
+        from visualization.node_search import NodeSearchIndex
+
+        nodes = {"apple": "apple", "pineapple": "pineapple", "applesauce": "applesauce", "banana": "banana"}
+        index = NodeSearchIndex(["fruit"], nodes, limit=10)
+
+        assert index.search("APPLE") == ["apple", "applesauce", "pineapple"]
+        assert index.search("nan") == ["banana"]
+        assert index.search("fru") == ["fruit"]
+        assert index.search("cherry") == []
+        assert len(index.search("a", limit=2)) == 2
+
+    def test_search_options_keep_selected_values(self):
+        from visualization.node_search import NodeSearchIndex
+
+        index = NodeSearchIndex([0, 1], {f"node{i}": f"node{i} (0)" for i in range(1000)}, limit=5)
+
+        assert len(index.get_initial_options()) == 2 + 5
+
+        options = index.get_search_options("node99", ["node3"])
+        values = [option["value"] for option in options]
+        assert values[0] == "node3"
+        assert values[1:] == ["node99", "node990", "node991", "node992", "node993"]
+
+        # Unknown values are skipped
+        assert index.get_options(["missing"]) == []
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,69 @@
+"""Test the compact responses of the Dash apps."""
+
+import base64
+
+import numpy as np
+import pytest
+
+
+def decode(encoded):
+    return np.frombuffer(base64.b64decode(encoded["bdata"]), dtype=np.dtype(encoded["dtype"]).newbyteorder('<'))
+
+
+class TestEncodeTrace:
+    """Test encoding numeric per-point fields as typed arrays."""
+
+    def test_encode_numbers(self):
+        from visualization.payload import encode_numbers
+
+        encoded = encode_numbers(np.array([0.123456, -1.5, np.nan]))
+        assert encoded["dtype"] == "f4"
+        assert np.allclose(decode(encoded), [0.123456, -1.5, np.nan], equal_nan=True)
+
+        assert np.allclose(decode(encode_numbers([0.123456, 2], decimals=2)), [0.12, 2.])
+        assert encode_numbers(np.arange(3))["dtype"] == "i4"
+
+        # Values that are not all numbers are kept
+        assert encode_numbers(["a", "b"]) == ["a", "b"]
+        assert encode_numbers([1., None]) == [1., None]
+        assert encode_numbers([True, False]) == [True, False]
+        assert encode_numbers(None) is None
+
+    def test_encode_trace(self):
+        from visualization.payload import encode_trace
+
+        trace = {"x": [0., 1.], "y": np.array([2., 3.]), "hovertext": np.array(["a", "b"], dtype=object),
+                 "customdata": [[0, "a"], [1, "b"]], "mode": "markers"}
+        encoded = encode_trace(trace)
+
+        assert np.array_equal(decode(encoded["x"]), [0., 1.]) and np.array_equal(decode(encoded["y"]), [2., 3.])
+        assert encoded["hovertext"] == ["a", "b"] and isinstance(encoded["hovertext"], list)
+        assert encoded["customdata"] == [[0, "a"], [1, "b"]]
+        assert encoded["mode"] == "markers"
+
+        # The trace itself is not modified
+        assert trace["x"] == [0., 1.]
+
+
+class TestCompression:
+    """Test compressing the responses of a Dash app."""
+
+    def test_enable_compression(self):
+        pytest.importorskip("flask_compress")
+        import flask
+
+        from visualization.payload import enable_compression
+
+        server = flask.Flask(__name__)
+
+        @server.route("/figure")
+        def get_figure():
+            return flask.jsonify(x=list(range(1000)))
+
+        assert enable_compression(server, ["gzip"])
+        response = server.test_client().get("/figure", headers={"Accept-Encoding": "gzip"})
+        assert response.headers.get("Content-Encoding") == "gzip"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
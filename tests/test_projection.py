@@ -0,0 +1,98 @@
+"""Test projecting temporal node embeddings onto the anchor coordinates."""
+
+import numpy as np
+import pytest
+
+
+def get_drifting_embeddings(num_snapshots=10, num_nodes=500, embed_dim=16, step=0.003, seed=0):
+    """Node embeddings that drift slowly between consecutive snapshots."""
+    rng = np.random.default_rng(seed)
+    z = [rng.normal(size=(num_nodes, embed_dim)).astype(np.float32)]
+    for _ in range(num_snapshots - 1):
+        z += [z[-1] + step * rng.normal(size=(num_nodes, embed_dim)).astype(np.float32)]
+    return np.stack(z), rng.normal(size=(num_nodes, 2))
+
+
+class TestProjection:
+    """Test k-NN projection."""
+
+    def test_coherent_projection_matches_full_search(self):
+        from visualization.projection import CoherentKNNProjector, knn_project
+
+        z, embedding_train = get_drifting_embeddings()
+        idx_projected_nodes = np.arange(20)
+        idx_self_reference = idx_projected_nodes.copy()
+        idx_self_reference[::4] = -1
+
+        projector = CoherentKNNProjector(embedding_train, idx_self_reference, nn=5, interpolation=0.2,
+                                         threshold=0.5, expansion=10)
+
+        for z_snapshot in z:
+            expected = knn_project(z_snapshot[idx_projected_nodes], z_snapshot, embedding_train, idx_self_reference,
+                                   5, 0.2)
+            actual = projector.project(z_snapshot[idx_projected_nodes], z_snapshot)
+            np.testing.assert_allclose(actual, expected, rtol=1e-5, atol=1e-5)
+
+        assert projector.hit_rate > 0.5
+        assert projector.error_bound >= 0.
+
+    def test_coherent_projection_falls_back_to_full_search(self):
+        from visualization.projection import CoherentKNNProjector
+
+        z, embedding_train = get_drifting_embeddings(step=1.)
+        projector = CoherentKNNProjector(embedding_train, np.arange(20), nn=5, interpolation=0.2, threshold=0.1)
+
+        for z_snapshot in z:
+            projector.project(z_snapshot[:20], z_snapshot)
+
+        assert projector.num_reused == 0
+        assert projector.error_bound == 0.
+
+    def test_neighbor_index_matches_knn_projection(self):
+        from visualization.projection import NeighborIndex, knn_project, knn_search
+
+        z, embedding_train = get_drifting_embeddings(num_snapshots=3)
+        idx_self_reference = np.arange(20)
+        idx_self_reference[::4] = -1
+
+        neighbors = np.stack([knn_search(z_snapshot[:20], z_snapshot, idx_self_reference, 10) for z_snapshot in z])
+        index = NeighborIndex(neighbors, embedding_train[idx_self_reference], embedding_train)
+
+        for nn, interpolation in [(1, 0.), (4, 0.2), (10, 1.)]:
+            expected = np.stack([knn_project(z_snapshot[:20], z_snapshot, embedding_train, idx_self_reference, nn,
+                                             interpolation) for z_snapshot in z])
+            np.testing.assert_allclose(index.get_coords(nn, interpolation), expected, rtol=1e-4, atol=1e-4)
+
+        with pytest.raises(ValueError):
+            index.get_coords(11, 0.2)
+
+    def test_mlp_projection(self):
+        from visualization.projection import MLPProjector
+
+        z, _ = get_drifting_embeddings()
+        embedding_train = z[-1, :, :2]
+        idx_self_reference = np.arange(20)
+
+        projector = MLPProjector(embedding_train, idx_self_reference, interpolation=0.2).fit(z[-1], epochs=5)
+        coords = projector.project(z[:, :20])
+
+        assert coords.shape == (len(z), 20, 2)
+        np.testing.assert_allclose(coords[3], projector.project(z[3, :20]), rtol=1e-5, atol=1e-5)
+
+    def test_engines_have_separate_caches(self):
+        from utils.utils_misc import get_visualization_name
+
+        name_knn = get_visualization_name("D", "M", "tsne", 10, 4, 0.2, 5)
+        assert name_knn == "D_M_tsne_perplex10_nn4_interpolation0.2_snapshot5"
+        assert get_visualization_name("D", "M", "tsne", 10, 4, 0.2, 5, "mlp") != name_knn
+
+    def test_neighborhood_preservation(self):
+        from visualization.projection import neighborhood_preservation
+
+        coords = np.random.default_rng(0).normal(size=(50, 2))
+        assert neighborhood_preservation(coords, coords, k=5) == pytest.approx(1.)
+        assert neighborhood_preservation(coords, coords * 2 + 1, k=5) == pytest.approx(1.)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
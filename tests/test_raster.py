@@ -0,0 +1,61 @@
+"""Test the raster background of the Dash apps."""
+
+import numpy as np
+import pytest
+
+
+class TestBackgroundRaster:
+    """Test binning, viewport snapping and the image cache."""
+
+    def test_rasterize_counts_every_node(self):
+        from visualization.raster import BackgroundRaster
+
+        x, y = np.random.rand(2, 1000)
+        raster = BackgroundRaster(x, y, width=64, height=32)
+        counts = raster.rasterize(raster.x_range, raster.y_range)
+
+        assert counts.shape == (32, 64)
+        assert counts.sum() == 1000
+
+        # Row 0 is the top of the image
+        raster = BackgroundRaster([0., 1.], [0., 1.], width=4, height=4)
+        counts = raster.rasterize(raster.x_range, raster.y_range)
+        assert counts[0, -1] == 1 and counts[-1, 0] == 1
+
+    def test_cache_reuses_nearby_viewports(self):
+        from visualization.raster import BackgroundRaster
+
+        # A fixed extent, so that the grid that viewports are snapped to does not depend on the random nodes
+        x, y = np.random.uniform(-4., 4., (2, 1000))
+        x[:2] = y[:2] = [-4., 4.]
+        raster = BackgroundRaster(x, y, width=32, height=32, max_cache_size=2)
+
+        image = raster.render()
+        assert image["source"].startswith("data:image/png;base64,")
+        assert raster.render() is image
+
+        # A small pan at the same zoom level snaps to the same viewport
+        raster.render((-1., 1.), (-1., 1.))
+        raster.render((-0.99, 1.01), (-1., 1.))
+        assert (raster.hits, raster.misses) == (2, 2)
+
+        # The least recently used image is evicted
+        raster.render((-0.1, 0.1), (-0.1, 0.1))
+        assert raster.render() is not image
+
+    def test_render_relayout(self):
+        from visualization.raster import BackgroundRaster
+
+        raster = BackgroundRaster(*np.random.randn(2, 100), width=16, height=16)
+
+        assert raster.render_relayout(None) is None
+        assert raster.render_relayout({"dragmode": "pan"}) is None
+        assert raster.render_relayout({"xaxis.autorange": True}) is raster.render()
+
+        image = raster.render_relayout({"xaxis.range[0]": -1, "xaxis.range[1]": 1, "yaxis.range[0]": -1,
+                                        "yaxis.range[1]": 1})
+        assert image["x"] <= -1 and image["x"] + image["sizex"] >= 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,72 @@
+"""Test the server-side view state of Dash sessions."""
+
+import pytest
+
+
+class TestSessionStore:
+    """Test that sessions are independent and bounded."""
+
+    def test_sessions_are_independent(self):
+        from visualization.session_state import SessionStore
+
+        sessions = SessionStore()
+        id_a, id_b = sessions.new_session_id(), sessions.new_session_id()
+        assert id_a != id_b
+
+        state_a, state_b = sessions.create(id_a), sessions.create(id_b)
+        state_a.reset(["background"])
+        assert state_a.toggle_label(3)
+        state_a.node2color["a"] = "#000000"
+
+        assert sessions.get(id_a) is state_a
+        assert state_b.toggled_labels == set() and state_b.node2color == {}
+
+        assert not state_a.toggle_label(3)
+        assert state_a.toggled_labels == set()
+        assert sessions.get("unknown") is None
+
+    def test_least_recently_used_session_is_evicted(self):
+        from visualization.session_state import SessionStore
+
+        sessions = SessionStore(max_sessions=2)
+        for session_id in ["a", "b"]:
+            sessions.create(session_id)
+
+        sessions.get("a")
+        sessions.create("c")
+
+        assert len(sessions) == 2
+        assert sessions.get("b") is None
+        assert sessions.get("a") is not None and sessions.get("c") is not None
+
+    def test_processes_share_sessions(self, tmp_path):
+        pytest.importorskip("diskcache")
+        np = pytest.importorskip("numpy")
+
+        from visualization.session_state import SessionStore
+
+        # Two stores on the same directory, like two worker processes of a WSGI server
+        sessions_a, sessions_b = SessionStore(cache_dir=str(tmp_path)), SessionStore(cache_dir=str(tmp_path))
+        state = sessions_a.create("a")
+        with state.lock:
+            state.reset(["background"])
+            state.toggle_label(3)
+            state.background_indices = np.arange(5)
+
+        state_b = sessions_b.get("a")
+        assert state_b.figure_traces == ["background"] and state_b.toggled_labels == {3}
+        np.testing.assert_array_equal(state_b.background_indices, np.arange(5))
+
+        with state_b.lock:
+            state_b.node2color["x"] = "#000000"
+
+        # The state is reloaded when the lock is acquired
+        with state.lock:
+            assert state.node2color == {"x": "#000000"}
+
+        assert len(sessions_a) == 1
+        assert sessions_b.get("unknown") is None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,87 @@
+"""Test the zoom-adaptive simplification of trajectories."""
+
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+
+class TestTrajectorySimplification:
+    """Test the Douglas-Peucker hierarchy and viewport-dependent selection."""
+
+    def test_importance(self):
+        from visualization.simplification import douglas_peucker_importance
+
+        # A straight line with one corner
+        x = np.array([0., 1., 2., 3., 3., 3.])
+        y = np.array([0., 0., 0., 0., 1., 2.])
+        importance = douglas_peucker_importance(x, y, keep=[1])
+
+        assert np.isinf(importance[[0, 1, 5]]).all()
+        assert importance[3] > 0
+        assert importance[2] == 0 and importance[4] == 0
+
+    def test_hierarchy_is_nested(self):
+        from visualization.simplification import douglas_peucker_importance
+
+        x, y = np.cumsum(np.random.randn(2, 500), axis=1)
+        importance = douglas_peucker_importance(x, y)
+
+        # Lower tolerances only add points
+        previous = set()
+        for tolerance in [10., 1., 0.1, 0.]:
+            selected = set(np.nonzero(importance >= tolerance)[0])
+            assert previous <= selected
+            previous = selected
+
+        assert len(previous) == 500
+
+    def test_zooming_in_reveals_points(self):
+        from visualization.simplification import TrajectorySimplifier
+
+        x, y = np.cumsum(np.random.randn(2, 522), axis=1)
+        simplifier = TrajectorySimplifier(pixel_tolerance=1., plot_width=100, plot_height=100)
+        full_range = (min(x.min(), y.min()), max(x.max(), y.max()))
+
+        indices = simplifier.select("a", x, y, full_range, full_range, keep=[200])
+        assert indices[0] == 0 and indices[-1] == 521 and 200 in indices
+        assert len(indices) < 522
+
+        zoomed_range = (full_range[0] / 100, full_range[1] / 100)
+        assert len(simplifier.select("a", x, y, zoomed_range, zoomed_range, keep=[200])) > len(indices)
+
+    def test_cache_is_thread_safe(self):
+        from visualization.simplification import TrajectorySimplifier
+
+        # A small cache, so that lookups, inserts and evictions of the threads interleave
+        simplifier = TrajectorySimplifier(max_cache_size=2)
+        x, y = np.cumsum(np.random.randn(2, 3), axis=1)
+        errors = []
+
+        def run(idx_thread):
+            try:
+                for idx in range(2000):
+                    key = (idx_thread + idx) % 3
+                    assert len(simplifier.get_importance(key, x, y)) == 3
+            except Exception as error:
+                errors.append(error)
+
+        # Switch threads as often as possible
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=run, args=(idx_thread,)) for idx_thread in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+        assert not errors
+        assert len(simplifier._cache) <= 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
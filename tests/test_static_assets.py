@@ -0,0 +1,69 @@
+"""Test serving data that is identical for every user as content-hashed static files."""
+
+import json
+
+import numpy as np
+import pytest
+
+
+class TestStaticAssets:
+    """Test publishing and serving static files."""
+
+    def test_publish(self):
+        from visualization.static_assets import StaticAssets
+
+        assets = StaticAssets()
+        url = assets.publish("background", {"data": [{"x": np.arange(3)}]})
+        assert url.startswith("/_dygetviz/static/background-") and url.endswith(".json")
+
+        # The URL only depends on the content
+        assert assets.publish("background", {"data": [{"x": [0, 1, 2]}]}) == url
+        assert assets.publish("background", {"data": [{"x": [0, 1]}]}) != url
+
+    def test_get_placeholders(self):
+        from visualization.static_assets import get_placeholders
+
+        traces = [{"type": "scattergl", "name": "background", "mode": "markers", "x": [0., 1.], "y": [0., 1.]}]
+        assert get_placeholders(traces) == [{"type": "scattergl", "name": "background", "mode": "markers"}]
+
+    def test_install(self):
+        flask = pytest.importorskip("flask")
+
+        from visualization.static_assets import StaticAssets
+
+        server = flask.Flask(__name__)
+        assets = StaticAssets()
+        assets.install(server)
+        url = assets.publish("background", {"data": [{"x": [0., 1.]}]})
+
+        client = server.test_client()
+        response = client.get(url)
+        assert response.status_code == 200
+        assert json.loads(response.data) == {"data": [{"x": [0., 1.]}]}
+        assert "immutable" in response.headers["Cache-Control"]
+
+        # A revalidation transfers nothing
+        revalidation = client.get(url, headers={"If-None-Match": response.headers["ETag"]})
+        assert revalidation.status_code == 304
+        assert not revalidation.data
+
+        assert client.get("/_dygetviz/static/background-0.json").status_code == 404
+
+    def test_install_under_prefix(self):
+        dash = pytest.importorskip("dash")
+
+        from visualization.static_assets import StaticAssets
+
+        app = dash.Dash(__name__, url_base_pathname="/viz/")
+        app.layout = dash.html.Div()
+        assets = StaticAssets()
+        assets.install(app.server, app.config.routes_pathname_prefix)
+
+        # The URL that the browser requests is the one that is served
+        url = app.get_relative_path(assets.publish("background", {"data": []}))
+        assert url.startswith("/viz/_dygetviz/static/")
+        assert app.server.test_client().get(url).status_code == 200
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
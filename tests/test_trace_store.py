@@ -0,0 +1,76 @@
+"""Test the indexed per-node trace store."""
+
+import pytest
+
+
+def get_cached_figure():
+    """A cached figure with one background trace and two trajectories over three snapshots."""
+    frames = [{
+        "name": str(t),
+        "data": [{"type": "scatter", "name": "background", "x": [0., 1.], "y": [0., 1.]}] + [{
+            "type": "scatter", "name": f"{node} (0)", "x": list(range(t + 1)), "y": list(range(t + 1)),
+            "visible": "legendonly",
+        } for node in ["a", "b"]],
+    } for t in range(3)]
+
+    return {"data": frames[0]["data"], "frames": frames, "layout": {}}
+
+
+class TestTraceStore:
+    """Test writing a trace store from a cached figure and reading single traces."""
+
+    def test_write_and_read(self, tmp_path):
+        from visualization.trace_store import TraceStore, write_trace_store_from_figure
+
+        path = str(tmp_path / "Traces_test.bin")
+        fig = get_cached_figure()
+        fig["data"][0]["x"] = {"dtype": "f8", "bdata": "AAAAAAAAAAAAAAAAAADwPw=="}
+
+        write_trace_store_from_figure(path, fig, num_background_traces=1)
+        store = TraceStore(path)
+
+        assert list(store.layers) == ["background"]
+        assert store.nodes == ["a", "b"]
+        assert len(store) == 3 and "a" in store and "c" not in store
+
+        # Typed arrays are decoded, and trajectories cover all snapshots
+        assert list(store["background"].x) == [0., 1.]
+        assert store.read("b")["x"] == [0, 1, 2]
+
+        # Background layers persist across accesses, trajectories are fresh copies
+        assert store["background"] is store["background"]
+        assert "visible" not in store.read("a")
+        store["a"].name = "modified"
+        assert store["a"].name == "a (0)"
+
+        with pytest.raises(KeyError):
+            store["c"]
+
+        store.close()
+
+    def test_trace_templates(self, tmp_path):
+        from visualization.trace_store import TraceStore, TraceTemplates, make_trace_template, \
+            write_trace_store
+
+        path = str(tmp_path / "Traces_test.bin")
+        write_trace_store(path, {"background": {"type": "scattergl", "x": [0.], "y": [0.], "mode": "markers+text",
+                                                "text": [""], "marker": {"size": 3, "color": "red"}}},
+                          {"a": {"type": "scattergl", "name": "a (0)", "x": [0., 1.], "y": [0., 1.],
+                                 "line": {"color": "blue", "width": 1}, "visible": "legendonly"}})
+        store = TraceStore(path)
+
+        # Unlabeled backgrounds only draw markers. The style overrides the stored one
+        background = make_trace_template(store.read("background"), marker=dict(size=8))
+        assert background["type"] == "scatter" and background["mode"] == "markers"
+        assert background["marker"] == {"size": 8}
+
+        templates = TraceTemplates(store, line=dict(width=3))
+        assert templates["a"] is templates["a"]
+        assert templates["a"]["line"] == {"color": "blue", "width": 3}
+        assert "visible" not in templates["a"]
+
+        store.close()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
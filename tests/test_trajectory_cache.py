@@ -0,0 +1,95 @@
+"""Test incremental updates of the trajectory visualization cache."""
+
+import numpy as np
+import pytest
+
+
+def get_cached_figure(num_snapshots):
+    """A cached figure with one background trace and two trajectories, as written by `plot_dtdg`."""
+    frames = []
+    for t in range(num_snapshots):
+        frames += [{
+            "name": str(t),
+            "data": [{"type": "scatter", "name": "background", "x": [0., 1.], "y": [0., 1.]}] + [{
+                "type": "scatter", "name": node, "x": list(range(t + 1)), "y": list(range(t + 1)),
+                "text": [""] * (t + 1), "hovertext": [f"Node: {node} | Snapshot: {i}" for i in range(t + 1)],
+            } for node in ["a", "b"]],
+        }]
+
+    layout = {"sliders": [{"steps": [{"args": [[str(t)], {}], "label": str(t), "method": "animate"}
+                                     for t in range(num_snapshots)]}]}
+    return {"data": frames[0]["data"], "frames": frames, "layout": layout}
+
+
+class TestTrajectoryCache:
+    """Test appending snapshots to a cached figure."""
+
+    manifest = {"num_background_traces": 1, "projected_nodes": ["a", "b"], "trajectory_nodes": ["a", "b"],
+                "snapshot_names": ["0", "1", "2"]}
+
+    def test_get_new_snapshot_indices(self):
+        from visualization.trajectory_cache import get_new_snapshot_indices
+
+        assert get_new_snapshot_indices(self.manifest, ["0", "1", "2", "3", "4"]).tolist() == [3, 4]
+        assert get_new_snapshot_indices(self.manifest, ["0", "1", "2"]).tolist() == []
+
+        with pytest.raises(ValueError):
+            get_new_snapshot_indices(self.manifest, ["0", "2", "1", "3"])
+
+    def test_append_snapshots_to_figure(self):
+        from visualization.trajectory_cache import append_snapshots_to_figure
+
+        fig = get_cached_figure(3)
+        coords = np.random.rand(5, 2, 2)
+        node_presence = np.ones((5, 2), dtype=bool)
+        node_presence[3, 1] = False
+
+        fig = append_snapshots_to_figure(fig, self.manifest, coords, node_presence, [str(t) for t in range(5)],
+                                         [3, 4])
+
+        assert [frame["name"] for frame in fig["frames"]] == ["0", "1", "2", "3", "4"]
+        assert len(fig["layout"]["sliders"][0]["steps"]) == 5
+
+        trace_a, trace_b = fig["frames"][-1]["data"][1:]
+        assert trace_a["x"][3:] == coords[3:, 0, 0].tolist()
+        assert trace_b["x"][3:] == [coords[4, 1, 0]]
+        assert trace_a["hovertext"][-1] == "Node: a | Snapshot: 4"
+
+        # Cached frames are untouched
+        assert fig["frames"][2]["data"][1]["x"] == [0, 1, 2]
+
+    def test_appended_labels_are_thinned_like_cached_ones(self):
+        from visualization.trajectory_cache import append_snapshots_to_figure
+
+        # The cache was built with 3 snapshots, in which every point is labeled
+        manifest = {**self.manifest, "num_labeled_snapshots": 3}
+        fig = append_snapshots_to_figure(get_cached_figure(3), manifest, np.random.rand(12, 2, 2),
+                                         np.ones((12, 2), dtype=bool), [str(t) for t in range(12)], range(3, 12))
+
+        assert fig["frames"][-1]["data"][1]["text"][3:] == [f"a ({t})" for t in range(3, 12)]
+
+    def test_find_cache_manifest(self, tmp_path):
+        from visualization.trajectory_cache import find_cache_manifest, get_cache_paths, save_cache_manifest
+
+        def save_cache(name, idx_reference_snapshot):
+            for path in [get_cache_paths(str(tmp_path), name)[field] for field in ["figure", "anchors", "coords"]]:
+                open(path, 'w').close()
+            np.savez(get_cache_paths(str(tmp_path), name)["neighbors"])
+            save_cache_manifest(str(tmp_path), name,
+                                {**self.manifest, "idx_reference_snapshot": idx_reference_snapshot})
+
+        # The default reference snapshot moved from 2 to 4 with two new snapshots
+        save_cache("D_M_tsne_perplex10_nn4_interpolation0.2_snapshot2", 2)
+        name, manifest = find_cache_manifest(str(tmp_path), "D_M_tsne_perplex10_nn4_interpolation0.2_snapshot4")
+        assert name == "D_M_tsne_perplex10_nn4_interpolation0.2_snapshot2"
+        assert manifest["idx_reference_snapshot"] == 2
+
+        assert find_cache_manifest(str(tmp_path), "D_M_tsne_perplex10_nn5_interpolation0.2_snapshot4")[1] is None
+
+        save_cache("D_M_tsne_perplex10_nn4_interpolation0.2_snapshot3", 3)
+        with pytest.raises(ValueError):
+            find_cache_manifest(str(tmp_path), "D_M_tsne_perplex10_nn4_interpolation0.2_snapshot4")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,57 @@
+"""Test the health checks and the warm-up of the Dash app."""
+
+import pytest
+
+
+def get_warm_up():
+    from visualization.metrics import StartupTimer
+    from visualization.warmup import WarmUp
+
+    startup = StartupTimer("Synth")
+    startup.stage("app", "Start the app ...")
+    startup.stage("load_data", "Loading data ...")
+    return startup, WarmUp(startup, ["app", "load_data", "cache_read", "layout"])
+
+
+class TestWarmUp:
+    """Test the responses while warming up and once ready."""
+
+    def test_warming_up(self):
+        werkzeug_test = pytest.importorskip("werkzeug.test")
+
+        startup, warm_up = get_warm_up()
+        client = werkzeug_test.Client(warm_up)
+
+        assert client.get("/healthz").status_code == 200
+
+        readiness = client.get("/readyz")
+        assert readiness.status_code == 503
+        assert readiness.json["progress"] == 0.25 and readiness.json["message"] == "Loading data ..."
+
+        # Pages show the progress, and requests of the app are retried later
+        page = client.get("/", headers={"Accept": "text/html"})
+        assert page.status_code == 503 and b"warming up" in page.data and b"Loading data" in page.data
+
+        callback = client.post("/_dash-update-component", json={})
+        assert callback.status_code == 503 and callback.headers["Retry-After"]
+
+    def test_ready(self):
+        flask = pytest.importorskip("flask")
+        werkzeug_test = pytest.importorskip("werkzeug.test")
+
+        startup, warm_up = get_warm_up()
+        server = flask.Flask(__name__)
+        server.route("/")(lambda: "app")
+        warm_up.install(server)
+
+        startup.finish()
+        warm_up.set_ready(server)
+
+        client = werkzeug_test.Client(warm_up)
+        assert client.get("/").data == b"app"
+        readiness = client.get("/readyz")
+        assert readiness.status_code == 200 and readiness.json["ready"] and readiness.json["progress"] == 1.
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])